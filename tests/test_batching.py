@@ -0,0 +1,106 @@
+from upscaler.batching import BatchController, Bucket, aligned_size, plan_buckets
+
+
+def _run(controller, key, n, times, ceiling=16):
+    for _ in range(times):
+        controller.success(key, n, ceiling)
+
+
+def test_grows_by_doubling_up_to_the_ceiling():
+    c = BatchController(grow_after=2)
+    sizes = [c.size("k", 2, 16)]
+    for _ in range(4):
+        _run(c, "k", sizes[-1], 2)
+        sizes.append(c.size("k", 2, 16))
+    assert sizes == [2, 4, 8, 16, 16]
+
+
+def test_oom_falls_back_to_the_largest_size_that_fit_then_grows_linearly():
+    c = BatchController(grow_after=2)
+    c.size("k", 4, 16)
+    _run(c, "k", 4, 2)
+    assert c.size("k", 4, 16) == 8
+    assert c.oom("k", 8) == 4
+    sizes = []
+    for _ in range(5):
+        n = c.size("k", 4, 16)
+        _run(c, "k", n, 2)
+        sizes.append(c.size("k", 4, 16))
+    # One frame at a time, never back to the size that failed.
+    assert sizes == [5, 6, 7, 7, 7]
+
+
+def test_oom_without_a_good_size_halves():
+    c = BatchController()
+    c.size("k", 8, 16)
+    assert c.oom("k", 8) == 4
+    assert c.oom("k", 4) == 2
+
+
+def test_oom_at_the_good_size_forgets_it():
+    c = BatchController(grow_after=2)
+    c.size("k", 4, 16)
+    _run(c, "k", 4, 1)
+    # 4 fit before; now it does not, so the retry must go below it.
+    assert c.oom("k", 4) == 2
+
+
+def test_short_tail_batch_does_not_grow():
+    c = BatchController(grow_after=2)
+    c.size("k", 4, 16)
+    _run(c, "k", 3, 5)
+    assert c.size("k", 4, 16) == 4
+
+
+def test_limit_is_retried_after_a_run_of_successes():
+    c = BatchController(grow_after=2, retry_limit_after=3)
+    c.size("k", 8, 16)
+    c.oom("k", 8)
+    assert c.size("k", 8, 16) == 4
+    _run(c, "k", 4, 2)
+    _run(c, "k", 5, 2)
+    _run(c, "k", 6, 2)
+    assert c.size("k", 8, 16) == 7
+    _run(c, "k", 7, 3)  # limit 8 -> 9
+    assert c.size("k", 8, 16) == 7
+    _run(c, "k", 7, 2)
+    assert c.size("k", 8, 16) == 8
+
+
+def test_keys_are_independent():
+    c = BatchController(grow_after=1)
+    c.size("a", 2, 16)
+    c.size("b", 2, 16)
+    c.success("a", 2, 16)
+    assert c.snapshot() == {"a": 4, "b": 2}
+
+
+def test_aligned_size_rounds_up():
+    assert aligned_size(41, 31, 2) == (42, 32)
+    assert aligned_size(41, 31, 4) == (44, 32)
+    assert aligned_size(40, 32, 4) == (40, 32)
+
+
+def test_buckets_keep_equal_sizes_only_without_max_pad():
+    buckets = plan_buckets([(64, 64), (32, 32), (64, 64)], batch_size=4)
+    assert buckets == [Bucket((64, 64), [0, 2]), Bucket((32, 32), [1])]
+
+
+def test_small_size_joins_a_larger_bucket_within_max_pad():
+    sizes = [(100, 100)] * 3 + [(96, 96)]
+    assert plan_buckets(sizes, batch_size=4, max_pad=0.15) == [Bucket((100, 100), [0, 1, 2, 3])]
+    # 96x96 pads away 7.8% of a 100x100 bucket: over a 5% budget it stays apart.
+    assert plan_buckets(sizes, batch_size=4, max_pad=0.05) == [
+        Bucket((100, 100), [0, 1, 2]), Bucket((96, 96), [3]),
+    ]
+
+
+def test_size_that_fills_a_batch_stays_exact():
+    sizes = [(96, 96)] * 4 + [(100, 100)]
+    assert plan_buckets(sizes, batch_size=4, max_pad=0.15) == [
+        Bucket((96, 96), [0, 1, 2, 3]), Bucket((100, 100), [4]),
+    ]
+
+
+def test_buckets_are_aligned_to_the_multiple():
+    assert plan_buckets([(41, 31), (42, 32)], batch_size=4, multiple=2) == [Bucket((42, 32), [0, 1])]
@@ -0,0 +1,29 @@
+from typer.testing import CliRunner
+
+from upscaler.cli import app
+
+runner = CliRunner()
+
+
+def test_input_without_subcommand_runs_the_run_command():
+    result = runner.invoke(app, ["input.mp4", "--help"])
+    assert result.exit_code == 0
+    assert "--chunk-frames" in result.output
+
+
+def test_options_before_input_also_go_to_run():
+    result = runner.invoke(app, ["-o", "out.mp4", "--help"])
+    assert result.exit_code == 0
+    assert "--chunk-frames" in result.output
+
+
+def test_subcommands_are_still_dispatched():
+    result = runner.invoke(app, ["cache", "--help"])
+    assert result.exit_code == 0
+    assert "prune" in result.output
+
+
+def test_group_help_lists_the_commands():
+    result = runner.invoke(app, ["--help"])
+    assert result.exit_code == 0
+    assert "run" in result.output and "segments" in result.output
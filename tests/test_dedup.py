@@ -0,0 +1,63 @@
+import pytest
+
+from upscaler.dedup import fill_duplicates, link_frames, plan_dedup
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _frames(tmp_path, colors):
+    src = tmp_path / "in"
+    src.mkdir()
+    frames = []
+    for i, color in enumerate(colors):
+        f = src / f"frame_{i + 1:06d}.png"
+        Image.new("RGB", (32, 18), color).save(f)
+        frames.append(f)
+    return frames
+
+
+def test_exact_duplicates_point_at_the_first_copy(tmp_path):
+    frames = _frames(tmp_path, ["red", "red", "blue", "red", "blue"])
+    plan = plan_dedup(frames)
+    assert plan.unique == [frames[0], frames[2]]
+    assert plan.duplicates == {frames[1]: frames[0], frames[3]: frames[0], frames[4]: frames[2]}
+    assert plan.skipped == 3
+
+
+def test_near_duplicates_need_a_tolerance(tmp_path):
+    frames = _frames(tmp_path, [(100, 100, 100), (102, 100, 100), (200, 50, 50)])
+    assert plan_dedup(frames).skipped == 0
+    plan = plan_dedup(frames, tolerance=0.01)
+    assert plan.unique == [frames[0], frames[2]]
+    assert plan.duplicates == {frames[1]: frames[0]}
+
+
+def test_no_frames(tmp_path):
+    plan = plan_dedup([])
+    assert plan.unique == [] and plan.skipped == 0
+
+
+def test_link_frames_and_fill_duplicates(tmp_path):
+    frames = _frames(tmp_path, ["red", "red", "blue", "red"])
+    plan = plan_dedup(frames)
+    unique_dir = tmp_path / "unique"
+    link_frames(plan.unique, unique_dir)
+    assert sorted(p.name for p in unique_dir.iterdir()) == [frames[0].name, frames[2].name]
+
+    out = tmp_path / "out"
+    out.mkdir()
+    for f in plan.unique:
+        (out / f"{f.stem}.webp").write_bytes(f.stem.encode())
+    assert fill_duplicates(plan, out, suffix=".webp") == 2
+    assert (out / f"{frames[1].stem}.webp").read_bytes() == frames[0].stem.encode()
+    assert (out / f"{frames[3].stem}.webp").read_bytes() == frames[0].stem.encode()
+    # Already filled: nothing to do.
+    assert fill_duplicates(plan, out, suffix=".webp") == 0
+
+
+def test_fill_duplicates_needs_the_source_output(tmp_path):
+    frames = _frames(tmp_path, ["red", "red"])
+    out = tmp_path / "out"
+    out.mkdir()
+    with pytest.raises(RuntimeError, match="source frame missing"):
+        fill_duplicates(plan_dedup(frames), out)
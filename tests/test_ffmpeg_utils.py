@@ -0,0 +1,33 @@
+import shutil
+import subprocess
+
+import pytest
+
+from upscaler.ffmpeg_utils import open_rawvideo_writer
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+
+
+def _count_frames(path):
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-count_frames", "-select_streams", "v:0",
+         "-show_entries", "stream=nb_read_frames", "-of", "csv=p=0", str(path)],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return int(out.strip())
+
+
+def test_rawvideo_writer_keeps_every_frame_with_audio(tmp_path):
+    audio = tmp_path / "audio.m4a"
+    subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+         "-t", "1", "-c:a", "aac", str(audio)],
+        check=True,
+    )
+    out = tmp_path / "out.mp4"
+    writer = open_rawvideo_writer(out, 32, 24, 10.0, audio_source=audio, duration=1.0)
+    for k in range(10):
+        writer.stdin.write(bytes([k * 20]) * (32 * 24 * 3))
+    writer.stdin.close()
+    assert writer.wait() == 0
+    assert _count_frames(out) == 10
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from upscaler.model_cache import ModelCache
+
+
+def _slow(value, seconds=0.3, calls=None):
+    def load():
+        if calls is not None:
+            calls.append(value)
+        time.sleep(seconds)
+        return value
+    return load
+
+
+def _in_threads(*targets):
+    threads = [threading.Thread(target=t) for t in targets]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_cold_loads_of_different_keys_overlap():
+    cache = ModelCache(max_entries=4)
+    t0 = time.perf_counter()
+    _in_threads(lambda: cache.get("a", _slow("A")), lambda: cache.get("b", _slow("B")))
+    assert time.perf_counter() - t0 < 0.55
+    assert sorted(cache.keys()) == ["a", "b"]
+
+
+def test_hit_does_not_wait_for_a_cold_load():
+    cache = ModelCache(max_entries=4)
+    cache.get("warm", lambda: "W")
+    loading = threading.Thread(target=lambda: cache.get("cold", _slow("C", 0.5)))
+    loading.start()
+    time.sleep(0.05)
+    t0 = time.perf_counter()
+    assert cache.get("warm", _slow("never")) == "W"
+    assert time.perf_counter() - t0 < 0.1
+    loading.join()
+
+
+def test_concurrent_misses_on_one_key_load_once():
+    cache = ModelCache(max_entries=4)
+    calls = []
+    results = []
+    _in_threads(*[lambda: results.append(cache.get("k", _slow("V", 0.2, calls))) for _ in range(4)])
+    assert calls == ["V"]
+    assert results == ["V"] * 4
+    stats = cache.stats()
+    assert (stats.misses, stats.hits) == (1, 3)
+    assert not cache._loading
+
+
+def test_failed_load_lets_the_next_caller_retry():
+    cache = ModelCache(max_entries=4)
+
+    def broken():
+        raise RuntimeError("download failed")
+
+    try:
+        cache.get("k", broken)
+    except RuntimeError:
+        pass
+    assert cache.get("k", lambda: "V") == "V"
+    assert not cache._loading
+
+
+def test_evict_model_maps_the_scale_to_the_models_native_scale(monkeypatch):
+    pytest.importorskip("torch")
+    from upscaler import api, model_cache
+
+    cache = ModelCache()
+    monkeypatch.setattr(model_cache, "MODEL_CACHE", cache)
+    monkeypatch.setattr(api.load_backend("torch"), "MODEL_CACHE", cache)
+    cache.get(("realesrgan-x4plus", 4, "cpu", "float32", "fp32"), lambda: "x4")
+    cache.get(("realesrgan-x2plus", 2, "cpu", "float32", "fp32"), lambda: "x2")
+    # x2 output made with the x4 model: cached under the model's native scale.
+    assert api.evict_model("realesrgan-x4plus", 2) == 1
+    assert cache.keys() == [("realesrgan-x2plus", 2, "cpu", "float32", "fp32")]
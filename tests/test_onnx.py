@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+
+from upscaler.realesrgan_onnx import _OnnxFrameUpscaler
+
+
+class _NearestRunner:
+    """Stands in for the x2 graph: rejects unaligned inputs like RRDBNet's pixel unshuffle."""
+
+    def __init__(self, scale, multiple):
+        self.scale = scale
+        self.multiple = multiple
+        self.shapes = []
+
+    def __call__(self, batch):
+        n, c, h, w = batch.shape
+        if h % self.multiple or w % self.multiple:
+            raise RuntimeError(f"Reshape: {h}x{w} is not a multiple of {self.multiple}")
+        self.shapes.append((h, w))
+        return batch.repeat(self.scale, axis=2).repeat(self.scale, axis=3)
+
+
+def _frame(h, w, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (h, w, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("tile_size", [None, 16])
+def test_odd_sized_frames_are_padded_and_cropped(tile_size):
+    runner = _NearestRunner(2, 2)
+    upscaler = _OnnxFrameUpscaler(runner, 2, batch_size=2, tile_size=tile_size, tile_pad=3)
+    imgs = [_frame(31, 41), _frame(31, 41, 1), _frame(20, 17, 2)]
+    outs = upscaler(imgs)
+    for img, out in zip(imgs, outs):
+        assert out.shape == (img.shape[0] * 2, img.shape[1] * 2, 3)
+        assert np.array_equal(out, img.repeat(2, axis=0).repeat(2, axis=1))
+    assert all(h % 2 == 0 and w % 2 == 0 for h, w in runner.shapes)
@@ -0,0 +1,87 @@
+import pytest
+
+from upscaler import planner
+from upscaler.planner import PlanError, factor_for, output_size, plan_upscale
+
+
+@pytest.fixture
+def ncnn_models(tmp_path, monkeypatch):
+    """Unpacks the given NCNN models into a temporary models dir."""
+    monkeypatch.setattr(planner, "MODELS_DIR", tmp_path)
+
+    def unpack(*names):
+        for name in names:
+            (tmp_path / f"{name}.param").write_text("")
+            (tmp_path / f"{name}.bin").write_text("")
+
+    return unpack
+
+
+@pytest.mark.parametrize("backend", ["torch", "onnx"])
+@pytest.mark.parametrize("scale,model,needs_resize", [
+    (1.5, "realesrgan-x2plus", True),
+    (2, "realesrgan-x2plus", False),
+    (3, "realesrgan-x4plus", True),
+    (4, "realesrgan-x4plus", False),
+])
+def test_torch_and_onnx_pick_the_smallest_model_that_reaches_the_scale(backend, scale, model, needs_resize):
+    plan = plan_upscale("realesrgan-x4plus", scale=scale, backend=backend)
+    assert (plan.model, plan.needs_resize) == (model, needs_resize)
+
+
+def test_requested_model_is_kept_when_it_is_the_cheapest():
+    assert plan_upscale("realesrgan-x2plus", scale=2, backend="torch").model == "realesrgan-x2plus"
+
+
+def test_scale_beyond_the_largest_model_fails():
+    with pytest.raises(PlanError, match="second pass"):
+        plan_upscale("realesrgan-x4plus", scale=8, backend="torch")
+
+
+def test_torch_has_no_anime_weights():
+    with pytest.raises(PlanError, match="no anime model"):
+        plan_upscale("realesrgan-anime-x4", scale=4, backend="torch")
+
+
+def test_ncnn_uses_only_unpacked_models(ncnn_models):
+    ncnn_models("realesrgan-x4plus")
+    assert plan_upscale("realesrgan-x4plus", scale=2).model == "realesrgan-x4plus"
+    ncnn_models("realesrgan-x2plus")
+    assert plan_upscale("realesrgan-x4plus", scale=2).model == "realesrgan-x2plus"
+
+
+def test_ncnn_keeps_a_requested_model_that_is_not_unpacked(ncnn_models):
+    plan = plan_upscale("realesrgan-anime-x4", scale=2)
+    assert (plan.model, plan.model_scale) == ("realesrgan-anime-x4", 4)
+
+
+def test_resample_backends_see_every_model():
+    assert plan_upscale("realesrgan-x4plus", scale=2, backend="lanczos").model == "realesrgan-x2plus"
+
+
+def test_target_height_sets_the_factor_and_output_size():
+    plan = plan_upscale("realesrgan-x4plus", target_height=720, input_size=(640, 360), backend="torch")
+    assert (plan.model, plan.factor, plan.out_size) == ("realesrgan-x2plus", 2.0, (1280, 720))
+    plan = plan_upscale("realesrgan-x4plus", scale=4, target_height=1080, input_size=(640, 360), backend="torch")
+    assert (plan.model, plan.factor, plan.out_size) == ("realesrgan-x4plus", 3.0, (1920, 1080))
+
+
+def test_output_size_even():
+    assert output_size(35, 21, 3) == (105, 63)
+    assert output_size(35, 21, 3, even=True) == (106, 64)
+
+
+@pytest.mark.parametrize("scale,target_height,input_size,message", [
+    (None, None, None, "required"),
+    (0.5, None, None, "downscale"),
+    (None, 720, None, "input size"),
+    (None, 0, (640, 360), "positive"),
+])
+def test_bad_requests(scale, target_height, input_size, message):
+    with pytest.raises(PlanError, match=message):
+        factor_for(scale, target_height, input_size)
+
+
+def test_unknown_model():
+    with pytest.raises(PlanError, match="Unknown model"):
+        plan_upscale("realesrgan-x3", scale=2)
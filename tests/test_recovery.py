@@ -0,0 +1,60 @@
+import pytest
+
+from upscaler.recovery import recover_frames
+
+
+def _frames(tmp_path, n):
+    src = tmp_path / "in"
+    src.mkdir()
+    frames = []
+    for i in range(n):
+        f = src / f"frame_{i + 1:06d}.png"
+        f.write_bytes(b"x")
+        frames.append(f)
+    out = tmp_path / "out"
+    out.mkdir()
+    return frames, out
+
+
+def _aborting_run(out, bad, calls):
+    """Folder run that writes frames in order and gives up at the first bad one."""
+    def run(group_dir, device):
+        calls.append(sorted(p.name for p in group_dir.iterdir()))
+        for frame in sorted(group_dir.iterdir()):
+            if frame.name in bad:
+                raise RuntimeError(f"decode image {frame.name} failed")
+            (out / frame.name).write_bytes(b"y")
+    return run
+
+
+def test_bad_frame_first_in_every_group_is_bisected(tmp_path):
+    frames, out = _frames(tmp_path, 16)
+    bad = {frames[0].name, frames[8].name}  # first frame of both initial halves
+    calls = []
+    report = recover_frames(frames, out, ".png", _aborting_run(out, bad, calls), tmp_path / "work")
+    assert sorted(f.name for f in report.failed) == sorted(bad)
+    assert report.recovered == 14
+    assert report.runs == len(calls)
+
+
+def test_frames_with_output_are_skipped(tmp_path):
+    frames, out = _frames(tmp_path, 8)
+    for f in frames[:6]:
+        (out / f.name).write_bytes(b"y")
+    calls = []
+    report = recover_frames(frames, out, ".png", _aborting_run(out, set(), calls), tmp_path / "work")
+    assert report.frames == 2
+    assert sorted(name for call in calls for name in call) == [frames[6].name, frames[7].name]
+
+
+def test_frame_independent_failure_stops_early(tmp_path):
+    frames, out = _frames(tmp_path, 64)
+    calls = []
+
+    def broken(group_dir, device):
+        calls.append(group_dir)
+        raise RuntimeError("vkCreateInstance failed")
+
+    with pytest.raises(RuntimeError, match="not frame-specific"):
+        recover_frames(frames, out, ".png", broken, tmp_path / "work")
+    assert len(calls) == 6  # two groups and their four halves
@@ -0,0 +1,47 @@
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from upscaler.frame_format import get_frame_format
+from upscaler.rolling import run_rolling
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+
+
+def _clip(path, seconds=2, fps=10):
+    subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc=size=64x48:rate={fps}",
+         "-t", str(seconds), "-pix_fmt", "yuv420p", str(path)],
+        check=True,
+    )
+
+
+def _count_frames(path):
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-count_frames", "-select_streams", "v:0",
+         "-show_entries", "stream=nb_read_frames", "-of", "csv=p=0", str(path)],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return int(out.strip())
+
+
+def _copy_infer(frames, frames_dir, out_dir):
+    for f in frames:
+        shutil.copy2(f, out_dir / f.name)
+    return None
+
+
+def test_relative_output_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _clip(tmp_path / "clip.mp4")
+    work = Path("work")
+    work.mkdir()
+    fmt = get_frame_format("png")
+    stats = run_rolling(
+        Path("clip.mp4"), Path("out") / "clip_x1.mp4", work, 10.0, 8, fmt, fmt.suffix, _copy_infer,
+    )
+    assert stats.chunks == 3
+    assert _count_frames(tmp_path / "out" / "clip_x1.mp4") == 20
+    assert [p.name for p in (tmp_path / "out").iterdir()] == ["clip_x1.mp4"]
@@ -0,0 +1,77 @@
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from upscaler import segments
+from upscaler.segments import _SegmentLock
+
+
+def _stale_lock(path):
+    path.write_text("dead-worker")
+    old = time.time() - segments.LOCK_STALE_SECONDS - 60
+    os.utime(path, (old, old))
+
+
+def test_stale_lock_is_taken_over(tmp_path):
+    path = tmp_path / "seg_00000.lock"
+    _stale_lock(path)
+    lock = _SegmentLock(path)
+    assert lock.acquire()
+    assert lock.held()
+    lock.release()
+    assert not path.exists()
+
+
+def test_fresh_lock_is_not_taken_over(tmp_path):
+    path = tmp_path / "seg_00000.lock"
+    path.write_text("live-worker")
+    assert not _SegmentLock(path).acquire()
+    assert path.read_text() == "live-worker"
+
+
+def test_concurrent_takeover_has_one_winner(tmp_path, monkeypatch):
+    path = tmp_path / "seg_00000.lock"
+    _stale_lock(path)
+    first, second = _SegmentLock(path), _SegmentLock(path)
+    rename = os.rename
+
+    def racing_rename(src, dst):
+        # `first` takes the stale lock over between `second`'s stale check and its rename.
+        monkeypatch.setattr(os, "rename", rename)
+        assert first.acquire()
+        rename(src, dst)
+
+    monkeypatch.setattr(os, "rename", racing_rename)
+    assert not second.acquire()
+    assert first.held()
+    assert not second.held()
+    first.release()
+    assert sorted(os.listdir(tmp_path)) == []
+
+
+def _copy_frames(backend, frames, work_in, frames_out, work_dir, plan, fmt_out, input_size, **options):
+    for f in frames:
+        shutil.copy2(f, frames_out / f"{f.stem}{fmt_out.suffix}")
+    return backend, False
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_relative_work_dir(tmp_path, monkeypatch):
+    from upscaler import api
+
+    monkeypatch.setattr(api, "_infer_frames", _copy_frames)
+    monkeypatch.chdir(tmp_path)
+    subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=64x48:rate=10", "-t", "3",
+         "-g", "10", "-pix_fmt", "yuv420p", "clip.mp4"],
+        check=True,
+    )
+    out = segments.upscale_video_segmented(
+        "clip.mp4", "clip_x2.mp4", "job", segment_seconds=1.0, backend="ncnn", scale=2,
+        model="realesrgan-x2plus", frame_format="png",
+    )
+    assert segments._count_frames(out) == 30
+    assert not (tmp_path / "job").exists()
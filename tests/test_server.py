@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from upscaler import server
+from upscaler.server import JobQueue
+
+
+def _wait(queue: JobQueue, job_id: str, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job.finished is not None:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} still {queue.get(job_id).status} after {timeout}s")
+
+
+@pytest.fixture
+def job_queue(monkeypatch):
+    monkeypatch.setitem(server.OPS, "video", lambda **kwargs: kwargs["output_path"])
+    q = JobQueue(devices=[None], slots_per_device=1)
+    q.start()
+    yield q
+    q.stop()
+
+
+@pytest.mark.parametrize("args", [
+    {"input_path": "in.mp4", "output_path": "out.mp4", "encoder": {"bogus": 1}},
+    {"input_path": 123, "output_path": "out.mp4"},
+])
+def test_malformed_job_fails_and_worker_survives(job_queue, args):
+    job = _wait(job_queue, job_queue.submit("video", args).id)
+    assert job.status == "failed"
+    assert job.error_type == "TypeError"
+    assert all(t.is_alive() for t in job_queue._workers)
+
+    ok = _wait(job_queue, job_queue.submit("video", {"input_path": "in.mp4", "output_path": "out.mp4"}).id)
+    assert ok.status == "done"
+    assert ok.result["output"] == "out.mp4"
@@ -0,0 +1,15 @@
+import os
+
+from upscaler.bench import DEFAULT_STARTUP_BUDGET_MS, STARTUP_FORBIDDEN, check_startup, measure_startup
+
+
+def test_cli_import_stays_within_budget():
+    # Slow CI hosts can raise the budget; the forbidden imports are checked regardless.
+    budget = float(os.environ.get("UPSCALER_STARTUP_BUDGET_MS", DEFAULT_STARTUP_BUDGET_MS))
+    report = measure_startup(runs=3)
+    assert check_startup(report, budget) == []
+
+
+def test_heavy_modules_are_forbidden_at_startup():
+    for mod in ("torch", "PIL", "upscaler.api"):
+        assert mod in STARTUP_FORBIDDEN
@@ -0,0 +1,67 @@
+import pytest
+
+from upscaler.tiling import auto_tile_size, plan_tiles
+
+CASES = [
+    # height, width, tile_size, tile_pad
+    (100, 100, 32, 10),
+    (1080, 1920, 256, 10),
+    (31, 41, 16, 3),
+    (50, 70, 64, 10),  # frame smaller than one window
+    (20, 200, 64, 10),  # one axis shorter than tile_size + 2 * tile_pad
+    (64, 64, 64, 0),
+]
+
+
+@pytest.mark.parametrize("height,width,tile_size,tile_pad", CASES)
+def test_cores_partition_the_frame(height, width, tile_size, tile_pad):
+    covered = [[0] * width for _ in range(height)]
+    for t in plan_tiles(height, width, tile_size, tile_pad):
+        assert t.y1 - t.y0 <= tile_size and t.x1 - t.x0 <= tile_size
+        for y in range(t.y0, t.y1):
+            for x in range(t.x0, t.x1):
+                covered[y][x] += 1
+    assert all(c == 1 for row in covered for c in row)
+
+
+@pytest.mark.parametrize("height,width,tile_size,tile_pad", CASES)
+def test_windows_fit_the_frame_with_one_size(height, width, tile_size, tile_pad):
+    tiles = plan_tiles(height, width, tile_size, tile_pad)
+    assert len({(t.wy1 - t.wy0, t.wx1 - t.wx0) for t in tiles}) == 1
+    for t in tiles:
+        assert 0 <= t.wy0 <= t.y0 < t.y1 <= t.wy1 <= height
+        assert 0 <= t.wx0 <= t.x0 < t.x1 <= t.wx1 <= width
+        # Every core pixel sees tile_pad pixels of context, except at the frame's edges.
+        assert t.wy0 <= max(0, t.y0 - tile_pad) and t.wy1 >= min(height, t.y1 + tile_pad)
+        assert t.wx0 <= max(0, t.x0 - tile_pad) and t.wx1 >= min(width, t.x1 + tile_pad)
+
+
+def test_short_axis_window_is_the_whole_axis():
+    tiles = plan_tiles(20, 200, 64, 10)
+    assert {(t.wy0, t.wy1) for t in tiles} == {(0, 20)}
+    assert {(t.y0, t.y1) for t in tiles} == {(0, 20)}
+    assert [(t.x0, t.x1) for t in tiles] == [(0, 64), (64, 128), (128, 192), (192, 200)]
+    assert {t.wx1 - t.wx0 for t in tiles} == {84}
+
+
+@pytest.mark.parametrize("multiple", [2, 4])
+def test_windows_are_aligned_on_an_aligned_frame(multiple):
+    tiles = plan_tiles(32, 44, 15, 4, multiple)
+    for t in tiles:
+        assert (t.wy1 - t.wy0) % multiple == 0 and (t.wx1 - t.wx0) % multiple == 0
+
+
+def test_non_positive_tile_size_is_rejected():
+    with pytest.raises(ValueError):
+        plan_tiles(10, 10, 0, 2)
+
+
+def test_auto_tile_size_is_bounded_and_rounded():
+    gib = 1024 ** 3
+    small, large = auto_tile_size(1 * gib, 4), auto_tile_size(8 * gib, 4)
+    assert small % 32 == 0 and large % 32 == 0
+    assert 64 <= small <= large <= 1024
+    assert auto_tile_size(0, 4) == 64
+    assert auto_tile_size(1024 * gib, 2) == 1024
+    # More output pixels per input pixel need more memory.
+    assert auto_tile_size(2 * gib, 4) <= auto_tile_size(2 * gib, 2)
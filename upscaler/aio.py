@@ -0,0 +1,596 @@
+# upscaler/upscaler/aio.py
+"""
+asyncio API for embedding the upscaler in async services.
+
+`upscale_image_async` / `upscale_video_async` mirror the blocking API, but child
+processes (ffprobe, ffmpeg, the NCNN binary) are started with
+`asyncio.create_subprocess_exec` and torch inference runs in an executor, so the
+event loop never blocks on a job.
+
+- Concurrency is bounded per resource: GPU slots for model passes (NCNN binary
+  or torch) and ffmpeg slots for decode/encode (see `ResourceLimits`).
+- Child stderr is streamed line by line to `on_stderr`; progress is reported to
+  `on_progress(stage, done, total)` (total 0 = unknown).
+- Cancelling the task kills the running child process, stops torch work before
+  its next batch (waiting for it, so no thread writes into a removed directory)
+  and removes the scratch directory.
+
+The result cache is not consulted here; callers that want it use the blocking API.
+
+Environment:
+- UPSCALER_GPU_SLOTS: concurrent model passes (default 1)
+- UPSCALER_FFMPEG_SLOTS: concurrent ffmpeg processes (default: half the CPUs)
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import re
+import shutil
+import threading
+import weakref
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+from rich.console import Console
+
+from .api import (
+    RESAMPLE_BACKENDS,
+    Backend,
+    _extract_command,
+    _image_size,
+    _ncnn_settings,
+)
+from .backends import load_backend
+from .dedup import fill_duplicates, link_frames, plan_dedup
+from .encode import DEFAULT_ENCODER, EncoderSettings, assemble_command
+from .ffmpeg_utils import resample_video_command
+from .frame_format import get_frame_format, output_format
+from .metrics import JobMetrics, stage
+from .planner import factor_for, output_size, plan_upscale
+from .preflight import auto_backend, preflight_gpu
+from .realesrgan_vulkan import build_realesrgan_command, check_realesrgan_output
+from .scratch import estimate_frame_bytes, frame_count_hint, make_scratch_dir
+
+console = Console()
+
+ProgressCallback = Callable[[str, int, int], None]
+LineCallback = Callable[[str], None]
+
+
+def _env_int(name: str) -> Optional[int]:
+    try:
+        return int(os.environ.get(name) or "") or None
+    except ValueError:
+        return None
+
+
+class ResourceLimits:
+    """
+    Per-resource semaphores. asyncio primitives belong to one event loop, so a set
+    is created lazily for every loop that uses them.
+    """
+
+    def __init__(self, gpu_slots: Optional[int] = None, ffmpeg_slots: Optional[int] = None):
+        self.gpu_slots = gpu_slots or _env_int("UPSCALER_GPU_SLOTS") or 1
+        self.ffmpeg_slots = ffmpeg_slots or _env_int("UPSCALER_FFMPEG_SLOTS") or max(1, (os.cpu_count() or 2) // 2)
+        self._per_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Semaphore]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _semaphore(self, name: str, slots: int) -> asyncio.Semaphore:
+        sems = self._per_loop.setdefault(asyncio.get_running_loop(), {})
+        if name not in sems:
+            sems[name] = asyncio.Semaphore(slots)
+        return sems[name]
+
+    def gpu(self) -> asyncio.Semaphore:
+        return self._semaphore("gpu", self.gpu_slots)
+
+    def ffmpeg(self) -> asyncio.Semaphore:
+        return self._semaphore("ffmpeg", self.ffmpeg_slots)
+
+
+LIMITS = ResourceLimits()
+
+
+def configure_limits(gpu_slots: Optional[int] = None, ffmpeg_slots: Optional[int] = None) -> None:
+    """Change the slot counts; jobs already waiting keep the old semaphores."""
+    global LIMITS
+    LIMITS = ResourceLimits(
+        gpu_slots = gpu_slots or LIMITS.gpu_slots,
+        ffmpeg_slots = ffmpeg_slots or LIMITS.ffmpeg_slots,
+    )
+
+
+@dataclass
+class ProcessResult:
+    returncode: int
+    stdout: str
+    stderr: str  # last lines only
+
+
+async def _pump(stream: asyncio.StreamReader, keep: deque, sink: Optional[LineCallback]) -> None:
+    # ffmpeg and the NCNN binary redraw progress with '\r', so split on both.
+    buf = b""
+    while True:
+        chunk = await stream.read(1 << 16)
+        if not chunk:
+            break
+        *lines, buf = re.split(rb"[\r\n]", buf + chunk)
+        for raw in lines:
+            if raw:
+                line = raw.decode(errors = "replace")
+                keep.append(line)
+                if sink is not None:
+                    sink(line)
+    if buf:
+        line = buf.decode(errors = "replace")
+        keep.append(line)
+        if sink is not None:
+            sink(line)
+
+
+async def run_process(
+        cmd: Sequence[str],
+        on_stdout: Optional[LineCallback] = None,
+        on_stderr: Optional[LineCallback] = None,
+        tail_lines: int = 200,
+) -> ProcessResult:
+    """
+    Run `cmd`, streaming its output lines to the callbacks. If the awaiting task is
+    cancelled (or a callback raises), the child is killed and reaped before re-raising.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin = asyncio.subprocess.DEVNULL,
+        stdout = asyncio.subprocess.PIPE,
+        stderr = asyncio.subprocess.PIPE,
+    )
+    out: deque = deque()
+    err: deque = deque(maxlen = tail_lines)
+    try:
+        assert proc.stdout is not None and proc.stderr is not None
+        await asyncio.gather(_pump(proc.stdout, out, on_stdout), _pump(proc.stderr, err, on_stderr))
+        returncode = await proc.wait()
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    return ProcessResult(returncode, "\n".join(out), "\n".join(err))
+
+
+async def run_ffmpeg(
+        cmd: list[str],
+        stage_name: str,
+        total_frames: int = 0,
+        on_progress: Optional[ProgressCallback] = None,
+        on_stderr: Optional[LineCallback] = None,
+) -> ProcessResult:
+    """Run an ffmpeg command in an ffmpeg slot, reporting `frame=` progress."""
+    cmd = [cmd[0], "-nostats", "-progress", "pipe:1", *cmd[1:]]
+
+    def on_stdout(line: str) -> None:
+        if on_progress is not None and line.startswith("frame="):
+            on_progress(stage_name, int(line[6:] or 0), total_frames)
+
+    async with LIMITS.ffmpeg():
+        result = await run_process(cmd, on_stdout = on_stdout, on_stderr = on_stderr)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg {stage_name} failed:\n{result.stderr}")
+    return result
+
+
+async def _run_ffmpeg_audio_fallback(
+        build: Callable[[str], list[str]],
+        encoder: EncoderSettings,
+        stage_name: str,
+        total_frames: int,
+        on_progress: Optional[ProgressCallback],
+        on_stderr: Optional[LineCallback],
+) -> None:
+    # Same policy as encode.run_with_audio_fallback.
+    try:
+        await run_ffmpeg(build(encoder.audio), stage_name, total_frames, on_progress, on_stderr)
+    except RuntimeError:
+        if encoder.audio != "copy":
+            raise
+        console.log("[yellow] audio stream copy failed, re-encoding audio to AAC[/yellow]")
+        await run_ffmpeg(build("aac"), stage_name, total_frames, on_progress, on_stderr)
+
+
+@dataclass
+class VideoInfo:
+    width: int
+    height: int
+    fps: float
+    duration: Optional[float]
+
+
+async def probe_video(input_path: Path) -> VideoInfo:
+    """Size, frame rate and duration from a single ffprobe call."""
+    result = await run_process([
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,r_frame_rate:format=duration",
+        "-of", "json",
+        str(input_path),
+    ])
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed:\n{result.stderr}")
+    data = json.loads(result.stdout or "{}")
+    streams = data.get("streams") or []
+    if not streams:
+        raise RuntimeError(f"No video stream in {input_path}")
+    stream0 = streams[0]
+
+    fps = 30.0
+    num, _, den = str(stream0.get("r_frame_rate") or "").partition("/")
+    try:
+        fps = float(num) / float(den or 1) or 30.0
+    except (ValueError, ZeroDivisionError):
+        pass
+    try:
+        duration = float((data.get("format") or {}).get("duration"))
+    except (TypeError, ValueError):
+        duration = None
+    return VideoInfo(int(stream0["width"]), int(stream0["height"]), fps, duration)
+
+
+@contextlib.asynccontextmanager
+async def _watch_outputs(
+        directory: Path,
+        suffix: str,
+        stage_name: str,
+        total: int,
+        on_progress: Optional[ProgressCallback],
+        interval: float = 0.5,
+):
+    # Folder-mode backends report nothing per frame; count finished outputs instead.
+    async def poll() -> None:
+        while True:
+            await asyncio.sleep(interval)
+            done = sum(1 for p in directory.glob(f"*{suffix}"))
+            on_progress(stage_name, done, total)
+
+    task = asyncio.create_task(poll()) if on_progress is not None else None
+    try:
+        yield
+    finally:
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+
+async def run_realesrgan_async(
+        input_path: Path,
+        output_path: Path,
+        scale: int,
+        model_name: str,
+        auto_download: bool = False,
+        gpu_id: Optional[int] = None,
+        verbose: bool = False,
+        force_gpu: bool = False,
+        tile_size: Optional[int] = None,
+        threads: Optional[str] = None,
+        output_format: Optional[str] = None,
+        on_stderr: Optional[LineCallback] = None,
+) -> None:
+    """`run_realesrgan` in a GPU slot; the binary is killed if the task is cancelled."""
+    # Resolving the binary/model may download them: keep that off the event loop.
+    rc = await asyncio.to_thread(
+        build_realesrgan_command,
+        input_path, output_path, scale, model_name,
+        auto_download, gpu_id, verbose, force_gpu, tile_size, threads, output_format,
+    )
+    console.log(f"[blue] RealESRGAN (async): {' '.join(rc.cmd)}[/blue]")
+    async with LIMITS.gpu():
+        result = await run_process(rc.cmd, on_stderr = on_stderr)
+    combined = "\n".join(part for part in (result.stdout, result.stderr) if part)
+    check_realesrgan_output(result.returncode, combined, rc.verbose, rc.force_gpu, rc.gpu_id)
+
+
+async def _run_backend_async(name: str, func: str, **kwargs):
+    """
+    `load_backend(name).<func>(**kwargs)` in the default executor, in a GPU slot.
+    On cancellation the pipeline is told to stop and awaited before re-raising.
+    """
+    # The first import of torch/onnxruntime takes seconds: keep it off the event loop.
+    backend = await asyncio.to_thread(load_backend, name)
+    run = getattr(backend, func)
+    cancel = threading.Event()
+    loop = asyncio.get_running_loop()
+    async with LIMITS.gpu():
+        fut = loop.run_in_executor(None, functools.partial(run, cancel = cancel, **kwargs))
+        try:
+            return await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            cancel.set()
+            with contextlib.suppress(Exception):
+                await fut
+            raise
+
+
+async def run_realesrgan_torch_async(**kwargs):
+    """`run_realesrgan_torch(**kwargs)` off the event loop (see `_run_backend_async`)."""
+    return await _run_backend_async("torch", "run_realesrgan_torch", **kwargs)
+
+
+async def run_realesrgan_onnx_async(**kwargs):
+    """`run_realesrgan_onnx(**kwargs)` off the event loop (see `_run_backend_async`)."""
+    return await _run_backend_async("onnx", "run_realesrgan_onnx", **kwargs)
+
+
+def _job_metrics(
+        metrics: Optional[JobMetrics], op: str, backend: str, model: str, scale: float
+) -> Optional[JobMetrics]:
+    metrics = metrics if metrics is not None else JobMetrics.from_env()
+    if metrics is not None:
+        for label, value in (("op", op), ("backend", backend), ("model", model), ("scale", scale)):
+            metrics.labels.setdefault(label, str(value))
+    return metrics
+
+
+async def upscale_image_async(
+        input_path: Path | str,
+        output_path: Path | str,
+        scale: int = 2,
+        backend: Backend = "realesrgan",
+        model: str = "realesrgan-x4plus",
+        auto_download: bool = False,
+        gpu_id: int | None = None,
+        verbose: bool = False,
+        force_gpu: bool = False,
+        tile_size: int | None = None,
+        tile_pad: int = 10,
+        ncnn_threads: str | None = None,
+        torch_fp16: bool = True,
+        torch_cpu_mode: str | None = None,
+        onnx_threads: int | None = None,
+        target_height: int | None = None,
+        metrics: JobMetrics | None = None,
+        on_stderr: LineCallback | None = None,
+) -> Path:
+    """Async `upscale_image` (same options, no result cache)."""
+    input_path = Path(input_path)
+    output_path = Path(output_path)
+    metrics = _job_metrics(metrics, "upscale_image_async", backend, model, scale)
+    try:
+        if metrics is not None:
+            metrics.frames = 1
+        input_size = await asyncio.to_thread(_image_size, input_path)
+        if backend == "auto":
+            backend = await asyncio.to_thread(auto_backend, model, auto_download)
+
+        if backend in RESAMPLE_BACKENDS:
+            from .resample import resample_image
+            size = output_size(*input_size, factor_for(scale, target_height, input_size))
+            with stage(metrics, "infer"):
+                await asyncio.to_thread(resample_image, input_path, output_path, scale, backend, size)
+            return output_path
+
+        plan = plan_upscale(model, scale, target_height, input_size, backend)
+        with stage(metrics, "infer"):
+            if backend == "realesrgan":
+                gpu_id = await asyncio.to_thread(preflight_gpu, plan.model, gpu_id, force_gpu, auto_download)
+                ncnn_tile, ncnn_threads = await asyncio.to_thread(
+                    _ncnn_settings, plan.model, plan.model_scale, gpu_id, tile_size, ncnn_threads,
+                )
+                await run_realesrgan_async(
+                    input_path, output_path, plan.model_scale, plan.model,
+                    auto_download = auto_download,
+                    gpu_id = gpu_id,
+                    verbose = verbose,
+                    force_gpu = force_gpu,
+                    tile_size = ncnn_tile,
+                    threads = ncnn_threads,
+                    on_stderr = on_stderr,
+                )
+                if plan.needs_resize:
+                    from .resample import resample_image
+                    await asyncio.to_thread(
+                        resample_image, output_path, output_path, plan.factor, "lanczos", plan.out_size,
+                    )
+            elif backend == "torch":
+                await run_realesrgan_torch_async(
+                    input_paths = [input_path],
+                    output_paths = [output_path],
+                    scale = plan.model_scale,
+                    model_name = plan.model,
+                    device = "cuda",
+                    fp16 = torch_fp16,
+                    cpu_mode = torch_cpu_mode,
+                    batch_size = 1,
+                    tile_size = tile_size,
+                    tile_pad = tile_pad,
+                    metrics = metrics,
+                    out_size = plan.out_size,
+                    input_sizes = [input_size],
+                )
+            elif backend == "onnx":
+                await run_realesrgan_onnx_async(
+                    input_paths = [input_path],
+                    output_paths = [output_path],
+                    scale = plan.model_scale,
+                    model_name = plan.model,
+                    batch_size = 1,
+                    tile_size = tile_size,
+                    tile_pad = tile_pad,
+                    threads = onnx_threads,
+                    metrics = metrics,
+                    out_size = plan.out_size,
+                )
+        return output_path
+    finally:
+        if metrics is not None:
+            metrics.finish()
+
+
+async def upscale_video_async(
+        input_path: Path | str,
+        output_path: Path | str,
+        scale: int = 2,
+        backend: Backend = "torch",
+        model: str = "realesrgan-x4plus",
+        fps: int | None = None,
+        auto_download: bool = False,
+        torch_batch_size: int = 4,
+        torch_fp16: bool = True,
+        torch_cpu_mode: str | None = None,
+        onnx_threads: int | None = None,
+        gpu_id: int | None = None,
+        verbose: bool = False,
+        force_gpu: bool = False,
+        tile_size: int | None = None,
+        tile_pad: int = 10,
+        dedup: bool = False,
+        dedup_tolerance: float = 0.0,
+        ncnn_threads: str | None = None,
+        target_height: int | None = None,
+        frame_format: str = "png",
+        scratch_dir: Path | str | None = None,
+        encoder: EncoderSettings | None = None,
+        metrics: JobMetrics | None = None,
+        on_progress: ProgressCallback | None = None,
+        on_stderr: LineCallback | None = None,
+) -> Path:
+    """
+    Async `upscale_video` over the frame-folder path (extract -> model -> assemble).
+    Progress stages: "extract", "infer", "assemble" (or "stream" for bicubic/lanczos).
+    """
+    input_path = Path(input_path)
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents = True, exist_ok = True)
+    encoder = encoder or DEFAULT_ENCODER
+    metrics = _job_metrics(metrics, "upscale_video_async", backend, model, scale)
+    tmp_dir: Optional[Path] = None
+    try:
+        with stage(metrics, "probe"):
+            info = await probe_video(input_path)
+        input_size = (info.width, info.height)
+        out_fps = float(fps) if fps is not None else info.fps
+        n_frames = frame_count_hint(info.duration, out_fps)
+        if metrics is not None:
+            metrics.frames = n_frames
+        if backend == "auto":
+            backend = await asyncio.to_thread(auto_backend, model, auto_download)
+
+        if backend in RESAMPLE_BACKENDS:
+            size = output_size(*input_size, factor_for(scale, target_height, input_size), even = True)
+            with stage(metrics, "stream"):
+                await _run_ffmpeg_audio_fallback(
+                    lambda audio: resample_video_command(
+                        input_path, output_path, scale, backend, fps, size, audio, encoder,
+                    ),
+                    encoder, "stream", n_frames, on_progress, on_stderr,
+                )
+            return output_path
+
+        plan = plan_upscale(model, scale, target_height, input_size, backend, even = True)
+        if backend == "realesrgan":
+            gpu_id = await asyncio.to_thread(preflight_gpu, plan.model, gpu_id, force_gpu, auto_download)
+        fmt_in = get_frame_format(frame_format)
+        fmt_out = output_format(fmt_in, backend)
+        estimate = estimate_frame_bytes(*input_size, n_frames, plan.model_scale, fmt_in, fmt_out)
+        tmp_dir = await asyncio.to_thread(make_scratch_dir, estimate, scratch_dir)
+        frames_in = tmp_dir / "in"
+        frames_out = tmp_dir / "out"
+        frames_in.mkdir()
+        frames_out.mkdir()
+
+        with stage(metrics, "extract"):
+            await run_ffmpeg(
+                _extract_command(input_path, frames_in, fps, fmt_in), "extract", n_frames, on_progress, on_stderr,
+            )
+        all_frames_in = sorted(frames_in.glob(f"frame_*{fmt_in.suffix}"))
+        if metrics is not None:
+            metrics.frames = len(all_frames_in)
+
+        work_in = frames_in
+        dedup_plan = None
+        if dedup:
+            with stage(metrics, "dedup"):
+                dedup_plan = await asyncio.to_thread(plan_dedup, all_frames_in, dedup_tolerance)
+            if dedup_plan.skipped:
+                all_frames_in = dedup_plan.unique
+                work_in = tmp_dir / "unique"
+                await asyncio.to_thread(link_frames, all_frames_in, work_in)
+
+        resized_on_device = False
+        with stage(metrics, "infer"):
+            async with _watch_outputs(frames_out, fmt_out.suffix, "infer", len(all_frames_in), on_progress):
+                if backend == "torch":
+                    await run_realesrgan_torch_async(
+                        input_paths = all_frames_in,
+                        output_paths = [frames_out / (f.stem + fmt_out.suffix) for f in all_frames_in],
+                        scale = plan.model_scale,
+                        model_name = plan.model,
+                        device = "cuda",
+                        fp16 = torch_fp16,
+                        cpu_mode = torch_cpu_mode,
+                        batch_size = torch_batch_size,
+                        tile_size = tile_size,
+                        tile_pad = tile_pad,
+                        metrics = metrics,
+                        out_size = plan.out_size,
+                        save_options = fmt_out.pil_options,
+                        input_sizes = [input_size] * len(all_frames_in),
+                    )
+                    resized_on_device = True
+                elif backend == "onnx":
+                    await run_realesrgan_onnx_async(
+                        input_paths = all_frames_in,
+                        output_paths = [frames_out / (f.stem + fmt_out.suffix) for f in all_frames_in],
+                        scale = plan.model_scale,
+                        model_name = plan.model,
+                        batch_size = torch_batch_size,
+                        tile_size = tile_size,
+                        tile_pad = tile_pad,
+                        threads = onnx_threads,
+                        metrics = metrics,
+                        out_size = plan.out_size,
+                        save_options = fmt_out.pil_options,
+                    )
+                    resized_on_device = True
+                else:
+                    ncnn_tile, ncnn_threads = await asyncio.to_thread(
+                        _ncnn_settings, plan.model, plan.model_scale, gpu_id, tile_size, ncnn_threads,
+                    )
+                    await run_realesrgan_async(
+                        work_in, frames_out, plan.model_scale, plan.model,
+                        auto_download = auto_download,
+                        gpu_id = gpu_id,
+                        verbose = verbose,
+                        force_gpu = force_gpu,
+                        tile_size = ncnn_tile,
+                        threads = ncnn_threads,
+                        output_format = fmt_out.ncnn_output,
+                        on_stderr = on_stderr,
+                    )
+
+        if dedup_plan is not None and dedup_plan.skipped:
+            await asyncio.to_thread(fill_duplicates, dedup_plan, frames_out, fmt_out.suffix)
+
+        with stage(metrics, "assemble"):
+            size = plan.out_size if plan.needs_resize and not resized_on_device else None
+            n_out = sum(1 for _ in frames_out.glob(f"frame_*{fmt_out.suffix}"))
+            await _run_ffmpeg_audio_fallback(
+                lambda audio: assemble_command(
+                    frames_out, input_path, output_path, out_fps, size, fmt_out.suffix, encoder, audio,
+                    n_out / out_fps if n_out else None,
+                ),
+                encoder, "assemble", n_frames, on_progress, on_stderr,
+            )
+        return output_path
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors = True)
+        if metrics is not None:
+            metrics.finish()
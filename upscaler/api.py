@@ -1,15 +1,34 @@
 # upscaler/upscaler/api.py
 from pathlib import Path
-from typing import Literal
+from typing import Iterable, Literal
 from rich.console import Console
 
-import shutil, subprocess, tempfile
+import functools, inspect, shutil, subprocess, tempfile
 
-from .ffmpeg_utils import upscale_image_bicubic, upscale_video_bicubic
-from .realesrgan_vulkan import run_realesrgan
+from .ffmpeg_utils import (
+    upscale_video_bicubic,
+    probe_duration,
+    probe_video_size,
+    open_rawvideo_reader,
+    open_rawvideo_writer,
+    read_process_stderr,
+)
+from .backends import backend_available, load_backend
+from .result_cache import open_result_cache
+from .metrics import JobMetrics, dir_size, stage
+from .dedup import fill_duplicates, link_frames, link_or_copy, plan_dedup
+from .planner import UpscalePlan, factor_for, output_size, plan_upscale
+from .frame_format import FRAME_FORMATS, FrameFormat, get_frame_format, output_format
+from .scratch import estimate_frame_bytes, frame_count_hint, make_scratch_dir
+from .encode import EncoderSettings, assemble_frames
+from .rolling import ROLLING_WINDOWS, plan_chunk_frames, run_rolling
+from .recovery import recover_frames
+from .preflight import auto_backend, preflight_gpu
 
 console = Console()
-Backend = Literal["bicubic", "realesrgan", "torch"]
+Backend = Literal["auto", "bicubic", "lanczos", "realesrgan", "torch", "onnx"]
+# Classic resampling backends: no model, handled in-process (images) or by one ffmpeg pass (video).
+RESAMPLE_BACKENDS = ("bicubic", "lanczos")
 
 def _probe_fps(input_path: Path) -> float:
     """
@@ -46,6 +65,173 @@ def _probe_fps(input_path: Path) -> float:
     except Exception:
         return 30.0
 
+def warm_model(
+        model: str = "realesrgan-x4plus",
+        scale: int = 4,
+        device: str = "cuda",
+        fp16: bool = True,
+        cpu_mode: str | None = None,
+) -> None:
+    """
+    Load a torch model into the process-wide model cache ahead of the first request
+    (on CPU prepared for `cpu_mode`, see torch_cpu).
+    """
+    load_backend("torch")._prepare_model(model, scale, device, fp16, cpu_mode)
+
+def evict_model(
+        model: str | None = None,
+        scale: int | None = None,
+        device: str | None = None,
+        cpu_mode: str | None = None,
+) -> int:
+    """
+    Drop cached torch models (all of them when called without arguments).
+    Returns the number of evicted entries.
+    """
+    from .model_cache import MODEL_CACHE
+    if model is None and scale is None and device is None and cpu_mode is None:
+        return MODEL_CACHE.evict()
+    return load_backend("torch").evict_realesrgan_model(model, scale, device, cpu_mode = cpu_mode)
+
+def configure_model_cache(max_entries: int | None = None, max_mb: int | None = None) -> None:
+    """
+    Set the model cache limits (entry count and/or memory budget in MiB).
+    """
+    from .model_cache import MODEL_CACHE
+    MODEL_CACHE.configure(
+        max_entries = max_entries,
+        max_bytes = max_mb * 1024 * 1024 if max_mb is not None else None,
+    )
+
+def model_cache_stats():
+    """
+    Hit/miss/eviction counters and current size of the model cache.
+    """
+    from .model_cache import MODEL_CACHE
+    return MODEL_CACHE.stats()
+
+def _ncnn_settings(
+        model: str,
+        scale: int,
+        gpu_id: int | None,
+        tile_size: int | None,
+        ncnn_threads: str | None,
+        autotune: bool = False,
+        sample_frames: list[Path] | None = None,
+        auto_download: bool = False,
+) -> tuple[int | None, str | None]:
+    """
+    Resolve -t/-j for the NCNN binary: explicit values win, then (with `autotune`)
+    a fresh tuning run over `sample_frames`, then the stored result for this device.
+    """
+    if tile_size is not None and ncnn_threads:
+        return tile_size, ncnn_threads
+
+    from .autotune import autotune_ncnn, lookup_ncnn_settings, sample_evenly
+
+    tuned = None
+    if autotune and sample_frames:
+        try:
+            tuned = autotune_ncnn(
+                sample_evenly(sample_frames),
+                model_name = model,
+                scale = scale,
+                gpu_id = gpu_id,
+                auto_download = auto_download,
+            )
+        except Exception as e:
+            console.print(f"[yellow][upscaler] NCNN autotune failed ({e}); using defaults.[/yellow]")
+    if tuned is None:
+        tuned = lookup_ncnn_settings(model, scale, gpu_id)
+    if tuned is None:
+        return tile_size, ncnn_threads
+    return (
+        tile_size if tile_size is not None else tuned.tile_size,
+        ncnn_threads or tuned.threads,
+    )
+
+# Arguments that never change the produced output; everything else is part of the cache key.
+_NON_OUTPUT_ARGS = {
+    "input_path", "output_path", "cache_dir", "auto_download", "gpu_id", "verbose", "force_gpu",
+    "torch_decode_workers", "torch_write_workers", "torch_prefetch", "torch_write_queue",
+    "ncnn_threads", "autotune", "gpu_ids", "instances_per_gpu", "metrics", "scratch_dir",
+}
+
+def _result_cached(fn):
+    """
+    Serve `fn(input_path, output_path, ...)` from the result cache when one is
+    enabled (`cache_dir=` or UPSCALER_CACHE_DIR) and store fresh results in it.
+    """
+    sig = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+        cache = open_result_cache(bound.arguments.get("cache_dir"))
+        if cache is None:
+            return fn(*args, **kwargs)
+
+        input_path = Path(bound.arguments["input_path"])
+        output_path = Path(bound.arguments["output_path"])
+        options = {k: v for k, v in bound.arguments.items() if k not in _NON_OUTPUT_ARGS}
+        key = cache.key(input_path, op = fn.__name__, suffix = output_path.suffix, **options)
+
+        if cache.get(key, output_path):
+            console.log(f"[green] result cache hit[/green]: {output_path}")
+            metrics = bound.arguments.get("metrics")
+            if metrics is not None:
+                metrics.event("cache_hit", key = key, output = str(output_path))
+            return output_path
+
+        result = fn(*args, **kwargs)
+        cache.put(key, output_path)
+        return result
+
+    return wrapper
+
+def _instrumented(fn):
+    """
+    Give every `fn(..., metrics=...)` call a `JobMetrics` (the caller's, or one wired
+    to UPSCALER_METRICS_* when set), label it with the job's options and finish it
+    (job summary event, Prometheus file) when the call returns or fails.
+    """
+    sig = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+        metrics = bound.arguments.get("metrics")
+        if metrics is None:
+            metrics = JobMetrics.from_env()
+        if metrics is None:
+            return fn(*args, **kwargs)
+
+        for label in ("backend", "model", "scale"):
+            metrics.labels.setdefault(label, str(bound.arguments.get(label)))
+        metrics.labels.setdefault("op", fn.__name__)
+        bound.arguments["metrics"] = metrics
+        try:
+            return fn(*bound.args, **bound.kwargs)
+        finally:
+            metrics.finish()
+
+    return wrapper
+
+def _image_size(path: Path) -> tuple[int, int]:
+    from PIL import Image
+    with Image.open(path) as im:
+        return im.size
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+@_instrumented
+@_result_cached
 def upscale_image(
         input_path: Path | str,
         output_path: Path | str, 
@@ -56,162 +242,824 @@ def upscale_image(
         gpu_id: int | None = None,
         verbose: bool = False,
         force_gpu: bool = False,
+        tile_size: int | None = None,
+        tile_pad: int = 10,
+        cache_dir: Path | str | None = None,
+        ncnn_threads: str | None = None,
+        metrics: JobMetrics | None = None,
+        torch_fp16: bool = True,
+        torch_cpu_mode: str | None = None,
+        onnx_threads: int | None = None,
+        target_height: int | None = None,
 ) -> Path:
+    """
+    Upscale one image by `scale`, or to `target_height` (aspect kept) when given.
+    Model backends run the cheapest model of `model`'s family that reaches the
+    factor (see planner) and resize the remainder.
+    """
     input_path = Path(input_path)
     output_path = Path(output_path)
+    if metrics is not None:
+        metrics.frames = 1
+    input_size = _image_size(input_path)
+    if backend == "auto":
+        backend = auto_backend(model, auto_download)
 
-    if backend == "bicubic":
-        console.print("[yellow]Bicubic upscaling is placeholder for now.[/yellow]")
+    if backend in RESAMPLE_BACKENDS:
+        resample_image = load_backend(backend).resample_image
+        size = output_size(*input_size, factor_for(scale, target_height, input_size))
+        with stage(metrics, "infer") as info:
+            resample_image(input_path, output_path, scale, method = backend, size = size)
+            info.update(bytes_in = _file_size(input_path), bytes_out = _file_size(output_path))
         return output_path
-    
-    elif backend == "realesrgan": 
-        run_realesrgan(
-            input_path, 
-            output_path, 
-            scale, 
-            model_name = model, 
-            auto_download = auto_download,
-            gpu_id = gpu_id,
-            verbose = verbose,
-            force_gpu = force_gpu,
-        )
+
+    plan = plan_upscale(model, scale, target_height, input_size, backend)
+    if backend == "realesrgan": 
+        ncnn = load_backend("realesrgan")
+        gpu_id = preflight_gpu(plan.model, gpu_id, force_gpu, auto_download)
+        ncnn_tile, ncnn_threads = _ncnn_settings(plan.model, plan.model_scale, gpu_id, tile_size, ncnn_threads)
+        with stage(metrics, "infer") as info:
+            ncnn.run_realesrgan(
+                input_path, 
+                output_path, 
+                plan.model_scale, 
+                model_name = plan.model, 
+                auto_download = auto_download,
+                gpu_id = gpu_id,
+                verbose = verbose,
+                force_gpu = force_gpu,
+                tile_size = ncnn_tile,
+                threads = ncnn_threads,
+                metrics = metrics,
+            )
+            if plan.needs_resize:
+                load_backend("lanczos").resample_image(output_path, output_path, plan.factor, method = "lanczos", size = plan.out_size)
+            info.update(bytes_in = _file_size(input_path), bytes_out = _file_size(output_path))
     elif backend == "torch":
-        # Lazy import: keep vulkan backend usable without torch installed.
-        try:
-            from .realesrgan_torch import run_realesrgan_torch
-        except Exception as e:
-            raise RuntimeError(
-                f"PyTorch backend requested but torch/torchvision is not available ({e}). "
-                f"Use --backend realesrgan for the Vulkan/NCNN backend."
-            ) from e
-        run_realesrgan_torch(
-            input_paths = [input_path],
-            output_paths = [output_path],
-            scale = scale,
-            model_name = model,
-            device = "cuda",
-            fp16 = True,
-            batch_size = 1 
-        )
+        # Imported on first use: the vulkan backend works without torch installed.
+        run_realesrgan_torch = load_backend("torch").run_realesrgan_torch
+        with stage(metrics, "infer"):
+            run_realesrgan_torch(
+                input_paths = [input_path],
+                output_paths = [output_path],
+                scale = plan.model_scale,
+                model_name = plan.model,
+                device = "cuda",
+                fp16 = torch_fp16,
+                cpu_mode = torch_cpu_mode,
+                batch_size = 1,
+                tile_size = tile_size,
+                tile_pad = tile_pad,
+                metrics = metrics,
+                out_size = plan.out_size,
+                input_sizes = [input_size],
+            )
+    elif backend == "onnx":
+        run_realesrgan_onnx = load_backend("onnx").run_realesrgan_onnx
+        with stage(metrics, "infer"):
+            run_realesrgan_onnx(
+                input_paths = [input_path],
+                output_paths = [output_path],
+                scale = plan.model_scale,
+                model_name = plan.model,
+                batch_size = 1,
+                tile_size = tile_size,
+                tile_pad = tile_pad,
+                threads = onnx_threads,
+                metrics = metrics,
+                out_size = plan.out_size,
+            )
     return output_path
 
-def upscale_video(
-        input_path: Path | str,
-        output_path: Path | str, 
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+def collect_images(source: Path | str) -> list[Path]:
+    """
+    Expand a directory (its image files, non-recursive), a glob pattern or a single
+    file into a sorted list of image paths.
+    """
+    source_s = str(source)
+    path = Path(source_s)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.is_file() and p.suffix.lower() in IMAGE_SUFFIXES)
+    if any(ch in source_s for ch in "*?["):
+        anchor = Path(path.anchor) if path.is_absolute() else Path(".")
+        pattern = str(path.relative_to(anchor)) if path.is_absolute() else source_s
+        return sorted(p for p in anchor.glob(pattern) if p.is_file())
+    return [path] if path.is_file() else []
+
+def _batch_output_paths(inputs: list[Path], output_dir: Path) -> list[Path]:
+    # <stem>.png, with a numeric suffix when two inputs share a stem.
+    seen: dict[str, int] = {}
+    outputs = []
+    for p in inputs:
+        n = seen.get(p.stem, 0)
+        seen[p.stem] = n + 1
+        name = f"{p.stem}.png" if n == 0 else f"{p.stem}_{n}.png"
+        outputs.append(output_dir / name)
+    return outputs
+
+def upscale_images(
+        inputs: Iterable[Path | str],
+        output_dir: Path | str,
         scale: int = 2,
-        backend: Backend = "torch", 
+        backend: Backend = "realesrgan",
         model: str = "realesrgan-x4plus",
-        fps: int | None = None,
         auto_download: bool = False,
-        torch_batch_size: int = 4, 
-        torch_fp16: bool = True,
         gpu_id: int | None = None,
         verbose: bool = False,
         force_gpu: bool = False,
-) -> Path: 
-    input_path = Path(input_path)
-    output_path = Path(output_path)
+        torch_batch_size: int = 4,
+        torch_fp16: bool = True,
+        torch_cpu_mode: str | None = None,
+        onnx_threads: int | None = None,
+        tile_size: int | None = None,
+        tile_pad: int = 10,
+        ncnn_threads: str | None = None,
+        autotune: bool = False,
+        target_height: int | None = None,
+) -> list[Path]:
+    """
+    Upscale many images in one go, paying backend startup once:
+    the Vulkan backend runs the NCNN binary once in folder mode and the torch
+    and onnx backends batch images of equal size. Outputs are `output_dir/<stem>.png`.
+    All images go through one model, the cheapest that reaches every image's
+    factor; per-image remainders are resized afterwards (torch/onnx: in the same pass).
+    """
+    input_paths = [Path(p) for p in inputs]
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_paths = _batch_output_paths(input_paths, output_dir)
 
-    if backend == "bicubic":
-        console.print("[yellow]Bicubic video upscaling is placeholder for now.[/yellow]")
-        return output_path
-    
-    tmp_dir = Path(tempfile.mkdtemp(prefix = "upscaler_"))
-    frames_in = tmp_dir / "in"
-    frames_out = tmp_dir / "out"
-    frames_in.mkdir(parents=True, exist_ok=True)
-    frames_out.mkdir(parents=True, exist_ok=True)
+    if not input_paths:
+        console.log("[yellow][upscaler] No images to process.[/yellow]")
+        return []
+
+    # Planned up front so an impossible request fails before any work starts.
+    sizes = [_image_size(p) for p in input_paths]
+    if backend == "auto":
+        backend = auto_backend(model, auto_download)
+    if backend in RESAMPLE_BACKENDS:
+        resample_images = load_backend(backend).resample_images
+        console.log(f"[bold blue] {backend.upper()} resampling of {len(input_paths)} images [/bold blue]")
+        out_sizes = [output_size(*size, factor_for(scale, target_height, size)) for size in sizes]
+        resample_images(input_paths, output_paths, scale, method = backend, sizes = out_sizes)
+        return output_paths
+
+    plans = [plan_upscale(model, scale, target_height, size, backend) for size in sizes]
+    model_pass = max(plans, key = lambda p: p.model_scale)
+
+    if backend == "realesrgan":
+        ncnn = load_backend("realesrgan")
+        gpu_id = preflight_gpu(model_pass.model, gpu_id, force_gpu, auto_download)
+        tmp_dir = Path(tempfile.mkdtemp(prefix = "upscaler_batch_"))
+        staged_in = tmp_dir / "in"
+        staged_out = tmp_dir / "out"
+        staged_in.mkdir()
+        staged_out.mkdir()
+        try:
+            # Index-named hardlinks keep names unique and map outputs back unambiguously.
+            for i, src in enumerate(input_paths):
+                link_or_copy(src.resolve(), staged_in / f"{i:06d}{src.suffix.lower()}")
+
+            ncnn_tile, ncnn_threads = _ncnn_settings(
+                model_pass.model, model_pass.model_scale, gpu_id, tile_size, ncnn_threads,
+                autotune = autotune, sample_frames = input_paths, auto_download = auto_download,
+            )
+            console.log(f"[bold yellow] VULKAN folder mode over {len(input_paths)} images [/bold yellow]")
+            ncnn.run_realesrgan(
+                input_path = staged_in,
+                output_path = staged_out,
+                scale = model_pass.model_scale,
+                model_name = model_pass.model,
+                auto_download = auto_download,
+                gpu_id = gpu_id,
+                verbose = verbose,
+                force_gpu = force_gpu,
+                tile_size = ncnn_tile,
+                threads = ncnn_threads,
+            )
+
+            missing = []
+            for i, (src, dst) in enumerate(zip(input_paths, output_paths)):
+                produced = staged_out / f"{i:06d}.png"
+                if not produced.exists():
+                    missing.append(src)
+                    continue
+                shutil.move(str(produced), str(dst))
+            if missing:
+                raise RuntimeError(
+                    f"RealESRGAN produced no output for {len(missing)} image(s): "
+                    + ", ".join(str(p) for p in missing[:10])
+                )
+
+            resize = [(dst, plan.out_size) for dst, plan in zip(output_paths, plans)
+                      if plan.factor != model_pass.model_scale]
+            if resize:
+                load_backend("lanczos").resample_images(
+                    [dst for dst, _size in resize], [dst for dst, _size in resize], model_pass.factor,
+                    method = "lanczos", sizes = [size for _dst, size in resize],
+                )
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors = True)
+
+    elif backend == "torch":
+        # Imported on first use: the vulkan backend works without torch installed.
+        run_realesrgan_torch = load_backend("torch").run_realesrgan_torch
+        # One pipeline for all sizes: it buckets them by resolution and adapts the batch size.
+        console.log(f"[bold green] TORCH batch: {len(input_paths)} images in {len(set(sizes))} sizes [/bold green]")
+        run_realesrgan_torch(
+            input_paths = input_paths,
+            output_paths = output_paths,
+            scale = model_pass.model_scale,
+            model_name = model_pass.model,
+            device = "cuda",
+            fp16 = torch_fp16,
+            cpu_mode = torch_cpu_mode,
+            batch_size = torch_batch_size,
+            tile_size = tile_size,
+            tile_pad = tile_pad,
+            input_sizes = sizes,
+            out_sizes = [plan.out_size for plan in plans],
+        )
+
+    elif backend == "onnx":
+        # Same batch/tile options as torch; batches are grouped by size for the per-size out_size.
+        run_realesrgan_onnx = load_backend("onnx").run_realesrgan_onnx
+        groups = {}
+        for i, size in enumerate(sizes):
+            groups.setdefault(size, []).append(i)
+
+        for size, idxs in groups.items():
+            console.log(f"[bold green] ONNX batch: {len(idxs)} images of {size[0]}x{size[1]} [/bold green]")
+            run_realesrgan_onnx(
+                input_paths = [input_paths[i] for i in idxs],
+                output_paths = [output_paths[i] for i in idxs],
+                scale = model_pass.model_scale,
+                model_name = model_pass.model,
+                batch_size = torch_batch_size,
+                tile_size = tile_size,
+                tile_pad = tile_pad,
+                threads = onnx_threads,
+                out_size = plans[idxs[0]].out_size,
+            )
+    return output_paths
+
+def _upscale_video_torch_stream(
+        input_path: Path,
+        output_path: Path,
+        scale: int,
+        model: str,
+        fps: int | None,
+        torch_batch_size: int,
+        torch_fp16: bool,
+        torch_cpu_mode: str | None = None,
+        tile_size: int | None = None,
+        tile_pad: int = 10,
+        metrics: JobMetrics | None = None,
+        out_size: tuple[int, int] | None = None,
+        encoder: EncoderSettings | None = None,
+) -> Path:
+    """
+    Torch backend without intermediate files: ffmpeg decodes rgb24 rawvideo to a pipe,
+    frames are batched straight into tensors and the upscaled frames are piped into a
+    second ffmpeg process that encodes the output (with the source audio).
+    """
+    run_realesrgan_torch_stream = load_backend("torch").run_realesrgan_torch_stream
+
+    with stage(metrics, "probe"):
+        width, height = probe_video_size(input_path)
+        out_fps = float(fps) if fps is not None else _probe_fps(input_path)
+        n_frames = frame_count_hint(probe_duration(input_path), out_fps)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    console.log(f"[bold green] Launching TORCH-backend (streaming, {width}x{height}) [/bold green]")
+    reader = open_rawvideo_reader(input_path, fps=fps)
+    writer = None
+
+    def open_writer(out_w: int, out_h: int):
+        nonlocal writer
+        writer = open_rawvideo_writer(
+            output_path, out_w, out_h, out_fps, audio_source=input_path, encoder=encoder,
+            duration=n_frames / out_fps if n_frames else None,
+        )
+        return writer.stdin
 
     try:
-        pattern_in = frames_in / "frame_%06d.png"
-        cmd_extract = [
-             "ffmpeg", "-y", "-i", str(input_path),
-        ]
-        if fps is not None:
-             cmd_extract += ["-vf", f"fps={fps}"]
-        cmd_extract.append(str(pattern_in))
-        
-        console.log("[cyan] extracting frames... [/cyan]")
-        proc = subprocess.run(cmd_extract, capture_output=True, text=True)
-        if proc.returncode != 0:
-             raise RuntimeError(f"ffmpeg extract failed:\n{proc.stderr}")
+        assert reader.stdout is not None
+        # Decode, inference and encode overlap here, so they are timed as one stage.
+        with stage(metrics, "stream"):
+            processed = run_realesrgan_torch_stream(
+                frames_in=reader.stdout,
+                open_writer=open_writer,
+                width=width,
+                height=height,
+                scale=scale,
+                model_name=model,
+                device="cuda",
+                fp16=torch_fp16,
+                cpu_mode=torch_cpu_mode,
+                batch_size=torch_batch_size,
+                tile_size=tile_size,
+                tile_pad=tile_pad,
+                metrics=metrics,
+                out_size=out_size,
+            )
+        if reader.wait() != 0:
+            raise RuntimeError(f"ffmpeg decode failed:\n{read_process_stderr(reader)}")
+        if writer is None or processed == 0:
+            raise RuntimeError("ffmpeg decode produced no frames")
+        if metrics is not None:
+            metrics.frames = processed
+        assert writer.stdin is not None
+        writer.stdin.close()
+        if writer.wait() != 0:
+            raise RuntimeError(f"ffmpeg encode failed:\n{read_process_stderr(writer)}")
+    finally:
+        for proc in (reader, writer):
+            if proc is not None and proc.poll() is None:
+                proc.kill()
+                proc.wait()
 
-        all_frames_in = sorted(frames_in.glob("frame_*.png"))
-        all_frames_out = [frames_out / f.name for f in all_frames_in]
+    return output_path
+
+def _extract_command(
+        input_path: Path,
+        frames_dir: Path,
+        fps: int | float | None = None,
+        frame_format: FrameFormat = FRAME_FORMATS["png"],
+) -> list[str]:
+    pattern_in = frames_dir / f"frame_%06d{frame_format.suffix}"
+    cmd_extract = [
+         "ffmpeg", "-y", "-i", str(input_path),
+    ]
+    if fps is not None:
+         cmd_extract += ["-vf", f"fps={fps}"]
+    cmd_extract += list(frame_format.ffmpeg_args)
+    cmd_extract.append(str(pattern_in))
+    return cmd_extract
+
+def _extract_frames(
+        input_path: Path,
+        frames_dir: Path,
+        fps: int | float | None = None,
+        frame_format: FrameFormat = FRAME_FORMATS["png"],
+) -> list[Path]:
+    """
+    Decode every frame of `input_path` to `frames_dir/frame_%06d<suffix>` in `frame_format`.
+    """
+    cmd_extract = _extract_command(input_path, frames_dir, fps, frame_format)
+
+    console.log("[cyan] extracting frames... [/cyan]")
+    proc = subprocess.run(cmd_extract, capture_output=True, text=True)
+    if proc.returncode != 0:
+         raise RuntimeError(f"ffmpeg extract failed:\n{proc.stderr}")
 
+    return sorted(frames_dir.glob(f"frame_*{frame_format.suffix}"))
+
+def _infer_frames(
+        backend: str,
+        frames: list[Path],
+        work_in: Path,
+        frames_out: Path,
+        work_dir: Path,
+        plan: UpscalePlan,
+        fmt_out: FrameFormat,
+        input_size: tuple[int, int],
+        *,
+        auto_download: bool,
+        torch_batch_size: int,
+        torch_fp16: bool,
+        torch_cpu_mode: str | None,
+        onnx_threads: int | None,
+        torch_decode_workers: int,
+        torch_write_workers: int,
+        torch_prefetch: int,
+        torch_write_queue: int,
+        gpu_id: int | None,
+        gpu_ids: list[int] | None,
+        instances_per_gpu: int,
+        verbose: bool,
+        force_gpu: bool,
+        tile_size: int | None,
+        tile_pad: int,
+        ncnn_threads: str | None,
+        autotune: bool,
+        metrics: JobMetrics | None,
+) -> tuple[str, bool]:
+    """
+    Model pass of the frame-folder path: `frames` (also found in `work_in`) ->
+    `frames_out/<stem><fmt_out.suffix>`; `work_dir` holds shard folders.
+    Returns the backend that ran and whether outputs are already at `plan.out_size`.
+    """
+    all_frames_out = [frames_out / (f.stem + fmt_out.suffix) for f in frames]
+    resized_on_device = False
+
+    with stage(metrics, "infer") as info:
         if backend == "torch":
             console.log(f"[bold green] Launching TORCH-backend (CUDA/FP16) [/bold green]")
-            # Lazy import: keep vulkan backend usable without torch installed.
             try:
-                from .realesrgan_torch import run_realesrgan_torch
+                run_realesrgan_torch = load_backend("torch").run_realesrgan_torch
                 run_realesrgan_torch(
-                    input_paths=all_frames_in,
+                    input_paths=frames,
                     output_paths=all_frames_out,
-                    scale=scale,
-                    model_name=model,
+                    scale=plan.model_scale,
+                    model_name=plan.model,
                     device="cuda", 
                     fp16=torch_fp16,
+                    cpu_mode=torch_cpu_mode,
                     batch_size=torch_batch_size,
+                    decode_workers=torch_decode_workers,
+                    write_workers=torch_write_workers,
+                    prefetch_batches=torch_prefetch,
+                    write_queue_batches=torch_write_queue,
+                    tile_size=tile_size,
+                    tile_pad=tile_pad,
+                    metrics=metrics,
+                    out_size=plan.out_size,
+                    save_options=fmt_out.pil_options,
+                    # Extracted frames share the source size: no header reads.
+                    input_sizes=[input_size] * len(frames),
                 )
+                resized_on_device = True
             except Exception as e:
                 console.print(
                     f"[yellow][upscaler] Torch backend failed ({e}). "
                     f"Falling back to Vulkan/NCNN backend.[/yellow]"
                 )
                 backend = "realesrgan"
+        elif backend == "onnx":
+            console.log("[bold green] Launching ONNX-backend (onnxruntime CPU) [/bold green]")
+            load_backend("onnx").run_realesrgan_onnx(
+                input_paths=frames,
+                output_paths=all_frames_out,
+                scale=plan.model_scale,
+                model_name=plan.model,
+                batch_size=torch_batch_size,
+                tile_size=tile_size,
+                tile_pad=tile_pad,
+                threads=onnx_threads,
+                decode_workers=torch_decode_workers,
+                write_workers=torch_write_workers,
+                metrics=metrics,
+                out_size=plan.out_size,
+                save_options=fmt_out.pil_options,
+            )
+            resized_on_device = True
         else:
             console.log(f"[bold yellow] Launching VULKAN-backend (NCNN/Vulkan) [/bold yellow]")
+            ncnn = load_backend("realesrgan")
             # Fast path: Real-ESRGAN NCNN can process a whole folder of frames in one process.
             # This is dramatically faster than spawning one process per frame.
+            ncnn_tile, ncnn_threads = _ncnn_settings(
+                plan.model, plan.model_scale, gpu_ids[0] if gpu_ids else gpu_id, tile_size, ncnn_threads,
+                autotune = autotune, sample_frames = frames, auto_download = auto_download,
+            )
             try:
-                run_realesrgan(
-                    input_path=frames_in,
-                    output_path=frames_out,
-                    scale=scale,
-                    model_name=model,
-                    auto_download=auto_download,
-                    gpu_id=gpu_id,
-                    verbose=verbose,
-                    force_gpu=force_gpu,
-                )
+                devices: list[int | None] = list(gpu_ids or ([gpu_id] if gpu_id is not None else []))
+                if len(devices) > 1 or instances_per_gpu > 1:
+                    ncnn.run_realesrgan_sharded(
+                        frames=frames,
+                        output_dir=frames_out,
+                        scale=plan.model_scale,
+                        model_name=plan.model,
+                        devices=devices or [None],
+                        work_dir=work_dir / "shards",
+                        instances_per_device=instances_per_gpu,
+                        auto_download=auto_download,
+                        verbose=verbose,
+                        force_gpu=force_gpu,
+                        tile_size=ncnn_tile,
+                        threads=ncnn_threads,
+                        metrics=metrics,
+                        output_format=fmt_out.ncnn_output,
+                    )
+                else:
+                    ncnn.run_realesrgan(
+                        input_path=work_in,
+                        output_path=frames_out,
+                        scale=plan.model_scale,
+                        model_name=plan.model,
+                        auto_download=auto_download,
+                        gpu_id=gpu_id,
+                        verbose=verbose,
+                        force_gpu=force_gpu,
+                        tile_size=ncnn_tile,
+                        threads=ncnn_threads,
+                        metrics=metrics,
+                        output_format=fmt_out.ncnn_output,
+                    )
             except Exception as e:
                 console.print(
                     f"[yellow][upscaler] Folder-mode Vulkan failed ({e}). "
-                    f"Falling back to per-frame mode.[/yellow]"
+                    f"Retrying the missing frames in bisected groups.[/yellow]"
                 )
-                for frame in all_frames_in:
-                    out_frame = frames_out / frame.name
-                    run_realesrgan(
-                        input_path=frame,
-                        output_path=out_frame,
-                        scale=scale,
-                        model_name=model,
+
+                def run_group(group_dir: Path, device: int | None) -> None:
+                    ncnn.run_realesrgan(
+                        input_path=group_dir,
+                        output_path=frames_out,
+                        scale=plan.model_scale,
+                        model_name=plan.model,
                         auto_download=auto_download,
-                        gpu_id=gpu_id,
+                        gpu_id=device,
                         verbose=verbose,
                         force_gpu=force_gpu,
+                        tile_size=ncnn_tile,
+                        threads=ncnn_threads,
+                        metrics=metrics,
+                        output_format=fmt_out.ncnn_output,
                     )
 
-        pattern_out = frames_out / "frame_%06d.png"
+                report = recover_frames(
+                    frames, frames_out, fmt_out.suffix, run_group, work_dir / "recovery",
+                    devices=devices or [None], instances_per_device=instances_per_gpu, metrics=metrics,
+                )
+                if report.failed:
+                    names = ", ".join(f.name for f in report.failed[:10])
+                    first = report.errors.get(report.failed[0].name, "")
+                    raise RuntimeError(
+                        f"RealESRGAN failed on {len(report.failed)} frame(s): {names}"
+                        f"{' ...' if len(report.failed) > 10 else ''}\n{first}"
+                    ) from e
+        if metrics is not None:
+            info.update(frames = len(frames), bytes_out = dir_size(frames_out))
+
+    return backend, resized_on_device
+
+def _upscale_video_rolling(
+        input_path: Path,
+        output_path: Path,
+        backend: str,
+        plan: UpscalePlan,
+        fmt_in: FrameFormat,
+        fmt_out: FrameFormat,
+        input_size: tuple[int, int],
+        fps: float,
+        chunk_frames: int | None,
+        scratch_limit: int | None,
+        scratch_dir: Path | str | None,
+        encoder: EncoderSettings | None,
+        dedup: bool,
+        dedup_tolerance: float,
+        metrics: JobMetrics | None,
+        infer_options: dict,
+        frame_range: tuple[int, int | None] | None = None,
+) -> Path:
+    """Rolling-window variant of the frame-folder path of `upscale_video` (see rolling)."""
+    frame_bytes = estimate_frame_bytes(*input_size, 1, plan.model_scale, fmt_in, fmt_out)
+    chunk_frames = plan_chunk_frames(frame_bytes, chunk_frames, scratch_limit)
+    tmp_dir = make_scratch_dir(ROLLING_WINDOWS * chunk_frames * frame_bytes, scratch_dir, prefix="upscaler_rolling_")
+
+    def infer(frames: list[Path], frames_in: Path, frames_out: Path) -> tuple[int, int] | None:
+        nonlocal backend
+        work_in = frames_in
+        dedup_plan = None
+        if dedup:
+            with stage(metrics, "dedup"):
+                dedup_plan = plan_dedup(frames, tolerance=dedup_tolerance)
+            if dedup_plan.skipped:
+                frames = dedup_plan.unique
+                work_in = frames_in.parent / "unique"
+                link_frames(frames, work_in)
+
+        backend, resized_on_device = _infer_frames(
+            backend, frames, work_in, frames_out, frames_in.parent, plan, fmt_out, input_size, **infer_options,
+        )
+        # Tuned on the first chunk; later chunks use the stored result.
+        infer_options["autotune"] = False
+        if dedup_plan is not None and dedup_plan.skipped:
+            fill_duplicates(dedup_plan, frames_out, suffix=fmt_out.suffix)
+        return plan.out_size if plan.needs_resize and not resized_on_device else None
+
+    start_frame, end_frame = frame_range or (0, None)
+    try:
+        run_rolling(
+            input_path, output_path, tmp_dir, fps, chunk_frames, fmt_in, fmt_out.suffix, infer,
+            encoder=encoder, metrics=metrics,
+            start_frame=start_frame, end_frame=end_frame, audio=frame_range is None,
+        )
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return output_path
+
+@_instrumented
+@_result_cached
+def upscale_video(
+        input_path: Path | str,
+        output_path: Path | str, 
+        scale: int = 2,
+        backend: Backend = "torch", 
+        model: str = "realesrgan-x4plus",
+        fps: int | None = None,
+        auto_download: bool = False,
+        torch_batch_size: int = 4, 
+        torch_fp16: bool = True,
+        torch_cpu_mode: str | None = None,
+        onnx_threads: int | None = None,
+        torch_decode_workers: int = 2,
+        torch_write_workers: int = 2,
+        torch_prefetch: int = 2,
+        torch_write_queue: int = 2,
+        gpu_id: int | None = None,
+        verbose: bool = False,
+        force_gpu: bool = False,
+        stream: bool = False,
+        tile_size: int | None = None,
+        tile_pad: int = 10,
+        dedup: bool = False,
+        dedup_tolerance: float = 0.0,
+        cache_dir: Path | str | None = None,
+        gpu_ids: list[int] | None = None,
+        instances_per_gpu: int = 1,
+        ncnn_threads: str | None = None,
+        autotune: bool = False,
+        metrics: JobMetrics | None = None,
+        target_height: int | None = None,
+        frame_format: str = "png",
+        scratch_dir: Path | str | None = None,
+        encoder: EncoderSettings | None = None,
+        encode_jobs: int = 1,
+        chunk_frames: int | None = None,
+        scratch_limit_gb: float | None = None,
+        frame_range: tuple[int, int | None] | None = None,
+) -> Path: 
+    """
+    Upscale a video by `scale`, or to `target_height` (aspect kept) when given.
+    Model backends run the cheapest model of `model`'s family that reaches the
+    factor (see planner); the remainder is resized on-device (torch) or in the
+    encode pass. The plan is checked before any frame is extracted.
+
+    The frame-folder path writes intermediate frames in `frame_format` (see
+    frame_format.FRAME_FORMATS) under a scratch directory (see scratch; /dev/shm
+    when the frames fit in memory, `scratch_dir` to override).
+
+    `encoder` sets codec/preset/CRF/threads/audio handling for the output (see
+    encode.EncoderSettings); `encode_jobs > 1` encodes frame ranges as parallel
+    segments joined without re-encoding.
+
+    `chunk_frames` switches to rolling-window mode (see rolling): chunks of that
+    many frames are extracted, upscaled and encoded one after another, so scratch
+    use no longer grows with the video. `scratch_limit_gb` caps scratch use: it
+    bounds the chunk size, and a job whose frames would not fit switches to
+    rolling mode on its own.
+
+    `frame_range=(start, end)` only upscales output frames [start, end) (`end=None`:
+    to the end) into a video-only file, in rolling mode; segments.py joins such
+    ranges back into one video.
+    """
+    input_path = Path(input_path)
+    output_path = Path(output_path)
+    if frame_range is not None:
+        if backend in RESAMPLE_BACKENDS:
+            raise ValueError(f"frame_range needs a model backend, not {backend!r}")
+        if frame_range[0] < 0 or (frame_range[1] is not None and frame_range[1] <= frame_range[0]):
+            raise ValueError(f"invalid frame_range {frame_range!r}")
+
+    with stage(metrics, "probe"):
+        input_size = probe_video_size(input_path)
+    if backend == "auto":
+        backend = auto_backend(model, auto_download)
+    if backend in RESAMPLE_BACKENDS:
+        size = output_size(*input_size, factor_for(scale, target_height, input_size), even=True)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        # Decode, resize and encode overlap inside one ffmpeg process.
+        with stage(metrics, "stream") as info:
+            frames = upscale_video_bicubic(
+                input_path, output_path, scale, method=backend, fps=fps, size=size, encoder=encoder,
+            )
+            info.update(bytes_in=_file_size(input_path), bytes_out=_file_size(output_path))
+        if metrics is not None:
+            metrics.frames = frames
+        return output_path
+
+    plan = plan_upscale(model, scale, target_height, input_size, backend, even=True)
+    fmt_in = get_frame_format(frame_format)
+    fmt_out = output_format(fmt_in, backend)
+    if plan.model != model:
+        console.log(f"[cyan] planner: {plan.factor:g}x via {plan.model} ({plan.model_scale}x)[/cyan]")
+    if backend == "torch" and torch_cpu_mode is not None and backend_available("torch"):
+        # A typo here would otherwise only surface as a torch failure (and the NCNN fallback) after extraction.
+        load_backend("torch").parse_cpu_mode(torch_cpu_mode)
+    if backend == "realesrgan":
+        # Device check before extraction: a software-only Vulkan fails (force_gpu) or warns now.
+        if gpu_ids:
+            gpu_ids = [preflight_gpu(plan.model, g, force_gpu, auto_download) for g in gpu_ids]
+        else:
+            gpu_id = preflight_gpu(plan.model, gpu_id, force_gpu, auto_download)
+
+    if backend == "torch" and stream and frame_range is None:
+        # Streaming path: rawvideo pipes in and out, no frames on disk.
+        try:
+            return _upscale_video_torch_stream(
+                input_path,
+                output_path,
+                scale=plan.model_scale,
+                model=plan.model,
+                fps=fps,
+                torch_batch_size=torch_batch_size,
+                torch_fp16=torch_fp16,
+                torch_cpu_mode=torch_cpu_mode,
+                tile_size=tile_size,
+                tile_pad=tile_pad,
+                metrics=metrics,
+                out_size=plan.out_size,
+                encoder=encoder,
+            )
+        except Exception as e:
+            console.print(
+                f"[yellow][upscaler] Streaming torch pipeline failed ({e}). "
+                f"Falling back to frame-folder mode.[/yellow]"
+            )
+    
+    with stage(metrics, "probe"):
         out_fps = float(fps) if fps is not None else _probe_fps(input_path)
-        cmd_assemble = [
-            "ffmpeg", "-y", 
-            "-framerate", str(out_fps),
-            "-i", str(pattern_out),
-            "-i", str(input_path),
-            "-map", "0:v:0",
-            "-map", "1:a:0?",
-            "-c:v", "libx264", "-pix_fmt", "yuv420p", 
-            "-c:a", "aac",
-            "-shortest",
-            str(output_path),
-        ]
-        console.log("[cyan] Assemling video... [/cyan]")
-        proc2 = subprocess.run(cmd_assemble, capture_output=True, text=True)
-        if proc2.returncode != 0:
-             raise RuntimeError(f"ffmpeg assemble failed:\n{proc2.stderr}")
+        n_frames = frame_count_hint(probe_duration(input_path), out_fps)
+    if frame_range is not None:
+        start, end = frame_range
+        # The open last range gets a second of slack: the duration-based count is a hint.
+        n_frames = max(1, end - start if end is not None else n_frames - start + int(out_fps))
+        # A range always runs rolling, in one chunk unless a chunk size or limit says otherwise.
+        if not chunk_frames and scratch_limit_gb is None:
+            chunk_frames = n_frames
+    infer_options = dict(
+        auto_download=auto_download,
+        torch_batch_size=torch_batch_size,
+        torch_fp16=torch_fp16,
+        torch_cpu_mode=torch_cpu_mode,
+        onnx_threads=onnx_threads,
+        torch_decode_workers=torch_decode_workers,
+        torch_write_workers=torch_write_workers,
+        torch_prefetch=torch_prefetch,
+        torch_write_queue=torch_write_queue,
+        gpu_id=gpu_id,
+        gpu_ids=gpu_ids,
+        instances_per_gpu=instances_per_gpu,
+        verbose=verbose,
+        force_gpu=force_gpu,
+        tile_size=tile_size,
+        tile_pad=tile_pad,
+        ncnn_threads=ncnn_threads,
+        autotune=autotune,
+        metrics=metrics,
+    )
+    # Checked before extraction: fail now rather than with a half-full disk.
+    estimate = estimate_frame_bytes(*input_size, n_frames, plan.model_scale, fmt_in, fmt_out)
+    scratch_limit = int(scratch_limit_gb * 1024 ** 3) if scratch_limit_gb else None
+    if chunk_frames or frame_range is not None or (scratch_limit is not None and estimate > scratch_limit):
+        return _upscale_video_rolling(
+            input_path, output_path, backend, plan, fmt_in, fmt_out, input_size, out_fps,
+            chunk_frames, scratch_limit, scratch_dir, encoder, dedup, dedup_tolerance, metrics, infer_options,
+            frame_range,
+        )
+    tmp_dir = make_scratch_dir(estimate, scratch_dir)
+    frames_in = tmp_dir / "in"
+    frames_out = tmp_dir / "out"
+    frames_in.mkdir(parents=True, exist_ok=True)
+    frames_out.mkdir(parents=True, exist_ok=True)
+
+    try:
+        with stage(metrics, "extract") as info:
+            all_frames_in = _extract_frames(input_path, frames_in, fps, fmt_in)
+            if metrics is not None:
+                info.update(bytes_in = _file_size(input_path), bytes_out = dir_size(frames_in))
+        if metrics is not None:
+            metrics.frames = len(all_frames_in)
+
+        # Only unique frames go through the model; repeats are filled in afterwards.
+        work_in = frames_in
+        dedup_plan = None
+        if dedup:
+            with stage(metrics, "dedup"):
+                dedup_plan = plan_dedup(all_frames_in, tolerance=dedup_tolerance)
+            console.log(
+                f"[cyan] dedup: {dedup_plan.skipped}/{len(all_frames_in)} frames are repeats, "
+                f"upscaling {len(dedup_plan.unique)} [/cyan]"
+            )
+            if dedup_plan.skipped:
+                all_frames_in = dedup_plan.unique
+                work_in = tmp_dir / "unique"
+                link_frames(all_frames_in, work_in)
+
+        backend, resized_on_device = _infer_frames(
+            backend, all_frames_in, work_in, frames_out, tmp_dir, plan, fmt_out, input_size, **infer_options,
+        )
+
+        if dedup_plan is not None and dedup_plan.skipped:
+            fill_duplicates(dedup_plan, frames_out, suffix=fmt_out.suffix)
+
+        with stage(metrics, "assemble") as info:
+            size = plan.out_size if plan.needs_resize and not resized_on_device else None
+            assemble_frames(
+                frames_out, input_path, output_path, out_fps, size, fmt_out.suffix,
+                encoder=encoder, jobs=encode_jobs, metrics=metrics,
+            )
+            if metrics is not None:
+                info.update(bytes_out = _file_size(output_path))
 
     finally:
+        if metrics is not None:
+            metrics.scratch_bytes = dir_size(tmp_dir)
         shutil.rmtree(tmp_dir, ignore_errors=True)
 
     return output_path
\ No newline at end of file
@@ -0,0 +1,176 @@
+# upscaler/upscaler/autotune.py
+"""
+Per-host tuning of the NCNN binary's tile size (-t) and load:proc:save threads (-j).
+
+`autotune_ncnn` times short folder-mode runs over a few sample frames, first over
+thread splits (with the binary's automatic tile size), then over tile sizes with
+the best split. Settings that fail (e.g. a tile too big for VRAM) are skipped.
+The winner is stored in a JSON file keyed by host, binary, device and model so
+later runs pick it up through `lookup_ncnn_settings`.
+
+Environment:
+- UPSCALER_TUNE_FILE: where results are stored (default ~/.cache/upscaler/ncnn_tune.json)
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional, Sequence
+
+from rich.console import Console
+
+from .realesrgan_vulkan import run_realesrgan
+
+console = Console()
+
+DEFAULT_THREAD_CANDIDATES = ("1:2:2", "2:4:2", "2:8:4", "4:16:4")
+DEFAULT_TILE_CANDIDATES = (512, 256, 128)
+
+
+@dataclass
+class NcnnSettings:
+    tile_size: Optional[int] = None
+    threads: Optional[str] = None
+    frames_per_sec: float = 0.0
+
+
+def tune_file() -> Path:
+    env = os.environ.get("UPSCALER_TUNE_FILE")
+    return Path(env) if env else Path.home() / ".cache" / "upscaler" / "ncnn_tune.json"
+
+
+def device_key(model_name: str, scale: int, gpu_id: Optional[int]) -> str:
+    from .downloads import ensure_realesrgan_binary
+
+    binary = ensure_realesrgan_binary(auto_download=False)
+    device = "auto" if gpu_id is None else str(gpu_id)
+    return f"{socket.gethostname()}|{binary.resolve()}|gpu={device}|{model_name}|x{scale}"
+
+
+def _load() -> dict:
+    try:
+        return json.loads(tune_file().read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _store(key: str, settings: NcnnSettings) -> None:
+    path = tune_file()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = _load()
+    data[key] = asdict(settings)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=2, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def lookup_ncnn_settings(model_name: str, scale: int, gpu_id: Optional[int]) -> Optional[NcnnSettings]:
+    entry = _load().get(device_key(model_name, scale, gpu_id))
+    if not entry:
+        return None
+    return NcnnSettings(**entry)
+
+
+def _trial(
+        sample_dir: Path,
+        out_dir: Path,
+        n_frames: int,
+        scale: int,
+        model_name: str,
+        gpu_id: Optional[int],
+        tile_size: Optional[int],
+        threads: Optional[str],
+        auto_download: bool,
+) -> Optional[float]:
+    shutil.rmtree(out_dir, ignore_errors=True)
+    t0 = time.perf_counter()
+    try:
+        run_realesrgan(
+            input_path=sample_dir,
+            output_path=out_dir,
+            scale=scale,
+            model_name=model_name,
+            auto_download=auto_download,
+            gpu_id=gpu_id,
+            tile_size=tile_size,
+            threads=threads,
+        )
+    except Exception as e:
+        console.print(f"[yellow][autotune] -t {tile_size} -j {threads} failed: {str(e).splitlines()[0]}[/yellow]")
+        return None
+    elapsed = time.perf_counter() - t0
+    if len(list(out_dir.iterdir())) != n_frames:
+        return None
+    fps = n_frames / elapsed if elapsed > 0 else 0.0
+    console.log(f"[cyan][autotune] -t {tile_size} -j {threads}: {fps:.2f} frames/s[/cyan]")
+    return fps
+
+
+def autotune_ncnn(
+        sample_frames: Sequence[Path],
+        model_name: str,
+        scale: int,
+        gpu_id: Optional[int] = None,
+        thread_candidates: Sequence[str] = DEFAULT_THREAD_CANDIDATES,
+        tile_candidates: Sequence[int] = DEFAULT_TILE_CANDIDATES,
+        auto_download: bool = False,
+        save: bool = True,
+) -> NcnnSettings:
+    """
+    Find the fastest working -j/-t combination for this device and model on
+    `sample_frames` and (by default) store it for later runs.
+    """
+    frames = list(sample_frames)
+    if not frames:
+        raise ValueError("autotune needs at least one sample frame")
+
+    work = Path(tempfile.mkdtemp(prefix="upscaler_tune_"))
+    try:
+        sample_dir = work / "in"
+        sample_dir.mkdir()
+        for i, frame in enumerate(frames):
+            shutil.copy2(frame, sample_dir / f"{i:04d}{frame.suffix}")
+        out_dir = work / "out"
+
+        def trial(tile_size: Optional[int], threads: Optional[str]) -> Optional[float]:
+            return _trial(sample_dir, out_dir, len(frames), scale, model_name, gpu_id, tile_size, threads, auto_download)
+
+        # Warm-up run: first launch pays shader compilation / pipeline cache costs.
+        trial(None, None)
+
+        best = NcnnSettings()
+        for threads in thread_candidates:
+            fps = trial(None, threads)
+            if fps is not None and fps > best.frames_per_sec:
+                best = NcnnSettings(tile_size=None, threads=threads, frames_per_sec=fps)
+        for tile_size in tile_candidates:
+            fps = trial(tile_size, best.threads)
+            if fps is not None and fps > best.frames_per_sec:
+                best = NcnnSettings(tile_size=tile_size, threads=best.threads, frames_per_sec=fps)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    if best.frames_per_sec <= 0:
+        raise RuntimeError("autotune: no NCNN setting completed successfully")
+
+    console.log(
+        f"[green][autotune] best: -t {best.tile_size} -j {best.threads} "
+        f"({best.frames_per_sec:.2f} frames/s)[/green]"
+    )
+    if save:
+        _store(device_key(model_name, scale, gpu_id), best)
+    return best
+
+
+def sample_evenly(frames: Sequence[Path], count: int = 8) -> list[Path]:
+    frames = list(frames)
+    if len(frames) <= count:
+        return frames
+    step = len(frames) / count
+    return [frames[int(i * step)] for i in range(count)]
@@ -0,0 +1,79 @@
+# upscaler/upscaler/backends.py
+"""
+Registry of upscaling backends.
+
+Entries only name the module implementing a backend and the packages it needs,
+so looking a backend up, listing backends or checking availability imports
+nothing heavy; the module is imported on first `load_backend`.
+
+    backend      module               needs
+    bicubic      resample             Pillow
+    lanczos      resample             Pillow
+    realesrgan   realesrgan_vulkan    the NCNN binary (checked when run)
+    torch        realesrgan_torch     torch, torchvision, basicsr
+    onnx         realesrgan_onnx      onnxruntime, numpy, Pillow (torch once, to export the graph)
+"""
+from __future__ import annotations
+
+import importlib
+import importlib.util
+from dataclasses import dataclass
+from types import ModuleType
+
+
+@dataclass(frozen=True)
+class BackendSpec:
+    name: str
+    # Module implementing the backend, relative to this package (or absolute).
+    module: str
+    # Top-level packages that must be importable.
+    requires: tuple[str, ...] = ()
+    # Message for a failed import; `{error}` is the import error.
+    unavailable: str = "{name} backend is not available ({error})."
+
+
+BACKENDS: dict[str, BackendSpec] = {}
+
+
+def register_backend(spec: BackendSpec) -> None:
+    BACKENDS[spec.name] = spec
+
+
+register_backend(BackendSpec("bicubic", ".resample", ("PIL",)))
+register_backend(BackendSpec("lanczos", ".resample", ("PIL",)))
+register_backend(BackendSpec("realesrgan", ".realesrgan_vulkan"))
+register_backend(BackendSpec(
+    "torch", ".realesrgan_torch", ("torch", "torchvision", "basicsr"),
+    unavailable = (
+        "PyTorch backend requested but torch/torchvision is not available ({error}). "
+        "Use --backend realesrgan for the Vulkan/NCNN backend."
+    ),
+))
+register_backend(BackendSpec(
+    "onnx", ".realesrgan_onnx", ("onnxruntime", "numpy", "PIL"),
+    unavailable = (
+        "ONNX backend requested but onnxruntime is not available ({error}). "
+        "Install it with `pip install onnxruntime` (or the `onnx` extra)."
+    ),
+))
+
+
+def get_backend_spec(name: str) -> BackendSpec:
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown backend: {name!r} (expected one of {', '.join(BACKENDS)})") from None
+
+
+def backend_available(name: str) -> bool:
+    """Whether the packages `name` needs are installed, without importing them."""
+    return all(importlib.util.find_spec(pkg) is not None for pkg in get_backend_spec(name).requires)
+
+
+def load_backend(name: str) -> ModuleType:
+    """Import and return the module implementing backend `name` (RuntimeError if it cannot be imported)."""
+    spec = get_backend_spec(name)
+    try:
+        return importlib.import_module(spec.module, __package__)
+    except Exception as e:
+        raise RuntimeError(spec.unavailable.format(name = name, error = e)) from e
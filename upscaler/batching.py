@@ -0,0 +1,144 @@
+# upscaler/upscaler/batching.py
+"""
+Adaptive batch sizes and resolution buckets for batched inference.
+
+`BatchController` keeps one batch size per key (model, device, input shape). A key
+starts at the requested size, doubles after a run of successful batches until the
+first out-of-memory, then grows one frame at a time up to just below the smallest
+size that failed; an OOM falls back to the largest size that fit (halves it when
+none did). Sizes live in the process-wide `BATCH_SIZES`, so a worker daemon
+learns them once per resolution and device, not once per job.
+
+`plan_buckets` groups inputs of different resolutions into shapes they can be
+padded to, so a folder of assorted stills still runs in batches. A size with
+fewer inputs than a batch joins a larger bucket when the padding wastes at most
+`max_pad` of that bucket's area; sizes that fill batches on their own stay exact.
+
+Backend-agnostic (no torch import), like model_cache.
+"""
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from typing import Hashable, Optional, Sequence
+
+# Successful full batches before a key grows, and before a remembered OOM limit
+# is retried (memory may have been freed by another job since).
+GROW_AFTER = 2
+RETRY_LIMIT_AFTER = 64
+
+
+@dataclass
+class _BatchState:
+    size: int
+    limit: Optional[int] = None  # smallest batch size that ran out of memory
+    good: int = 0  # largest batch size that fit
+    streak: int = 0
+
+
+class BatchController:
+    def __init__(self, grow_after: int = GROW_AFTER, retry_limit_after: int = RETRY_LIMIT_AFTER):
+        self.grow_after = max(1, grow_after)
+        self.retry_limit_after = max(1, retry_limit_after)
+        self._states: dict[Hashable, _BatchState] = {}
+        self._lock = threading.Lock()
+
+    def size(self, key: Hashable, start: int, ceiling: int) -> int:
+        """Current batch size for `key` (`start` for a new key), at most `ceiling`."""
+        with self._lock:
+            state = self._states.setdefault(key, _BatchState(max(1, start)))
+            return max(1, min(state.size, ceiling))
+
+    def success(self, key: Hashable, n: int, ceiling: int) -> None:
+        """Record a batch of `n` that fit; full batches count towards growing."""
+        with self._lock:
+            state = self._states.setdefault(key, _BatchState(max(1, n)))
+            if n < min(state.size, ceiling):
+                # A short tail batch says nothing about larger ones.
+                return
+            state.good = max(state.good, n)
+            state.streak += 1
+            if state.limit is not None and state.streak >= self.retry_limit_after:
+                state.limit += 1
+                state.streak = 0
+            if state.streak < self.grow_after:
+                return
+            cap = ceiling if state.limit is None else min(ceiling, state.limit - 1)
+            grown = state.size * 2 if state.limit is None else state.size + 1
+            if min(grown, cap) > state.size:
+                state.size = min(grown, cap)
+                state.streak = 0
+
+    def oom(self, key: Hashable, n: int) -> int:
+        """Record that a batch of `n` ran out of memory; returns the size to retry with."""
+        with self._lock:
+            state = self._states.setdefault(key, _BatchState(max(1, n)))
+            state.limit = n if state.limit is None else min(state.limit, n)
+            if state.good >= n:
+                state.good = 0  # memory got tighter: what fit before no longer counts
+            state.size = state.good if state.good else max(1, min(state.size, n) // 2)
+            state.streak = 0
+            return state.size
+
+    def snapshot(self) -> dict[Hashable, int]:
+        with self._lock:
+            return {k: s.size for k, s in self._states.items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._states.clear()
+
+
+BATCH_SIZES = BatchController()
+
+
+@dataclass
+class Bucket:
+    """Inputs (by index) that run padded to one `size` (width, height)."""
+    size: tuple[int, int]
+    indices: list[int] = field(default_factory=list)
+
+
+def aligned_size(width: int, height: int, multiple: int = 1) -> tuple[int, int]:
+    """(width, height) rounded up to a multiple of `multiple`."""
+    m = max(1, multiple)
+    return (-(-width // m) * m, -(-height // m) * m)
+
+
+def plan_buckets(
+        sizes: Sequence[tuple[int, int]],
+        batch_size: int,
+        max_pad: float = 0.0,
+        multiple: int = 1,
+) -> list[Bucket]:
+    """
+    Group inputs of `sizes` (width, height) into buckets, largest sizes first.
+    Every bucket size is a multiple of `multiple` (what the model needs) and
+    `max_pad=0` only groups equal sizes. Buckets come out in the order of their
+    first input, indices in input order.
+    """
+    groups: dict[tuple[int, int], list[int]] = {}
+    for i, (w, h) in enumerate(sizes):
+        groups.setdefault(aligned_size(w, h, multiple), []).append(i)
+
+    buckets: list[Bucket] = []
+    for size in sorted(groups, key=lambda s: (s[0] * s[1], s), reverse=True):
+        idxs = groups[size]
+        target = None
+        if len(idxs) < batch_size and max_pad > 0:
+            fits = [
+                b for b in buckets
+                if size[0] <= b.size[0] and size[1] <= b.size[1]
+                and 1.0 - (size[0] * size[1]) / (b.size[0] * b.size[1]) <= max_pad
+            ]
+            # Least padding wins.
+            target = min(fits, key=lambda b: b.size[0] * b.size[1], default=None)
+        if target is None:
+            buckets.append(Bucket(size, list(idxs)))
+        else:
+            target.indices.extend(idxs)
+
+    for b in buckets:
+        b.indices.sort()
+    buckets.sort(key=lambda b: b.indices[0])
+    return buckets
@@ -0,0 +1,337 @@
+# upscaler/upscaler/bench.py
+"""
+Benchmark suite: synthetic inputs through `upscale_image` / `upscale_video` per backend.
+
+Inputs are generated with ffmpeg's `testsrc` (plus a sine audio track for clips).
+Every case runs in a fresh process, so model loading is included (cold start) and
+peak RSS is measured per case, for Python itself and for child processes
+(ffmpeg, the NCNN binary) separately. Results are a JSON document that can be
+saved as a baseline and compared against later runs.
+
+`measure_startup` times CLI startup in fresh interpreters (`upscaler bench
+--startup`): import time of `upscaler.cli`, `upscaler --help`, and which heavy
+modules got imported on the way.
+"""
+from __future__ import annotations
+
+import importlib.util
+import json
+import multiprocessing as mp
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Sequence
+
+from rich.console import Console
+
+from .backends import get_backend_spec
+
+console = Console()
+
+BENCH_VERSION = 1
+DEFAULT_BACKENDS = ("bicubic", "realesrgan", "torch", "onnx")
+DEFAULT_SIZES = ((320, 180), (640, 360))
+DEFAULT_SECONDS = (1.0,)
+
+
+@dataclass
+class BenchCase:
+    kind: str               # "image" | "video"
+    backend: str
+    width: int
+    height: int
+    seconds: float = 0.0
+    fps: int = 24
+    scale: int = 4
+    model: str = "realesrgan-x4plus"
+    options: dict = field(default_factory=dict)
+
+    @property
+    def case_id(self) -> str:
+        base = f"{self.kind}/{self.backend}/{self.width}x{self.height}"
+        return base + (f"/{self.seconds:g}s@{self.fps}" if self.kind == "video" else "")
+
+
+def make_clip(path: Path, width: int, height: int, seconds: float, fps: int = 24) -> Path:
+    cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc=size={width}x{height}:rate={fps}",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+        "-t", f"{seconds}",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac",
+        str(path),
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg testsrc clip failed:\n{proc.stderr}")
+    return path
+
+
+def make_image(path: Path, width: int, height: int) -> Path:
+    cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc=size={width}x{height}",
+        "-frames:v", "1",
+        str(path),
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg testsrc image failed:\n{proc.stderr}")
+    return path
+
+
+def backend_available(backend: str) -> Optional[str]:
+    """None when `backend` can run here, else the reason it is skipped."""
+    if shutil.which("ffmpeg") is None:
+        return "ffmpeg not found"
+    if backend == "realesrgan":
+        from .config import DEFAULT_REALESRGAN_BIN
+
+        if not DEFAULT_REALESRGAN_BIN.exists():
+            return f"binary not found at {DEFAULT_REALESRGAN_BIN}"
+    # find_spec instead of importing: the parent must stay small (see metrics.peak_memory).
+    for mod in get_backend_spec(backend).requires:
+        if importlib.util.find_spec(mod) is None:
+            return f"{backend} backend unavailable ({mod} not installed)"
+    return None
+
+
+def _run_case(case: BenchCase, input_path: str, work_dir: str, conn) -> None:
+    # Child process entry point.
+    from .api import upscale_image, upscale_video
+    from .metrics import JobMetrics, peak_memory
+
+    metrics = JobMetrics()
+    suffix = ".mp4" if case.kind == "video" else ".png"
+    output_path = Path(work_dir) / f"out{suffix}"
+    t0 = time.perf_counter()
+    try:
+        if case.kind == "video":
+            upscale_video(
+                input_path, output_path, scale=case.scale, backend=case.backend,  # type: ignore[arg-type]
+                model=case.model, metrics=metrics, **case.options,
+            )
+        else:
+            upscale_image(
+                input_path, output_path, scale=case.scale, backend=case.backend,  # type: ignore[arg-type]
+                model=case.model, metrics=metrics, **case.options,
+            )
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall = time.perf_counter() - t0
+    rss_self, rss_children = peak_memory()
+    conn.send({
+        "wall_s": wall,
+        "metrics": metrics.to_dict(),
+        "peak_rss_bytes": rss_self,
+        "peak_child_rss_bytes": rss_children,
+        "output_bytes": output_path.stat().st_size if output_path.exists() else 0,
+        "error": error,
+    })
+    conn.close()
+
+
+def run_case(case: BenchCase, input_path: Path, work_dir: Path, timeout: float = 3600) -> dict:
+    ctx = mp.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_case, args=(case, str(input_path), str(work_dir), child))
+    proc.start()
+    child.close()
+    result = parent.recv() if parent.poll(timeout) else {"error": f"timed out after {timeout}s"}
+    proc.join(timeout=10)
+    if proc.is_alive():
+        proc.kill()
+
+    frames = (result.get("metrics") or {}).get("frames") or 0
+    stages = (result.get("metrics") or {}).get("stages") or {}
+    infer_s = stages.get("infer") or stages.get("stream") or result.get("wall_s") or 0.0
+    result.update({
+        "case": case.case_id,
+        "kind": case.kind,
+        "backend": case.backend,
+        "frames": frames,
+        "fps_end_to_end": frames / result["wall_s"] if result.get("wall_s") and frames else 0.0,
+        "fps_infer": frames / infer_s if infer_s and frames else 0.0,
+    })
+    return result
+
+
+def build_cases(
+        backends: Sequence[str] = DEFAULT_BACKENDS,
+        sizes: Sequence[tuple[int, int]] = DEFAULT_SIZES,
+        seconds: Sequence[float] = DEFAULT_SECONDS,
+        fps: int = 24,
+        scale: int = 4,
+        realesrgan_gpu_id: Optional[int] = -1,
+) -> list[BenchCase]:
+    cases = []
+    for backend in backends:
+        options: dict = {}
+        if backend == "realesrgan" and realesrgan_gpu_id is not None:
+            options["gpu_id"] = realesrgan_gpu_id
+        if backend == "torch":
+            options["torch_fp16"] = False
+        for w, h in sizes:
+            cases.append(BenchCase("image", backend, w, h, scale=scale, options=dict(options)))
+            for sec in seconds:
+                cases.append(BenchCase("video", backend, w, h, sec, fps, scale=scale, options=dict(options)))
+    return cases
+
+
+def run_bench(cases: Sequence[BenchCase], work_root: Optional[Path] = None) -> dict:
+    work_root = Path(work_root or tempfile.mkdtemp(prefix="upscaler_bench_"))
+    inputs: dict[tuple, Path] = {}
+    results = []
+    skipped: dict[str, str] = {}
+    try:
+        for case in cases:
+            reason = backend_available(case.backend)
+            if reason is not None:
+                skipped[case.backend] = reason
+                continue
+
+            key = (case.kind, case.width, case.height, case.seconds, case.fps)
+            if key not in inputs:
+                name = f"{case.kind}_{case.width}x{case.height}_{case.seconds:g}s_{case.fps}"
+                if case.kind == "video":
+                    inputs[key] = make_clip(work_root / f"{name}.mp4", case.width, case.height, case.seconds, case.fps)
+                else:
+                    inputs[key] = make_image(work_root / f"{name}.png", case.width, case.height)
+
+            case_dir = work_root / case.case_id.replace("/", "_").replace("@", "_")
+            case_dir.mkdir(parents=True, exist_ok=True)
+            console.log(f"[cyan][bench] {case.case_id}[/cyan]")
+            result = run_case(case, inputs[key], case_dir)
+            if result.get("error"):
+                console.print(f"[yellow][bench] {case.case_id} failed: {result['error']}[/yellow]")
+            results.append(result)
+            shutil.rmtree(case_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    return {
+        "version": BENCH_VERSION,
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "cases": results,
+        "skipped": skipped,
+    }
+
+
+@dataclass
+class Regression:
+    case: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def change(self) -> float:
+        return (self.current - self.baseline) / self.baseline if self.baseline else 0.0
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.10) -> list[Regression]:
+    """
+    Cases present in both runs whose throughput dropped, or whose peak RSS or
+    scratch usage grew, by more than `tolerance` (relative).
+    """
+    base_cases = {c["case"]: c for c in baseline.get("cases", []) if not c.get("error")}
+    regressions = []
+    for cur in current.get("cases", []):
+        base = base_cases.get(cur["case"])
+        if base is None or cur.get("error"):
+            continue
+        for metric in ("fps_end_to_end", "fps_infer"):
+            b, c = base.get(metric) or 0.0, cur.get(metric) or 0.0
+            if b > 0 and c < b * (1 - tolerance):
+                regressions.append(Regression(cur["case"], metric, b, c))
+        for metric in ("peak_rss_bytes", "peak_child_rss_bytes"):
+            b, c = base.get(metric) or 0, cur.get(metric) or 0
+            if b > 0 and c > b * (1 + tolerance):
+                regressions.append(Regression(cur["case"], metric, b, c))
+        b = (base.get("metrics") or {}).get("scratch_bytes") or 0
+        c = (cur.get("metrics") or {}).get("scratch_bytes") or 0
+        if b > 0 and c > b * (1 + tolerance):
+            regressions.append(Regression(cur["case"], "scratch_bytes", b, c))
+    return regressions
+
+
+def load_report(path: Path) -> dict:
+    return json.loads(Path(path).read_text())
+
+
+def save_report(report: dict, path: Path) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, sort_keys=True))
+
+
+# Imported only on the code paths that need them; never just to start the CLI.
+STARTUP_FORBIDDEN = (
+    "torch", "torchvision", "basicsr", "numpy", "PIL", "http.client",
+    "upscaler.api", "upscaler.realesrgan_torch", "upscaler.realesrgan_vulkan",
+)
+DEFAULT_STARTUP_BUDGET_MS = 500.0
+
+
+def _timed(cmd: list[str]) -> tuple[float, subprocess.CompletedProcess]:
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    return (time.perf_counter() - t0) * 1000, proc
+
+
+def _import_times(stderr: str) -> dict[str, float]:
+    # `-X importtime` lines: "import time: self [us] | cumulative | imported package"
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def measure_startup(runs: int = 5) -> dict:
+    """Best-of-`runs` CLI startup timings, each in a fresh interpreter."""
+    py = sys.executable
+    probe = "import json, sys, upscaler.cli; print(json.dumps(sorted(sys.modules)))"
+    bare, imports, helps = [], [], []
+    modules: list[str] = []
+    top: dict[str, float] = {}
+    for _ in range(max(1, runs)):
+        bare.append(_timed([py, "-c", "pass"])[0])
+        ms, proc = _timed([py, "-X", "importtime", "-c", probe])
+        if proc.returncode != 0:
+            raise RuntimeError(f"importing upscaler.cli failed:\n{proc.stderr[-2000:]}")
+        times = _import_times(proc.stderr)
+        imports.append(times.get("upscaler.cli", ms))
+        if not top:
+            modules = json.loads(proc.stdout)
+            top = dict(sorted(times.items(), key=lambda kv: -kv[1])[:10])
+        helps.append(_timed([py, "-c", "from upscaler.cli import app; app()", "--help"])[0])
+    return {
+        "python_ms": min(bare),
+        "import_ms": min(imports),
+        "help_ms": min(helps),
+        "slowest_imports_ms": top,
+        "forbidden_modules": [m for m in STARTUP_FORBIDDEN if m in modules],
+    }
+
+
+def check_startup(report: dict, budget_ms: float = DEFAULT_STARTUP_BUDGET_MS) -> list[str]:
+    """Problems with a `measure_startup` report: over budget or heavy modules imported."""
+    problems = []
+    if report["import_ms"] > budget_ms:
+        problems.append(f"importing upscaler.cli took {report['import_ms']:.0f} ms (budget {budget_ms:.0f} ms)")
+    for mod in report["forbidden_modules"]:
+        problems.append(f"{mod} is imported at CLI startup")
+    return problems
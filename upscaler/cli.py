@@ -1,23 +1,54 @@
 # upscaler/upscaler/cli.py
+from dataclasses import asdict, is_dataclass
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
+import os
 
 import typer 	
 from rich.console import Console
 
-from .api import upscale_image, upscale_video
+if TYPE_CHECKING:
+	from .client import UpscalerClient
+	from .result_cache import ResultCache
+
+# Only typer/rich at import time: `--help` and argument errors must stay fast.
+# Commands import the pipeline (and through the backend registry, the backends)
+# when they run; `upscaler bench --startup` checks the budget.
 
 console = Console()
 
+class _RunByDefault(typer.core.TyperGroup):
+	"""Command group that treats `upscaler <input> ...` as `upscaler run <input> ...`."""
+
+	def parse_args(self, ctx, args):
+		first = args[0] if args else None
+		group_option = first is not None and (
+			first in ctx.help_option_names or first.startswith(("--install-completion", "--show-completion"))
+		)
+		if first is not None and first not in self.commands and not group_option:
+			args = ["run", *args]
+		return super().parse_args(ctx, args)
+
+# The CLI was a single command (`upscaler input.mp4 ...`); it still is by
+# default, the other commands are only picked by name.
 app = typer.Typer(
-	help = "Simple CLI for image/video upscaling"
+	cls = _RunByDefault,
+	help = "Simple CLI for image/video upscaling (`upscaler <input> ...` is `upscaler run <input> ...`)"
 )
 
+def _parse_int_list(value: Optional[str], name: str) -> Optional[list[int]]:
+	if not value:
+		return None
+	try:
+		return [int(v) for v in value.split(",") if v.strip()]
+	except ValueError:
+		raise typer.BadParameter(f"{name} must be a comma-separated list of integers, got {value!r}")
+
 @app.command()
 def run(
 	input_path: Path = typer.Argument(
 		...,
-		help = "Path to input file(image or video)",
+		help = "Path to input file(image or video). In image mode also a directory or a quoted glob ('shots/*.png')",
 	),
 	output_path: Optional[Path] = typer.Option(
 		None,
@@ -35,7 +66,7 @@ def run(
 		"realesrgan",
 		"--backend",
 		"-b",
-		help = "Backend: bicubic / realesrgan / torch",
+		help = "Backend: bicubic / lanczos / realesrgan / torch / onnx / auto (Vulkan GPU, else CUDA torch, else onnx)",
 	),
 	scale: int = typer.Option(
 		2,
@@ -43,6 +74,11 @@ def run(
 		"-s",
 		help = "Scale factor (2/3/4)",
 	),
+	target_height: Optional[int] = typer.Option(
+		None,
+		"--target-height",
+		help = "Output height in pixels (e.g. 2160), aspect kept; overrides --scale",
+	),
 	model: str = typer.Option(
 		"realesrgan-x4plus",
 		"--model",
@@ -58,6 +94,26 @@ def run(
 		"--gpu-id",
 		help = "RealESRGAN NCNN/Vulkan GPU id. 0/1/2... selects a Vulkan device; -1 forces CPU; default=auto.",
 	),
+	gpu_ids: Optional[str] = typer.Option(
+		None,
+		"--gpu-ids",
+		help = "Video, RealESRGAN NCNN: comma-separated device ids to shard frames over, e.g. 0,1 or -1,-1 for two CPU instances",
+	),
+	instances_per_gpu: int = typer.Option(
+		1,
+		"--instances-per-gpu",
+		help = "Video, RealESRGAN NCNN: binary instances to run concurrently per device",
+	),
+	ncnn_threads: Optional[str] = typer.Option(
+		None,
+		"--ncnn-threads",
+		help = "RealESRGAN NCNN load:proc:save thread counts (-j), e.g. 1:2:2",
+	),
+	autotune: bool = typer.Option(
+		False,
+		"--autotune",
+		help = "RealESRGAN NCNN: time -j/-t settings on sample frames and store the fastest for this device",
+	),
 	verbose: bool = typer.Option(
 		False,
 		"--verbose",
@@ -80,19 +136,198 @@ def run(
 		"--fp16/--no-fp16",
 		help = "Enable FP16 precision for PyTorch backend (requires modern NVIDIA GPU)",
 	),
+	onnx_threads: Optional[int] = typer.Option(
+		None,
+		"--onnx-threads",
+		help = "ONNX backend: intra-op threads (default: $UPSCALER_ONNX_THREADS or the CPUs available to the process)",
+	),
+	torch_cpu_mode: Optional[str] = typer.Option(
+		None,
+		"--torch-cpu-mode",
+		help = "PyTorch backend on CPU: fp32 / channels_last / bf16 / int8 / compile joined with '+', plus threads=N, interop=N (default: $UPSCALER_TORCH_CPU_MODE or fp32; compare with `upscaler bench --cpu-modes`)",
+	),
+	torch_decode_workers: int = typer.Option(
+		2,
+		"--decode-workers",
+		help = "PyTorch backend: threads decoding frames ahead of the model",
+	),
+	torch_write_workers: int = typer.Option(
+		2,
+		"--write-workers",
+		help = "PyTorch backend: threads writing upscaled frames",
+	),
+	torch_prefetch: int = typer.Option(
+		2,
+		"--prefetch",
+		help = "PyTorch backend: decoded batches queued ahead of the model",
+	),
+	torch_write_queue: int = typer.Option(
+		2,
+		"--write-queue",
+		help = "PyTorch backend: output batches queued for the writers",
+	),
+	tile_size: Optional[int] = typer.Option(
+		None,
+		"--tile",
+		help = "Tile size (0 = auto). PyTorch: default whole frames; RealESRGAN NCNN: passed as -t",
+	),
+	tile_pad: int = typer.Option(
+		10,
+		"--tile-pad",
+		help = "Overlap in pixels around each tile",
+	),
+	dedup: bool = typer.Option(
+		False,
+		"--dedup/--no-dedup",
+		help = "Video: upscale repeated frames only once and reuse the result",
+	),
+	dedup_tolerance: float = typer.Option(
+		0.0,
+		"--dedup-tolerance",
+		help = "Video: also treat frames within this mean difference (0..1) of the previous kept frame as repeats",
+	),
+	cache_dir: Optional[Path] = typer.Option(
+		None,
+		"--cache-dir",
+		help = "Reuse results from this content-addressed cache (default: $UPSCALER_CACHE_DIR if set, else off)",
+	),
+	frame_format: str = typer.Option(
+		"png",
+		"--frame-format",
+		help = "Video: intermediate frame format: png / png0 (no compression) / bmp / ppm / webp (lossless)",
+	),
+	scratch_dir: Optional[Path] = typer.Option(
+		None,
+		"--scratch-dir",
+		help = "Video: root for intermediate frames (default: $UPSCALER_SCRATCH_DIR, /dev/shm if the frames fit, else the temp dir)",
+	),
+	chunk_frames: Optional[int] = typer.Option(
+		None,
+		"--chunk-frames",
+		help = "Video: rolling-window mode, extract/upscale/encode N frames at a time (bounded scratch use)",
+	),
+	scratch_limit_gb: Optional[float] = typer.Option(
+		None,
+		"--scratch-limit-gb",
+		help = "Video: cap on scratch use in GiB; bounds --chunk-frames and switches to rolling mode when the frames would not fit",
+	),
+	vcodec: str = typer.Option(
+		"libx264",
+		"--vcodec",
+		help = "Video: output video codec (ffmpeg encoder name, e.g. libx264, libx265, h264_nvenc)",
+	),
+	preset: Optional[str] = typer.Option(
+		None,
+		"--preset",
+		help = "Video: encoder preset, e.g. veryfast / medium / slow (default: the encoder's)",
+	),
+	crf: Optional[int] = typer.Option(
+		None,
+		"--crf",
+		help = "Video: constant rate factor (lower = better quality, larger file)",
+	),
+	encode_threads: Optional[int] = typer.Option(
+		None,
+		"--encode-threads",
+		help = "Video: encoder threads (per segment with --encode-jobs)",
+	),
+	audio: str = typer.Option(
+		"copy",
+		"--audio",
+		help = "Video: audio handling: copy (stream copy, AAC fallback) / aac / any ffmpeg audio codec / none",
+	),
+	encode_jobs: int = typer.Option(
+		1,
+		"--encode-jobs",
+		help = "Video: encode this many frame-range segments in parallel and join them without re-encoding (0 = one per core)",
+	),
+	stream: bool = typer.Option(
+		False,
+		"--stream/--no-stream",
+		help = "PyTorch backend: pipe rawvideo through ffmpeg instead of writing PNG frames to disk",
+	),
+	metrics_jsonl: Optional[Path] = typer.Option(
+		None,
+		"--metrics-jsonl",
+		help = "Append per-stage metric events to this JSON-lines file (default: $UPSCALER_METRICS_JSONL)",
+	),
+	metrics_prom: Optional[Path] = typer.Option(
+		None,
+		"--metrics-prom",
+		help = "Write job metrics as a Prometheus textfile here (default: $UPSCALER_METRICS_PROM)",
+	),
+	daemon: Optional[bool] = typer.Option(
+		None,
+		"--daemon/--no-daemon",
+		help = "Hand the job to a running 'upscaler serve' daemon ($UPSCALER_SERVER or the default socket). Default: when one answers and no local metrics files are requested",
+	),
 ):
+	from .api import collect_images, upscale_image, upscale_images, upscale_video
+	from .encode import EncoderSettings
+	from .metrics import JobMetrics, JsonLinesSink
+
+	client = _daemon_client(daemon, local_metrics = metrics_jsonl is not None or metrics_prom is not None)
+	is_batch = mode == "image" and (input_path.is_dir() or any(ch in str(input_path) for ch in "*?["))
+
+	if is_batch:
+		images = collect_images(input_path)
+		if not images:
+			raise typer.BadParameter(f"No images found: {input_path}")
+		if output_path is None:
+			base = input_path if input_path.is_dir() else input_path.parent
+			tag = f"_{target_height}p" if target_height else f"_x{scale}"
+			output_path = base.with_name(base.name + tag) if base.name else Path(f"upscaled{tag}")
+
+		console.log(f"[bold cyan] Upscaler[/] running on [yellow]{len(images)} images[/] from [yellow]{input_path}")
+		console.log(f"mode = {mode} (batch), backend = {backend}, scale = {scale}")
+		_dispatch(
+			"images",
+			upscale_images,
+			client,
+			inputs = images,
+			output_dir = output_path,
+			scale = scale,
+			backend = backend, # type: ignore
+			model = model,
+			auto_download = auto_download,
+			gpu_id = gpu_id,
+			verbose = verbose,
+			force_gpu = force_gpu,
+			torch_batch_size = torch_batch_size,
+			torch_fp16 = torch_fp16,
+			torch_cpu_mode = torch_cpu_mode,
+			onnx_threads = onnx_threads,
+			tile_size = tile_size,
+			tile_pad = tile_pad,
+			ncnn_threads = ncnn_threads,
+			autotune = autotune,
+			target_height = target_height,
+		)
+		console.log(f"[green]Done[/]: {output_path}")
+		return
+
 	if not input_path.exists():
 		raise typer.BadParameter(f"Input file does not exist: {input_path}")
 	
 	if output_path is None: 
 		suffix = ".mp4" if mode == "video" else ".png"
-		output_path = input_path.with_name(input_path.stem + f"_x{scale}{suffix}")
+		tag = f"_{target_height}p" if target_height else f"_x{scale}"
+		output_path = input_path.with_name(input_path.stem + f"{tag}{suffix}")
 
 	console.log(f"[bold cyan] Upscaler[/] running on [yellow]{input_path}")
 	console.log(f"mode = {mode}, backend = {backend}, scale = {scale}")
 
+	metrics = JobMetrics.from_env() or JobMetrics()
+	if metrics_jsonl is not None:
+		metrics.sinks.append(JsonLinesSink(metrics_jsonl))
+	if metrics_prom is not None:
+		metrics.prometheus_path = metrics_prom
+
 	if mode == "image":
-		upscale_image(
+		job = _dispatch(
+			"image",
+			upscale_image,
+			client,
 			input_path = input_path,
 			output_path = output_path, 
 			scale = scale,
@@ -102,9 +337,21 @@ def run(
 			gpu_id = gpu_id,
 			verbose = verbose,
 			force_gpu = force_gpu,
+			tile_size = tile_size,
+			tile_pad = tile_pad,
+			cache_dir = cache_dir,
+			ncnn_threads = ncnn_threads,
+			torch_fp16 = torch_fp16,
+			torch_cpu_mode = torch_cpu_mode,
+			onnx_threads = onnx_threads,
+			metrics = metrics,
+			target_height = target_height,
 		)
 	elif mode == "video": 
-		upscale_video(
+		job = _dispatch(
+			"video",
+			upscale_video,
+			client,
 			input_path=input_path,
 			output_path=output_path,
 			scale=scale,
@@ -113,11 +360,623 @@ def run(
 			auto_download=auto_download,
 			torch_batch_size=torch_batch_size,
 			torch_fp16=torch_fp16,
+			torch_cpu_mode=torch_cpu_mode,
+			onnx_threads=onnx_threads,
+			torch_decode_workers=torch_decode_workers,
+			torch_write_workers=torch_write_workers,
+			torch_prefetch=torch_prefetch,
+			torch_write_queue=torch_write_queue,
 			gpu_id=gpu_id,
 			verbose=verbose,
 			force_gpu=force_gpu,
+			stream=stream,
+			dedup=dedup,
+			dedup_tolerance=dedup_tolerance,
+			cache_dir=cache_dir,
+			gpu_ids=_parse_int_list(gpu_ids, "--gpu-ids"),
+			instances_per_gpu=instances_per_gpu,
+			ncnn_threads=ncnn_threads,
+			autotune=autotune,
+			tile_size=tile_size,
+			tile_pad=tile_pad,
+			metrics=metrics,
+			target_height=target_height,
+			frame_format=frame_format,
+			scratch_dir=scratch_dir,
+			chunk_frames=chunk_frames,
+			scratch_limit_gb=scratch_limit_gb,
+			encoder=EncoderSettings(
+				codec=vcodec,
+				preset=preset,
+				crf=crf,
+				threads=encode_threads,
+				audio=audio,
+			),
+			encode_jobs=encode_jobs,
 		)
 	else:
 		raise typer.BadParameter(f"Unknown mode: {mode}. Must be 'image' or 'video'.")
 
-	console.log(f"[green]Done[/]: {output_path}")
\ No newline at end of file
+	if client is not None:
+		result = job["result"] or {}
+		frames, wall, stage_seconds = result.get("frames", 0), result.get("seconds", 0.0), result.get("stages", {})
+	else:
+		frames, wall, stage_seconds = metrics.frames, metrics.wall_seconds, metrics.stages
+	stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in stage_seconds.items())
+	fps = frames / wall if wall else 0.0
+	console.log(f"[cyan]{frames} frames in {wall:.2f}s ({fps:.2f} fps); {stages}[/cyan]")
+	console.log(f"[green]Done[/]: {output_path}")
+
+
+def _run_planned(fn, **kwargs):
+	from .planner import PlanError
+
+	# Impossible scale/model/size combinations are rejected before any work starts.
+	try:
+		return fn(**kwargs)
+	except PlanError as e:
+		raise typer.BadParameter(str(e)) from e
+
+
+def _daemon_client(daemon: Optional[bool], local_metrics: bool) -> "Optional[UpscalerClient]":
+	from .config import server_address
+
+	if daemon is False or (daemon is None and local_metrics):
+		return None
+	address = server_address()
+	if daemon is None and address.startswith("unix:") and not Path(address[len("unix:"):]).exists():
+		# Common case, no daemon: skip importing the HTTP client.
+		return None
+	from .client import find_server
+
+	client = find_server(address)
+	if client is None and daemon:
+		raise typer.BadParameter("--daemon: no 'upscaler serve' daemon is answering (set UPSCALER_SERVER?)")
+	return client
+
+
+def _jsonable(value):
+	# The daemon has its own working directory: send absolute paths.
+	if isinstance(value, Path):
+		return str(value.resolve())
+	if isinstance(value, (list, tuple)):
+		return [_jsonable(v) for v in value]
+	if is_dataclass(value):
+		return asdict(value)
+	return value
+
+
+def _dispatch(op: str, fn, client: "Optional[UpscalerClient]", **kwargs):
+	if client is None:
+		return _run_planned(fn, **kwargs)
+	from .client import DaemonJobError
+
+	kwargs.pop("metrics", None)
+	job = client.submit(op, {k: _jsonable(v) for k, v in kwargs.items()})
+	console.log(f"[cyan] handed to daemon at {client.address}: job {job['id']}[/cyan]")
+	try:
+		return client.wait(job["id"])
+	except DaemonJobError as e:
+		if e.error_type == "PlanError":
+			raise typer.BadParameter(str(e)) from e
+		raise
+
+
+cache_app = typer.Typer(help = "Inspect and prune the result cache")
+app.add_typer(cache_app, name = "cache")
+
+def _open_cache(cache_dir: Optional[Path]) -> "ResultCache":
+	from .result_cache import ResultCache
+
+	return ResultCache(cache_dir or os.environ.get("UPSCALER_CACHE_DIR") or None)
+
+@cache_app.command("stats")
+def cache_stats(
+	cache_dir: Optional[Path] = typer.Option(
+		None,
+		"--cache-dir",
+		help = "Cache root (default: $UPSCALER_CACHE_DIR or ~/.cache/upscaler/results)",
+	),
+):
+	stats = _open_cache(cache_dir).stats()
+	console.print(f"root     : {stats.root}")
+	console.print(f"entries  : {stats.entries}")
+	console.print(f"size     : {stats.bytes / 1024 ** 2:.1f} MiB / {stats.max_bytes / 1024 ** 3:.1f} GiB cap")
+
+@cache_app.command("prune")
+def cache_prune(
+	cache_dir: Optional[Path] = typer.Option(
+		None,
+		"--cache-dir",
+		help = "Cache root (default: $UPSCALER_CACHE_DIR or ~/.cache/upscaler/results)",
+	),
+	max_gb: Optional[float] = typer.Option(
+		None,
+		"--max-gb",
+		help = "Shrink the cache to this size (default: the configured cap)",
+	),
+	older_than_days: Optional[float] = typer.Option(
+		None,
+		"--older-than-days",
+		help = "Also drop entries not used for this many days",
+	),
+	clear: bool = typer.Option(
+		False,
+		"--all",
+		help = "Remove every entry",
+	),
+):
+	cache = _open_cache(cache_dir)
+	max_bytes = 0 if clear else (int(max_gb * 1024 ** 3) if max_gb is not None else None)
+	older_than = older_than_days * 86400 if older_than_days is not None else None
+	removed, freed = cache.prune(max_bytes = max_bytes, older_than = older_than)
+	console.print(f"[green]Removed {removed} entries ({freed / 1024 ** 2:.1f} MiB)[/green]")
+
+segments_app = typer.Typer(help = "Split one video into keyframe-aligned segments that workers process and resume independently")
+app.add_typer(segments_app, name = "segments")
+
+def _parse_shard(value: Optional[str]) -> Optional[tuple[int, int]]:
+	if not value:
+		return None
+	try:
+		i, n = (int(v) for v in value.split("/"))
+	except ValueError:
+		raise typer.BadParameter(f"--shard must look like i/N, got {value!r}")
+	if not 0 <= i < n:
+		raise typer.BadParameter(f"--shard {value}: need 0 <= i < N")
+	return i, n
+
+@segments_app.command("plan")
+def segments_plan(
+	input_path: Path = typer.Argument(
+		...,
+		help = "Input video (at a path every worker can read)",
+	),
+	work_dir: Path = typer.Option(
+		...,
+		"--work-dir",
+		"-w",
+		help = "Shared directory for the manifest, segments and completion markers",
+	),
+	segment_seconds: float = typer.Option(
+		60.0,
+		"--segment-seconds",
+		help = "Approximate segment length; cuts land on source keyframes",
+	),
+	backend: str = typer.Option(
+		"realesrgan",
+		"--backend",
+		"-b",
+		help = "Backend: realesrgan / torch / onnx / auto (resolved on each worker)",
+	),
+	scale: int = typer.Option(
+		2,
+		"--scale",
+		"-s",
+		help = "Scale factor (2/3/4)",
+	),
+	target_height: Optional[int] = typer.Option(
+		None,
+		"--target-height",
+		help = "Output height in pixels, aspect kept; overrides --scale",
+	),
+	model: str = typer.Option(
+		"realesrgan-x4plus",
+		"--model",
+		help = "RealESRGAN model name",
+	),
+	fps: Optional[float] = typer.Option(
+		None,
+		"--fps",
+		help = "Output frame rate (default: the input's)",
+	),
+	frame_format: str = typer.Option(
+		"png",
+		"--frame-format",
+		help = "Intermediate frame format: png / png0 / bmp / ppm / webp",
+	),
+	tile_size: Optional[int] = typer.Option(
+		None,
+		"--tile",
+		help = "Tile size (0 = auto)",
+	),
+	dedup: bool = typer.Option(
+		False,
+		"--dedup/--no-dedup",
+		help = "Upscale repeated frames only once",
+	),
+	vcodec: str = typer.Option(
+		"libx264",
+		"--vcodec",
+		help = "Output video codec",
+	),
+	preset: Optional[str] = typer.Option(
+		None,
+		"--preset",
+		help = "Encoder preset",
+	),
+	crf: Optional[int] = typer.Option(
+		None,
+		"--crf",
+		help = "Constant rate factor",
+	),
+	audio: str = typer.Option(
+		"copy",
+		"--audio",
+		help = "Audio handling at merge: copy / aac / any ffmpeg audio codec / none",
+	),
+):
+	from .encode import EncoderSettings
+	from .segments import plan_segments
+
+	if not input_path.exists():
+		raise typer.BadParameter(f"Input file does not exist: {input_path}")
+	options = dict(backend = backend, scale = scale, model = model, frame_format = frame_format, dedup = dedup)
+	if target_height is not None:
+		options["target_height"] = target_height
+	if tile_size is not None:
+		options["tile_size"] = tile_size
+	try:
+		manifest = plan_segments(
+			input_path,
+			work_dir,
+			segment_seconds = segment_seconds,
+			fps = fps,
+			encoder = EncoderSettings(codec = vcodec, preset = preset, crf = crf, audio = audio),
+			**options,
+		)
+	except (ValueError, RuntimeError) as e:
+		raise typer.BadParameter(str(e)) from e
+	n = len(manifest.segments)
+	console.print(f"[green]{n} segments planned in {work_dir}[/green]; run `upscaler segments run {work_dir} --shard i/N` on each worker")
+
+@segments_app.command("run")
+def segments_run(
+	work_dir: Path = typer.Argument(
+		...,
+		help = "Work directory of `upscaler segments plan`",
+	),
+	index: Optional[list[int]] = typer.Option(
+		None,
+		"--index",
+		"-i",
+		help = "Segment to process (repeatable; default: every segment not done or taken)",
+	),
+	shard: Optional[str] = typer.Option(
+		None,
+		"--shard",
+		help = "Only the segments k with k % N == i, given as i/N",
+	),
+	auto_download: bool = typer.Option(
+		False,
+		"--auto-download",
+		help = "Try to download binary/models if missing",
+	),
+	gpu_id: Optional[int] = typer.Option(
+		None,
+		"--gpu-id",
+		help = "RealESRGAN NCNN/Vulkan GPU id; -1 forces CPU",
+	),
+	gpu_ids: Optional[str] = typer.Option(
+		None,
+		"--gpu-ids",
+		help = "RealESRGAN NCNN: comma-separated device ids to shard frames over",
+	),
+	instances_per_gpu: int = typer.Option(
+		1,
+		"--instances-per-gpu",
+		help = "RealESRGAN NCNN: binary instances per device",
+	),
+	ncnn_threads: Optional[str] = typer.Option(
+		None,
+		"--ncnn-threads",
+		help = "RealESRGAN NCNN load:proc:save thread counts (-j)",
+	),
+	torch_batch_size: int = typer.Option(
+		4,
+		"--batch",
+		"-B",
+		help = "Batch size for the PyTorch/ONNX backends",
+	),
+	onnx_threads: Optional[int] = typer.Option(
+		None,
+		"--onnx-threads",
+		help = "ONNX backend: intra-op threads",
+	),
+	scratch_dir: Optional[Path] = typer.Option(
+		None,
+		"--scratch-dir",
+		help = "Root for intermediate frames on this worker",
+	),
+	chunk_frames: Optional[int] = typer.Option(
+		None,
+		"--chunk-frames",
+		help = "Process each segment N frames at a time (bounded scratch use)",
+	),
+	scratch_limit_gb: Optional[float] = typer.Option(
+		None,
+		"--scratch-limit-gb",
+		help = "Cap on scratch use in GiB on this worker",
+	),
+	verbose: bool = typer.Option(
+		False,
+		"--verbose",
+		"-v",
+		help = "Verbose output from the RealESRGAN binary",
+	),
+):
+	from .segments import process_segments
+
+	try:
+		done = process_segments(
+			work_dir,
+			indices = index or None,
+			shard = _parse_shard(shard),
+			auto_download = auto_download,
+			gpu_id = gpu_id,
+			gpu_ids = _parse_int_list(gpu_ids, "--gpu-ids"),
+			instances_per_gpu = instances_per_gpu,
+			ncnn_threads = ncnn_threads,
+			torch_batch_size = torch_batch_size,
+			onnx_threads = onnx_threads,
+			scratch_dir = scratch_dir,
+			chunk_frames = chunk_frames,
+			scratch_limit_gb = scratch_limit_gb,
+			verbose = verbose,
+		)
+	except ValueError as e:
+		raise typer.BadParameter(str(e)) from e
+	except RuntimeError as e:
+		console.print(f"[red]{e}[/red]")
+		raise typer.Exit(code = 1)
+	console.print(f"[green]Finished {len(done)} segments[/green]{': ' + ', '.join(map(str, done)) if done else ''}")
+
+@segments_app.command("merge")
+def segments_merge(
+	work_dir: Path = typer.Argument(
+		...,
+		help = "Work directory of `upscaler segments plan`",
+	),
+	output_path: Path = typer.Option(
+		...,
+		"--output",
+		"-o",
+		help = "Output video",
+	),
+	clean: bool = typer.Option(
+		False,
+		"--clean",
+		help = "Remove the work directory after a successful merge",
+	),
+):
+	import shutil
+
+	from .segments import merge_segments
+
+	try:
+		merge_segments(work_dir, output_path)
+	except RuntimeError as e:
+		console.print(f"[red]{e}[/red]")
+		raise typer.Exit(code = 1)
+	if clean:
+		shutil.rmtree(work_dir, ignore_errors = True)
+	console.log(f"[green]Done[/]: {output_path}")
+
+@segments_app.command("status")
+def segments_status(
+	work_dir: Path = typer.Argument(
+		...,
+		help = "Work directory of `upscaler segments plan`",
+	),
+):
+	from .segments import segment_status
+
+	status = segment_status(work_dir)
+	for state in ("done", "running", "stale", "pending"):
+		indices = [i for i, s in status.items() if s == state]
+		if indices:
+			console.print(f"{state:8} : {len(indices)} ({', '.join(map(str, indices[:20]))}{' ...' if len(indices) > 20 else ''})")
+
+def _parse_sizes(value: str) -> list[tuple[int, int]]:
+	sizes = []
+	for item in value.split(","):
+		try:
+			w, h = item.lower().split("x")
+			sizes.append((int(w), int(h)))
+		except ValueError:
+			raise typer.BadParameter(f"--sizes expects WxH[,WxH...], got {value!r}")
+	return sizes
+
+@app.command()
+def bench(
+	backends: str = typer.Option(
+		"bicubic,realesrgan,torch,onnx",
+		"--backends",
+		help = "Comma-separated backends to benchmark (unavailable ones are skipped)",
+	),
+	sizes: str = typer.Option(
+		"320x180,640x360",
+		"--sizes",
+		help = "Synthetic input resolutions, WxH[,WxH...]",
+	),
+	seconds: str = typer.Option(
+		"1",
+		"--seconds",
+		help = "Synthetic clip lengths in seconds, comma-separated",
+	),
+	fps: int = typer.Option(24, "--fps", help = "Synthetic clip frame rate"),
+	scale: int = typer.Option(4, "--scale", "-s", help = "Scale factor"),
+	realesrgan_gpu_id: Optional[int] = typer.Option(
+		-1,
+		"--realesrgan-gpu-id",
+		help = "Device for the realesrgan backend (-1 = CPU, so results are comparable across hosts)",
+	),
+	output: Optional[Path] = typer.Option(
+		None,
+		"--output",
+		"-o",
+		help = "Write the JSON report here (default: print it)",
+	),
+	baseline: Optional[Path] = typer.Option(
+		None,
+		"--baseline",
+		help = "Compare against this saved report; exit 1 on regressions",
+	),
+	tolerance: float = typer.Option(
+		0.10,
+		"--tolerance",
+		help = "Relative change treated as a regression",
+	),
+	startup: bool = typer.Option(
+		False,
+		"--startup",
+		help = "Only measure CLI startup (import time, --help, heavy modules loaded); exit 1 when over budget",
+	),
+	startup_budget_ms: float = typer.Option(
+		500.0,
+		"--startup-budget-ms",
+		help = "With --startup: allowed import time of the CLI in milliseconds",
+	),
+	cpu_modes: Optional[str] = typer.Option(
+		None,
+		"--cpu-modes",
+		help = "Only compare torch CPU modes (comma-separated, e.g. fp32,channels_last+bf16,int8) for throughput and PSNR against fp32 on a crop of the first --sizes entry",
+	),
+	min_psnr: float = typer.Option(
+		40.0,
+		"--min-psnr",
+		help = "With --cpu-modes: quality limit (dB against fp32) for the recommended mode",
+	),
+):
+	from .bench import build_cases, compare, load_report, run_bench, save_report
+
+	if cpu_modes is not None:
+		from dataclasses import asdict
+
+		from .torch_cpu import evaluate_cpu_modes, pick_cpu_mode
+
+		size = min(_parse_sizes(sizes)[0])
+		results = evaluate_cpu_modes(
+			modes = [m.strip() for m in cpu_modes.split(",") if m.strip()],
+			size = size,
+			on_result = lambda r: console.log(
+				f"[cyan][bench] {r.mode}: {r.fps:.2f} frames/s ({r.speedup:.2f}x), PSNR {r.psnr_db:.1f} dB[/cyan]"
+				if r.error is None else f"[yellow][bench] {r.mode} failed: {r.error}[/yellow]"
+			),
+		)
+		picked = pick_cpu_mode(results, min_psnr)
+		report = {"size": size, "min_psnr": min_psnr, "picked": picked, "modes": [asdict(r) for r in results]}
+		if output is not None:
+			save_report(report, output)
+		console.print_json(data = report)
+		console.print(f"[green]Fastest CPU mode within {min_psnr:g} dB: {picked}[/green] (--torch-cpu-mode {picked})")
+		return
+
+	if startup:
+		from .bench import check_startup, measure_startup
+
+		report = measure_startup()
+		if output is not None:
+			save_report(report, output)
+		console.print_json(data = report)
+		problems = check_startup(report, startup_budget_ms)
+		for problem in problems:
+			console.print(f"[red]STARTUP[/] {problem}")
+		if problems:
+			raise typer.Exit(code = 1)
+		console.print(f"[green]CLI startup within budget ({report['import_ms']:.0f} / {startup_budget_ms:.0f} ms)[/green]")
+		return
+
+	try:
+		secs = [float(s) for s in seconds.split(",") if s.strip()]
+	except ValueError:
+		raise typer.BadParameter(f"--seconds expects numbers, got {seconds!r}")
+
+	cases = build_cases(
+		backends = [b.strip() for b in backends.split(",") if b.strip()],
+		sizes = _parse_sizes(sizes),
+		seconds = secs,
+		fps = fps,
+		scale = scale,
+		realesrgan_gpu_id = realesrgan_gpu_id,
+	)
+	report = run_bench(cases)
+
+	if output is not None:
+		save_report(report, output)
+		console.log(f"[green]Report written[/]: {output}")
+	else:
+		console.print_json(data = report)
+
+	for backend, reason in report["skipped"].items():
+		console.print(f"[yellow]skipped {backend}: {reason}[/yellow]")
+
+	if baseline is not None:
+		regressions = compare(report, load_report(baseline), tolerance = tolerance)
+		for r in regressions:
+			console.print(f"[red]REGRESSION[/] {r.case} {r.metric}: {r.baseline:.3g} -> {r.current:.3g} ({r.change:+.0%})")
+		if regressions:
+			raise typer.Exit(code = 1)
+		console.print("[green]No regressions against baseline[/green]")
+
+
+@app.command()
+def serve(
+	socket_path: Optional[Path] = typer.Option(
+		None,
+		"--socket",
+		help = "Unix socket to listen on (default: $XDG_RUNTIME_DIR/upscaler.sock or the temp dir)",
+	),
+	host: str = typer.Option(
+		"127.0.0.1",
+		"--host",
+		help = "TCP host, used with --port",
+	),
+	port: Optional[int] = typer.Option(
+		None,
+		"--port",
+		help = "Listen on HTTP at host:port instead of a Unix socket",
+	),
+	devices: Optional[str] = typer.Option(
+		None,
+		"--devices",
+		help = "Comma-separated device ids with their own worker slots, e.g. 0,1 (default: one default device)",
+	),
+	slots_per_device: int = typer.Option(
+		1,
+		"--slots-per-device",
+		help = "Jobs run concurrently per device",
+	),
+	preload: Optional[str] = typer.Option(
+		None,
+		"--preload",
+		help = "Comma-separated torch models to load at startup, e.g. realesrgan-x4plus",
+	),
+	probe_vulkan: bool = typer.Option(
+		True,
+		"--probe-vulkan/--no-probe-vulkan",
+		help = "Run the NCNN binary once at startup to warm the driver and record the Vulkan devices",
+	),
+	verbose: bool = typer.Option(
+		False,
+		"--verbose",
+		"-v",
+		help = "Log every request",
+	),
+):
+	from .server import serve as serve_forever
+
+	try:
+		serve_forever(
+			socket_path = socket_path,
+			host = host,
+			port = port,
+			devices = _parse_int_list(devices, "--devices") or [None],
+			slots_per_device = slots_per_device,
+			preload = [m.strip() for m in (preload or "").split(",") if m.strip()],
+			probe_vulkan = probe_vulkan,
+			verbose = verbose,
+		)
+	except RuntimeError as e:
+		console.print(f"[red]{e}[/red]")
+		raise typer.Exit(code = 1)
@@ -0,0 +1,110 @@
+# upscaler/upscaler/client.py
+"""
+Thin client for the `upscaler serve` daemon.
+
+The address is `unix:/path/to.sock` or `http://host:port`; by default
+UPSCALER_SERVER, else the daemon's default socket path.
+"""
+from __future__ import annotations
+
+import http.client
+import json
+import socket
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from .config import server_address
+
+
+class DaemonJobError(RuntimeError):
+    """A job the daemon ran failed; `error_type` is the exception name on the daemon side."""
+
+    def __init__(self, message: str, error_type: Optional[str] = None):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self._socket_path)
+        self.sock = sock
+
+
+class UpscalerClient:
+    def __init__(self, address: Optional[str] = None, timeout: float = 30.0):
+        self.address = address or server_address()
+        self.timeout = timeout
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.address.startswith("unix:"):
+            return _UnixHTTPConnection(self.address[len("unix:"):], self.timeout)
+        rest = self.address.split("://", 1)[-1].rstrip("/")
+        host, _, port = rest.partition(":")
+        return http.client.HTTPConnection(host, int(port or 80), timeout=self.timeout)
+
+    def _request(self, method: str, path: str, body: Any = None) -> Any:
+        conn = self._connection()
+        try:
+            payload = json.dumps(body).encode() if body is not None else None
+            headers = {"Content-Type": "application/json"} if payload is not None else {}
+            conn.request(method, path, body=payload, headers=headers)
+            resp = conn.getresponse()
+            data = json.loads(resp.read() or b"null")
+        finally:
+            conn.close()
+        if resp.status >= 400:
+            raise RuntimeError(f"upscaler daemon: {(data or {}).get('error') or resp.reason} (HTTP {resp.status})")
+        return data
+
+    def health(self) -> dict:
+        return self._request("GET", "/health")
+
+    def submit(self, op: str, args: dict, priority: int = 0) -> dict:
+        """Queue a job; path arguments must be valid on the daemon's side (use absolute paths)."""
+        return self._request("POST", "/jobs", {"op": op, "args": args, "priority": priority})
+
+    def status(self, job_id: str) -> dict:
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def jobs(self) -> list[dict]:
+        return self._request("GET", "/jobs")
+
+    def cancel(self, job_id: str) -> dict:
+        return self._request("DELETE", f"/jobs/{job_id}")
+
+    def wait(self, job_id: str, poll: float = 0.2, timeout: Optional[float] = None) -> dict:
+        """Poll until the job finishes; raises DaemonJobError if it failed or was cancelled."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            job = self.status(job_id)
+            if job["status"] == "done":
+                return job
+            if job["status"] in ("failed", "cancelled"):
+                raise DaemonJobError(job.get("error") or f"Job {job_id} {job['status']}", job.get("error_type"))
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job_id} still {job['status']} after {timeout}s")
+            time.sleep(poll)
+
+    def run(self, op: str, args: dict, priority: int = 0) -> dict:
+        return self.wait(self.submit(op, args, priority)["id"])
+
+
+def find_server(address: Optional[str] = None) -> Optional[UpscalerClient]:
+    """A client for a running daemon, or None when nothing answers at the address."""
+    address = address or server_address()
+    if address.startswith("unix:") and not Path(address[len("unix:"):]).exists():
+        return None
+    client = UpscalerClient(address, timeout=2.0)
+    try:
+        client.health()
+    except (OSError, RuntimeError, ValueError):
+        return None
+    client.timeout = 30.0
+    return client
@@ -1,6 +1,6 @@
 # upscaler/upscaler/config.py
 from pathlib import Path
-import sys
+import os, sys, tempfile
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 
@@ -21,6 +21,13 @@ VALID_MODELS = {
     4: ["realesrgan-x4plus", "realesrgan-anime-x4"],
 }
 
+# Native upscale factor of every model (derived from VALID_MODELS).
+MODEL_SCALES = {name: scale for scale, names in VALID_MODELS.items() for name in names}
+
+# Input sides must be multiples of this per native scale: RRDBNet pixel-unshuffles
+# x2 inputs by 2 and x1 inputs by 4.
+INPUT_MULTIPLE = {1: 4, 2: 2}
+
 LT_MODEL = {
     2: "realesrgan-x2plus",
     4: "realesrgan-x4plus",
@@ -31,3 +38,18 @@ REALESRGAN_MODELS = {
     "general-x2": "realesrgan-x2plus",                  # x2
     "anime-x4": "realesrgan-anime-x4",                  # anime x4
 }
+
+# PyTorch weights for the models the torch backend can build.
+TORCH_MODEL_URLS = {
+    "realesrgan-x4plus": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth",
+    "realesrgan-x2plus": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x2plus.pth",
+}
+
+# Address of the `upscaler serve` daemon: UPSCALER_SERVER ("unix:/path" or
+# "http://host:port"), else a Unix socket in the runtime dir.
+def default_socket_path() -> Path:
+    base = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return Path(base) / "upscaler.sock"
+
+def server_address() -> str:
+    return os.environ.get("UPSCALER_SERVER") or f"unix:{default_socket_path()}"
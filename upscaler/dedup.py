@@ -0,0 +1,131 @@
+# upscaler/upscaler/dedup.py
+"""
+Duplicate / near-duplicate frame elimination between extraction and inference.
+
+Exact duplicates are found by hashing frame files (ffmpeg's image encoders are
+deterministic, so identical pixels give identical files). With a tolerance > 0,
+a frame is also treated as a repeat of the last kept frame when their downscaled
+thumbnails differ by at most `tolerance` (mean absolute difference, 0..1).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from rich.console import Console
+
+console = Console()
+
+_THUMB_SIZE = (128, 72)
+
+
+@dataclass
+class DedupPlan:
+    frames: list[Path]
+    unique: list[Path] = field(default_factory=list)
+    # duplicate frame -> the unique frame whose output it reuses
+    duplicates: dict[Path, Path] = field(default_factory=dict)
+
+    @property
+    def skipped(self) -> int:
+        return len(self.duplicates)
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _thumbnail(path: Path):
+    from PIL import Image
+
+    with Image.open(path) as im:
+        return im.convert("RGB").resize(_THUMB_SIZE, Image.BILINEAR)
+
+
+def _mean_abs_diff(a, b) -> float:
+    from PIL import ImageChops, ImageStat
+
+    diff = ImageChops.difference(a, b)
+    return sum(ImageStat.Stat(diff).mean) / (3 * 255.0)
+
+
+def plan_dedup(frames: list[Path], tolerance: float = 0.0, workers: Optional[int] = None) -> DedupPlan:
+    """
+    Decide which of `frames` (in display order) need upscaling.
+    """
+    plan = DedupPlan(frames=list(frames))
+    if not frames:
+        return plan
+
+    workers = workers or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = list(pool.map(_file_digest, frames))
+
+    by_digest: dict[str, Path] = {}
+    ref: Optional[Path] = None
+    ref_thumb = None
+    for frame, digest in zip(frames, digests):
+        source = by_digest.get(digest)
+        if source is not None:
+            plan.duplicates[frame] = source
+            continue
+
+        if tolerance > 0 and ref is not None:
+            thumb = _thumbnail(frame)
+            if ref_thumb is None:
+                ref_thumb = _thumbnail(ref)
+            if _mean_abs_diff(thumb, ref_thumb) <= tolerance:
+                plan.duplicates[frame] = ref
+                by_digest[digest] = ref
+                continue
+            ref_thumb = thumb
+        else:
+            ref_thumb = None
+
+        by_digest[digest] = frame
+        plan.unique.append(frame)
+        ref = frame
+
+    return plan
+
+
+def link_frames(frames: list[Path], dest_dir: Path) -> None:
+    """Hardlink (or copy) `frames` into `dest_dir` under their own names."""
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    for frame in frames:
+        link_or_copy(frame, dest_dir / frame.name)
+
+
+def fill_duplicates(plan: DedupPlan, frames_out: Path, suffix: str = ".png") -> int:
+    """
+    Materialize the skipped frames in `frames_out` from the upscaled copies of
+    the frames they repeat. Returns the number of frames filled.
+    """
+    filled = 0
+    for dup, source in plan.duplicates.items():
+        src = frames_out / (source.stem + suffix)
+        dst = frames_out / (dup.stem + suffix)
+        if not src.exists():
+            raise RuntimeError(f"Dedup: upscaled source frame missing: {src}")
+        if dst.exists():
+            continue
+        link_or_copy(src, dst)
+        filled += 1
+    return filled
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    """Hardlink `src` to `dst`, copying when linking is not possible (cross-device, FAT, ...)."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
@@ -7,8 +7,6 @@ import os
 import sys
 import shutil
 import tempfile
-import urllib.request
-import zipfile
 
 from rich.console import Console
 
@@ -49,6 +47,10 @@ def ensure_dirs() -> None:
 def _download_and_unpack_ncnn(url: str) -> None:
     ensure_dirs()
 
+    # Only needed for downloads; urllib pulls in http.client and email.
+    import urllib.request
+    import zipfile
+
     with tempfile.TemporaryDirectory() as tmpdir_str:
         tmpdir = Path(tmpdir_str)
         zip_path = tmpdir / "realesrgan.zip"
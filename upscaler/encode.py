@@ -0,0 +1,253 @@
+# upscaler/upscaler/encode.py
+"""
+Encoding upscaled frame folders into the output video.
+
+`EncoderSettings` carries the video codec, preset, CRF, encoder threads and the
+audio handling ("copy" the source stream, re-encode with a named codec such as
+"aac", or "none"). Audio copy falls back to AAC when the source codec does not
+fit the output container.
+
+With `jobs > 1`, `assemble_frames` encodes contiguous frame ranges as separate
+video-only segments in parallel and joins them with the concat demuxer
+(`-c:v copy`, no second encode), muxing the audio in the same step. Each
+segment starts on a keyframe, so the join is exact; the cost is one extra
+keyframe per segment.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+from rich.console import Console
+
+from .metrics import JobMetrics
+
+console = Console()
+
+# Segments shorter than this many seconds are not worth a separate encoder.
+MIN_SEGMENT_SECONDS = 2.0
+
+
+@dataclass(frozen=True)
+class EncoderSettings:
+    codec: str = "libx264"
+    preset: Optional[str] = None
+    crf: Optional[int] = None
+    threads: Optional[int] = None
+    pix_fmt: str = "yuv420p"
+    audio: str = "copy"
+
+    def video_args(self, threads: Optional[int] = None) -> list[str]:
+        args = ["-c:v", self.codec, "-pix_fmt", self.pix_fmt]
+        if self.preset:
+            args += ["-preset", self.preset]
+        if self.crf is not None:
+            args += ["-crf", str(self.crf)]
+        threads = threads or self.threads
+        if threads:
+            args += ["-threads", str(threads)]
+        return args
+
+    def audio_args(self, audio: Optional[str] = None) -> list[str]:
+        audio = audio or self.audio
+        return ["-an"] if audio == "none" else ["-c:a", audio]
+
+
+DEFAULT_ENCODER = EncoderSettings()
+
+
+def _frames_pattern(frames_dir: Path, suffix: str) -> str:
+    return str(frames_dir / f"frame_%06d{suffix}")
+
+
+def _length_args(duration: Optional[float]) -> list[str]:
+    # `-shortest` with a copied audio stream ends the output when the audio packets
+    # run out, while frames are still in the encoder's lookahead; cutting at the
+    # known video duration keeps every frame.
+    return ["-t", f"{duration:.6f}"] if duration else ["-shortest"]
+
+
+def _scale_args(size: tuple[int, int] | None) -> list[str]:
+    return ["-vf", f"scale={size[0]}:{size[1]}:flags=lanczos"] if size is not None else []
+
+
+def assemble_command(
+        frames_dir: Path,
+        audio_source: Path,
+        output_path: Path,
+        fps: float,
+        size: tuple[int, int] | None = None,
+        suffix: str = ".png",
+        encoder: EncoderSettings | None = None,
+        audio: str | None = None,
+        duration: float | None = None,
+) -> list[str]:
+    """
+    Single-pass encode of `frames_dir/frame_%06d<suffix>` plus the audio of
+    `audio_source`, cut to `duration` seconds (the video length) when known.
+    """
+    encoder = encoder or DEFAULT_ENCODER
+    audio = audio or encoder.audio
+    cmd = [
+        "ffmpeg", "-y",
+        "-framerate", str(fps),
+        "-i", _frames_pattern(frames_dir, suffix),
+    ]
+    if audio != "none":
+        cmd += ["-i", str(audio_source), "-map", "0:v:0", "-map", "1:a:0?"]
+    cmd += _scale_args(size)
+    cmd += encoder.video_args()
+    cmd += encoder.audio_args(audio)
+    if audio != "none":
+        cmd += _length_args(duration)
+    cmd += [str(output_path)]
+    return cmd
+
+
+def segment_command(
+        frames_dir: Path,
+        segment_path: Path,
+        fps: float,
+        start_number: int,
+        count: int,
+        size: tuple[int, int] | None = None,
+        suffix: str = ".png",
+        encoder: EncoderSettings | None = None,
+        threads: Optional[int] = None,
+) -> list[str]:
+    """Video-only encode of `count` frames starting at frame number `start_number`."""
+    encoder = encoder or DEFAULT_ENCODER
+    return [
+        "ffmpeg", "-y", "-v", "error",
+        "-framerate", str(fps),
+        "-start_number", str(start_number),
+        "-i", _frames_pattern(frames_dir, suffix),
+        "-frames:v", str(count),
+        *_scale_args(size),
+        *encoder.video_args(threads),
+        "-an",
+        str(segment_path),
+    ]
+
+
+def concat_command(
+        list_file: Path,
+        audio_source: Path,
+        output_path: Path,
+        encoder: EncoderSettings | None = None,
+        audio: str | None = None,
+        duration: float | None = None,
+) -> list[str]:
+    """Join the segments listed in `list_file` without re-encoding and mux the audio."""
+    encoder = encoder or DEFAULT_ENCODER
+    audio = audio or encoder.audio
+    cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(list_file)]
+    if audio != "none":
+        cmd += ["-i", str(audio_source), "-map", "0:v:0", "-map", "1:a:0?"]
+    cmd += ["-c:v", "copy", *encoder.audio_args(audio)]
+    if audio != "none":
+        cmd += _length_args(duration)
+    cmd += [str(output_path)]
+    return cmd
+
+
+def segment_ranges(n_frames: int, jobs: int, fps: float) -> list[tuple[int, int]]:
+    """Split `n_frames` into at most `jobs` contiguous (offset, count) ranges of near-equal length."""
+    min_frames = max(1, int(MIN_SEGMENT_SECONDS * fps))
+    parts = max(1, min(jobs, n_frames // min_frames))
+    base, extra = divmod(n_frames, parts)
+    ranges, offset = [], 0
+    for k in range(parts):
+        count = base + (1 if k < extra else 0)
+        ranges.append((offset, count))
+        offset += count
+    return ranges
+
+
+def run_with_audio_fallback(build: Callable[[str], list[str]], encoder: EncoderSettings, what: str) -> None:
+    """Run `build(audio)`; when copying the audio stream fails, retry once re-encoding it to AAC."""
+    proc = subprocess.run(build(encoder.audio), capture_output = True, text = True)
+    if proc.returncode != 0 and encoder.audio == "copy":
+        console.log("[yellow] audio stream copy failed, re-encoding audio to AAC[/yellow]")
+        proc = subprocess.run(build("aac"), capture_output = True, text = True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg {what} failed:\n{proc.stderr}")
+
+
+def assemble_frames(
+        frames_dir: Path,
+        audio_source: Path,
+        output_path: Path,
+        fps: float,
+        size: tuple[int, int] | None = None,
+        suffix: str = ".png",
+        encoder: EncoderSettings | None = None,
+        jobs: int = 1,
+        metrics: Optional[JobMetrics] = None,
+) -> None:
+    """
+    Encode `frames_dir/frame_%06d<suffix>` into `output_path` with the audio of
+    `audio_source`; `size` (width, height) resizes in the encode pass. `jobs > 1`
+    encodes segments in parallel (see module docstring), 0 = one per core.
+    """
+    encoder = encoder or DEFAULT_ENCODER
+    frames = sorted(frames_dir.glob(f"frame_*{suffix}"))
+    jobs = jobs or os.cpu_count() or 1
+    ranges = segment_ranges(len(frames), jobs, fps) if jobs > 1 and frames else [(0, len(frames))]
+    duration = len(frames) / fps if frames and fps else None
+
+    t0 = time.perf_counter()
+    if len(ranges) <= 1:
+        console.log("[cyan] Assemling video... [/cyan]")
+        run_with_audio_fallback(
+            lambda audio: assemble_command(
+                frames_dir, audio_source, output_path, fps, size, suffix, encoder, audio, duration,
+            ),
+            encoder, "assemble",
+        )
+    else:
+        # Frame numbers come from the file names: extraction numbers from 1, but
+        # don't rely on it.
+        first = int(frames[0].stem.split("_")[-1])
+        threads = encoder.threads or max(1, (os.cpu_count() or 1) // len(ranges))
+        seg_dir = Path(tempfile.mkdtemp(prefix = "segments_", dir = frames_dir.parent))
+        segments = [seg_dir / f"seg_{k:04d}{output_path.suffix or '.mp4'}" for k in range(len(ranges))]
+        console.log(f"[cyan] Assembling video in {len(ranges)} parallel segments ({threads} threads each)...[/cyan]")
+
+        def encode(k: int) -> None:
+            offset, count = ranges[k]
+            cmd = segment_command(
+                frames_dir, segments[k], fps, first + offset, count, size, suffix, encoder, threads,
+            )
+            proc = subprocess.run(cmd, capture_output = True, text = True)
+            if proc.returncode != 0:
+                raise RuntimeError(f"ffmpeg segment {k} encode failed:\n{proc.stderr}")
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        try:
+            with ThreadPoolExecutor(max_workers = len(ranges)) as pool:
+                list(pool.map(encode, range(len(ranges))))
+            list_file = seg_dir / "segments.txt"
+            list_file.write_text("".join(f"file '{p.as_posix()}'\n" for p in segments))
+            run_with_audio_fallback(
+                lambda audio: concat_command(list_file, audio_source, output_path, encoder, audio, duration),
+                encoder, "concat",
+            )
+        finally:
+            shutil.rmtree(seg_dir, ignore_errors = True)
+
+    if metrics is not None:
+        metrics.event(
+            "encode",
+            codec = encoder.codec,
+            segments = len(ranges),
+            frames = len(frames),
+            seconds = time.perf_counter() - t0,
+        )
@@ -1,12 +1,14 @@
 # upscaler/upscaler/ffmpeg_utils.py
-import subprocess
+import json, re, subprocess, tempfile
 from pathlib import Path
 
 from rich.console import Console
 
+from .encode import DEFAULT_ENCODER, EncoderSettings, _length_args
+
 console = Console()
 
-def upscale_image_bicubic(input_path: Path, output_path: Path, scale: int) -> None: 
+def upscale_image_bicubic(input_path: Path, output_path: Path, scale: int, method: str = "bicubic") -> None: 
     w = f"iw*{scale}"
     h = f"ih*{scale}"
 
@@ -16,34 +18,224 @@ def upscale_image_bicubic(input_path: Path, output_path: Path, scale: int) -> No
         "-i",
         str(input_path),
         "-vf",
-        f"scale={w}:{h}:flags=bicubic",
+        f"scale={w}:{h}:flags={method}",
         str(output_path),
     ]
-    console.log(f"[blue] FFmpeg bicubic image[/blue]")
+    console.log(f"[blue] FFmpeg {method} image[/blue]")
     proc = subprocess.run(cmd, capture_output = True, text = True)
     if proc.returncode != 0: 
         console.print(f"[red] {proc.stderr}[/red]")
-        raise RuntimeError("ffmpeg bicubic image failed")
+        raise RuntimeError(f"ffmpeg {method} image failed")
     
-def upscale_video_bicubic(input_path: Path, output_path: Path, scale: int) -> None: 
-    w = f"iw*{scale}"
-    h = f"ih*{scale}"
-
+def resample_video_command(
+        input_path: Path,
+        output_path: Path,
+        scale: int,
+        method: str = "bicubic",
+        fps: float | None = None,
+        size: tuple[int, int] | None = None,
+        audio_codec: str | None = None,
+        encoder: EncoderSettings | None = None,
+) -> list[str]:
+    encoder = encoder or DEFAULT_ENCODER
+    audio_codec = audio_codec or encoder.audio
+    vf = f"scale={size[0]}:{size[1]}:flags={method}" if size else f"scale=iw*{scale}:ih*{scale}:flags={method}"
+    if fps is not None:
+        vf = f"fps={fps},{vf}"
     cmd = [
         "ffmpeg",
         "-y",
         "-i",
         str(input_path),
-        "-vf",
-        f"scale={w}:{h}:flags=bicubic",
-        "-c:v",
-        "libx264",
-        "-c:a",
-        "copy",
-        str(output_path),
+        "-map",
+        "0:v:0",
     ]
-    console.log(f"[blue] FFmpeg bicubic image[/blue]")
-    proc = subprocess.run(cmd, capture_output = True, text = True)
+    if audio_codec != "none":
+        cmd += ["-map", "0:a?"]
+    cmd += ["-vf", vf]
+    cmd += encoder.video_args()
+    cmd += encoder.audio_args(audio_codec)
+    cmd += [str(output_path)]
+    return cmd
+
+def upscale_video_bicubic(
+        input_path: Path,
+        output_path: Path,
+        scale: int,
+        method: str = "bicubic",
+        fps: float | None = None,
+        size: tuple[int, int] | None = None,
+        encoder: EncoderSettings | None = None,
+) -> int: 
+    """
+    Decode, resize (by `scale`, or to `size` = (width, height) when given) and encode
+    in a single ffmpeg pass; the audio stream is copied unless `encoder` says otherwise.
+    Falls back to AAC when the source audio codec cannot be stored in the output
+    container. Returns the number of frames encoded (0 if ffmpeg did not report it).
+    """
+    encoder = encoder or DEFAULT_ENCODER
+
+    def cmd(audio_codec: str) -> list[str]:
+        return resample_video_command(input_path, output_path, scale, method, fps, size, audio_codec, encoder)
+
+    console.log(f"[blue] FFmpeg {method} video[/blue]")
+    proc = subprocess.run(cmd(encoder.audio), capture_output = True, text = True)
+    if proc.returncode != 0 and encoder.audio == "copy":
+        console.log("[yellow] audio stream copy failed, re-encoding audio to AAC[/yellow]")
+        proc = subprocess.run(cmd("aac"), capture_output = True, text = True)
     if proc.returncode != 0: 
         console.print(f"[red] {proc.stderr}[/red]")
-        raise RuntimeError("ffmpeg bicubic image failed")
\ No newline at end of file
+        raise RuntimeError(f"ffmpeg {method} video failed")
+    frames = re.findall(r"frame=\s*(\d+)", proc.stderr or "")
+    return int(frames[-1]) if frames else 0
+
+def probe_video_size(input_path: Path) -> tuple[int, int]:
+    """
+    Return (width, height) of the first video stream.
+    """
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=width,height",
+        "-of",
+        "csv=s=x:p=0",
+        str(input_path),
+    ]
+    proc = subprocess.run(cmd, capture_output = True, text = True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe failed:\n{proc.stderr}")
+    try:
+        w_s, h_s = (proc.stdout or "").strip().splitlines()[0].split("x")[:2]
+        return int(w_s), int(h_s)
+    except Exception as e:
+        raise RuntimeError(f"Could not parse video size from ffprobe output: {proc.stdout!r}") from e
+
+
+def probe_duration(input_path: Path) -> float | None:
+    """
+    Container duration in seconds, or None when ffprobe cannot tell.
+    """
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-show_entries",
+        "format=duration",
+        "-of",
+        "default=nokey=1:noprint_wrappers=1",
+        str(input_path),
+    ]
+    proc = subprocess.run(cmd, capture_output = True, text = True)
+    try:
+        return float((proc.stdout or "").strip().splitlines()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def probe_keyframes(input_path: Path) -> list[float]:
+    """
+    Times (seconds from the container start, ascending) of the first video
+    stream's keyframes, read from packet flags without decoding. Empty when
+    ffprobe cannot tell.
+    """
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "format=start_time:packet=pts_time,flags",
+        "-of",
+        "json",
+        str(input_path),
+    ]
+    proc = subprocess.run(cmd, capture_output = True, text = True)
+    if proc.returncode != 0:
+        return []
+    try:
+        data = json.loads(proc.stdout or "{}")
+        start = float(data.get("format", {}).get("start_time") or 0.0)
+    except ValueError:
+        return []
+    times = set()
+    for packet in data.get("packets", []):
+        if "K" in packet.get("flags", "") and packet.get("pts_time") not in (None, "N/A"):
+            times.add(round(float(packet["pts_time"]) - start, 6))
+    return sorted(times)
+
+
+def open_rawvideo_reader(input_path: Path, fps: float | None = None) -> subprocess.Popen:
+    """
+    Start ffmpeg decoding `input_path` to rgb24 rawvideo on stdout.
+    stderr goes to a temp file so a chatty decoder can never block the pipe.
+    """
+    cmd = ["ffmpeg", "-v", "error", "-i", str(input_path)]
+    if fps is not None:
+        cmd += ["-vf", f"fps={fps}"]
+    cmd += ["-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+
+    console.log(f"[blue] FFmpeg rawvideo decode: {input_path}[/blue]")
+    return subprocess.Popen(
+        cmd,
+        stdin = subprocess.DEVNULL,
+        stdout = subprocess.PIPE,
+        stderr = tempfile.TemporaryFile(),
+        bufsize = 0,
+    )
+
+
+def open_rawvideo_writer(
+        output_path: Path,
+        width: int,
+        height: int,
+        fps: float,
+        audio_source: Path | None = None,
+        encoder: EncoderSettings | None = None,
+        duration: float | None = None,
+) -> subprocess.Popen:
+    """
+    Start ffmpeg encoding rgb24 rawvideo from stdin into `output_path`,
+    muxing the first audio stream of `audio_source` if it has one.
+    Audio is re-encoded (AAC unless `encoder` names another codec): a failed
+    stream copy cannot be retried once frames have been piped in. The output
+    is cut at `duration` (the video's length) rather than with `-shortest`,
+    which drops the last frames (see encode._length_args).
+    """
+    encoder = encoder or DEFAULT_ENCODER
+    audio_codec = "aac" if encoder.audio == "copy" else encoder.audio
+    cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "rawvideo",
+        "-pix_fmt", "rgb24",
+        "-s", f"{width}x{height}",
+        "-framerate", str(fps),
+        "-i", "-",
+    ]
+    if audio_source is not None and audio_codec != "none":
+        cmd += ["-i", str(audio_source), "-map", "0:v:0", "-map", "1:a:0?", *encoder.audio_args(audio_codec), *_length_args(duration)]
+    cmd += [*encoder.video_args(), str(output_path)]
+
+    console.log(f"[blue] FFmpeg rawvideo encode: {width}x{height} -> {output_path}[/blue]")
+    return subprocess.Popen(
+        cmd,
+        stdin = subprocess.PIPE,
+        stdout = subprocess.DEVNULL,
+        stderr = tempfile.TemporaryFile(),
+    )
+
+
+def read_process_stderr(proc: subprocess.Popen) -> str:
+    """Return whatever a process opened by `open_rawvideo_*` wrote to stderr."""
+    err = proc.stderr
+    if err is None:
+        return ""
+    try:
+        err.seek(0)
+        return err.read().decode(errors = "replace")
+    except Exception:
+        return ""
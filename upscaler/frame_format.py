@@ -0,0 +1,73 @@
+# upscaler/upscaler/frame_format.py
+"""
+Intermediate frame formats for the frame-folder video path.
+
+PNG deflate on both sides of the model is a large share of CPU time, so the
+format of extracted (input) and upscaled (output) frames is selectable. All
+formats are lossless:
+
+    name   suffix  notes
+    png    .png    ffmpeg/Pillow default compression (smallest on disk)
+    png0   .png    compression level 0: no deflate work, ~raw size
+    bmp    .bmp    uncompressed
+    ppm    .ppm    uncompressed
+    webp   .webp   lossless WebP (needs ffmpeg with libwebp)
+
+Backend support:
+- torch reads and writes every format.
+- the NCNN binary reads every format but only writes png/webp (`-f`), so its
+  output frames are PNG unless the format is webp.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class FrameFormat:
+    name: str
+    suffix: str
+    # Encoder options for the ffmpeg extract step (image2 muxer).
+    ffmpeg_args: tuple[str, ...] = ()
+    # Options for PIL.Image.save when the torch backend writes frames.
+    pil_options: dict = field(default_factory=dict, hash=False)
+    # What the NCNN binary writes for this format (-f).
+    ncnn_output: str = "png"
+    # Approximate on-disk bytes per RGB pixel, for scratch space estimates.
+    bytes_per_pixel: float = 3.0
+
+
+FRAME_FORMATS: dict[str, FrameFormat] = {
+    "png": FrameFormat("png", ".png", bytes_per_pixel=2.0),
+    "png0": FrameFormat(
+        "png0", ".png", ("-compression_level", "0"), {"compress_level": 0}, bytes_per_pixel=3.0,
+    ),
+    "bmp": FrameFormat("bmp", ".bmp", bytes_per_pixel=3.0),
+    "ppm": FrameFormat("ppm", ".ppm", bytes_per_pixel=3.0),
+    "webp": FrameFormat(
+        "webp", ".webp",
+        ("-c:v", "libwebp", "-lossless", "1", "-compression_level", "0", "-pix_fmt", "bgra"),
+        {"lossless": True, "method": 0},
+        ncnn_output="webp",
+        bytes_per_pixel=2.0,
+    ),
+}
+
+DEFAULT_FRAME_FORMAT = "png"
+
+
+def get_frame_format(name: Optional[str]) -> FrameFormat:
+    try:
+        return FRAME_FORMATS[name or DEFAULT_FRAME_FORMAT]
+    except KeyError:
+        raise ValueError(
+            f"Unknown frame format: {name!r} (expected one of {', '.join(FRAME_FORMATS)})"
+        ) from None
+
+
+def output_format(fmt: FrameFormat, backend: str) -> FrameFormat:
+    """The format `backend` writes upscaled frames in when given `fmt` input frames."""
+    if backend == "realesrgan":
+        return FRAME_FORMATS[fmt.ncnn_output]
+    return fmt
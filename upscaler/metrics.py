@@ -0,0 +1,263 @@
+# upscaler/upscaler/metrics.py
+"""
+Per-job instrumentation: stage timings, counters, queue depths, peak memory.
+
+API calls accept an optional `JobMetrics`; stages (probe, extract, infer,
+assemble, ...) are timed with `metrics.stage(name)`, which yields a dict the
+caller can fill with `bytes_in` / `bytes_out` / `frames` / anything else.
+Every finished stage and every `event()` becomes a JSON-able event that is kept
+on the object and forwarded to the configured sinks (e.g. a JSON-lines file).
+`finish()` samples peak memory and, when `prometheus_path` is set, writes a
+Prometheus textfile-collector file.
+
+Environment (used when the API creates the metrics object itself):
+- UPSCALER_METRICS_JSONL: append events to this JSON-lines file
+- UPSCALER_METRICS_PROM: write the Prometheus textfile here at the end of each job
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+EventSink = Callable[[dict], None]
+
+
+class JsonLinesSink:
+    """Append each event as one JSON line (thread-safe, flushed per line)."""
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict) -> None:
+        line = json.dumps(event, default=str, sort_keys=True)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+@dataclass
+class JobMetrics:
+    job_id: str = field(default_factory=lambda: os.urandom(6).hex())
+    labels: dict[str, str] = field(default_factory=dict)
+    stages: dict[str, float] = field(default_factory=dict)
+    frames: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    scratch_bytes: int = 0
+    queue_peaks: dict[str, int] = field(default_factory=dict)
+    peak_rss_bytes: int = 0
+    peak_child_rss_bytes: int = 0
+    peak_gpu_bytes: int = 0
+    wall_seconds: float = 0.0
+    events: list[dict] = field(default_factory=list)
+    sinks: list[EventSink] = field(default_factory=list, repr=False)
+    prometheus_path: Optional[Path] = None
+    _started: float = field(default_factory=time.time, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @classmethod
+    def from_env(cls) -> Optional["JobMetrics"]:
+        """A metrics object wired to UPSCALER_METRICS_* sinks, or None when neither is set."""
+        jsonl = os.environ.get("UPSCALER_METRICS_JSONL")
+        prom = os.environ.get("UPSCALER_METRICS_PROM")
+        if not jsonl and not prom:
+            return None
+        return cls(
+            sinks=[JsonLinesSink(jsonl)] if jsonl else [],
+            prometheus_path=Path(prom) if prom else None,
+        )
+
+    def event(self, kind: str, **fields: Any) -> dict:
+        ev = {"ts": time.time(), "job": self.job_id, "event": kind, **self.labels, **fields}
+        with self._lock:
+            self.events.append(ev)
+        for sink in self.sinks:
+            try:
+                sink(ev)
+            except Exception:
+                # Telemetry must never break a job.
+                pass
+        return ev
+
+    @contextmanager
+    def stage(self, name: str, **attrs: Any) -> Iterator[dict]:
+        info: dict[str, Any] = dict(attrs)
+        t0 = time.perf_counter()
+        error = None
+        try:
+            yield info
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            seconds = time.perf_counter() - t0
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+                self.bytes_read += int(info.get("bytes_in", 0) or 0)
+                self.bytes_written += int(info.get("bytes_out", 0) or 0)
+            self.event("stage", stage=name, seconds=seconds, error=error, **info)
+
+    def add(self, counter: str, value: int) -> None:
+        """Increment `frames`, `bytes_read` or `bytes_written` (thread-safe)."""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    def observe_queue(self, name: str, depth: int) -> None:
+        with self._lock:
+            if depth > self.queue_peaks.get(name, -1):
+                self.queue_peaks[name] = depth
+
+    def finish(self) -> None:
+        """Sample peak memory, emit the job summary event and write the Prometheus file."""
+        self.wall_seconds = time.time() - self._started
+        rss_self, rss_children = peak_memory()
+        self.peak_rss_bytes = max(self.peak_rss_bytes, rss_self)
+        self.peak_child_rss_bytes = max(self.peak_child_rss_bytes, rss_children)
+        self.peak_gpu_bytes = max(self.peak_gpu_bytes, _peak_gpu_bytes())
+        summary = self.to_dict()
+        summary.pop("labels", None)
+        self.event("job", **summary)
+        if self.prometheus_path is not None:
+            write_prometheus(self, self.prometheus_path)
+
+    @property
+    def fps(self) -> float:
+        return self.frames / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "labels": dict(self.labels),
+            "stages": dict(self.stages),
+            "frames": self.frames,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "scratch_bytes": self.scratch_bytes,
+            "queue_peaks": dict(self.queue_peaks),
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "peak_child_rss_bytes": self.peak_child_rss_bytes,
+            "peak_gpu_bytes": self.peak_gpu_bytes,
+            "wall_seconds": self.wall_seconds,
+            "fps": self.fps,
+        }
+
+
+@contextmanager
+def stage(metrics: Optional[JobMetrics], name: str, **attrs: Any) -> Iterator[dict]:
+    """`metrics.stage(name)` that tolerates `metrics=None`."""
+    if metrics is None:
+        yield dict(attrs)
+        return
+    with metrics.stage(name, **attrs) as info:
+        yield info
+
+
+def peak_memory() -> tuple[int, int]:
+    """
+    (self, children) peak RSS in bytes; 0 where unsupported.
+    On Linux ru_maxrss survives exec, so a spawned child would report its parent's
+    peak; VmHWM from /proc is per address space and is used instead when available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0, 0
+    mult = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is KiB on Linux, bytes on macOS
+    rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * mult
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    rss_self = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    return rss_self, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * mult
+
+
+def _peak_gpu_bytes() -> int:
+    # Only if the torch backend already imported torch; never import it just for this.
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return 0
+    try:
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            return int(torch.cuda.max_memory_allocated())
+    except Exception:
+        pass
+    return 0
+
+
+def _prom_labels(labels: dict[str, str]) -> str:
+    def esc(v: str) -> str:
+        return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+def to_prometheus(metrics: JobMetrics) -> str:
+    """Render the job as Prometheus text exposition format (gauges, last job wins)."""
+    base = {"host": socket.gethostname(), **metrics.labels}
+    lines: list[str] = []
+
+    def gauge(name: str, help_text: str, samples: list[tuple[dict, float]]) -> None:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_prom_labels({**base, **labels})} {value}")
+
+    gauge("upscaler_job_wall_seconds", "Wall time of the last job.", [({}, metrics.wall_seconds)])
+    gauge("upscaler_job_frames", "Frames processed by the last job.", [({}, metrics.frames)])
+    gauge("upscaler_job_fps", "End-to-end frames per second of the last job.", [({}, metrics.fps)])
+    gauge(
+        "upscaler_stage_seconds",
+        "Time spent per stage in the last job.",
+        [({"stage": k}, v) for k, v in sorted(metrics.stages.items())],
+    )
+    gauge("upscaler_job_bytes_read", "Bytes read by the last job.", [({}, metrics.bytes_read)])
+    gauge("upscaler_job_bytes_written", "Bytes written by the last job.", [({}, metrics.bytes_written)])
+    gauge("upscaler_job_scratch_bytes", "Peak scratch disk usage of the last job.", [({}, metrics.scratch_bytes)])
+    gauge(
+        "upscaler_queue_depth_max",
+        "Deepest observed queue depth in the last job.",
+        [({"queue": k}, v) for k, v in sorted(metrics.queue_peaks.items())],
+    )
+    gauge("upscaler_peak_rss_bytes", "Peak RSS of the upscaler process.", [({}, metrics.peak_rss_bytes)])
+    gauge(
+        "upscaler_peak_child_rss_bytes",
+        "Peak RSS of the largest child process (ffmpeg, NCNN binary).",
+        [({}, metrics.peak_child_rss_bytes)],
+    )
+    gauge("upscaler_peak_gpu_bytes", "Peak CUDA memory allocated by torch.", [({}, metrics.peak_gpu_bytes)])
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(metrics: JobMetrics, path: Path | str) -> None:
+    """Atomically write the textfile-collector file (node_exporter reads *.prom)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(to_prometheus(metrics))
+    os.replace(tmp, path)
+
+
+def dir_size(path: Path) -> int:
+    """Total size in bytes of the regular files under `path`."""
+    total = 0
+    for p in Path(path).rglob("*"):
+        try:
+            if p.is_file():
+                total += p.stat().st_size
+        except FileNotFoundError:
+            continue
+    return total
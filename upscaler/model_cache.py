@@ -0,0 +1,158 @@
+# upscaler/upscaler/model_cache.py
+"""
+Process-wide LRU cache for loaded models.
+
+Backend-agnostic: the cache only sees keys, loader callables and sizes, so the torch
+backend can cache `RRDBNet` instances without this module importing torch.
+Limits default from the environment:
+- UPSCALER_MODEL_CACHE_ENTRIES: max number of cached models (default 2)
+- UPSCALER_MODEL_CACHE_MB: max total size in MiB (default: unlimited)
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, Optional
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    val = os.environ.get(name)
+    if val is None or val == "":
+        return default
+    try:
+        return int(val)
+    except Exception:
+        return default
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+
+@dataclass
+class _LoadSlot:
+    """Serializes loads of one key; dropped when no thread waits on it."""
+    lock: threading.RLock = field(default_factory=threading.RLock)
+    users: int = 0
+
+
+class ModelCache:
+    def __init__(self, max_entries: Optional[int] = 2, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, tuple[Any, int]]" = OrderedDict()
+        self._loading: dict[Hashable, _LoadSlot] = {}
+        self._lock = threading.RLock()
+        self._stats = CacheStats()
+
+    def configure(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None) -> None:
+        """Change limits (None keeps the current value) and evict down to them."""
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._shrink()
+
+    def get(
+            self,
+            key: Hashable,
+            loader: Callable[[], Any],
+            size_of: Optional[Callable[[Any], int]] = None,
+    ) -> Any:
+        """
+        Return the cached value for `key`, loading (and caching) it on a miss.
+        Loads run outside the cache lock: hits and loads of other keys do not wait
+        for them; concurrent misses on the same key wait for one load.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return entry[0]
+            slot = self._loading.get(key)
+            if slot is None:
+                slot = self._loading[key] = _LoadSlot()
+            slot.users += 1
+
+        try:
+            with slot.lock:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        # Loaded by the thread this one waited for.
+                        self._entries.move_to_end(key)
+                        self._stats.hits += 1
+                        return entry[0]
+                    self._stats.misses += 1
+                value = loader()
+                size = int(size_of(value)) if size_of is not None else 0
+                with self._lock:
+                    self._entries[key] = (value, size)
+                    self._shrink(keep=key)
+                return value
+        finally:
+            with self._lock:
+                slot.users -= 1
+                if not slot.users:
+                    del self._loading[key]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def keys(self) -> list[Hashable]:
+        with self._lock:
+            return list(self._entries.keys())
+
+    def evict(self, key: Optional[Hashable] = None) -> int:
+        """Drop `key` (or everything when None). Returns the number of entries removed."""
+        with self._lock:
+            if key is None:
+                n = len(self._entries)
+                self._entries.clear()
+            else:
+                n = 1 if self._entries.pop(key, None) is not None else 0
+            self._stats.evictions += n
+            return n
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self._stats.hits,
+                misses=self._stats.misses,
+                evictions=self._stats.evictions,
+                entries=len(self._entries),
+                bytes=sum(size for _value, size in self._entries.values()),
+            )
+
+    def _shrink(self, keep: Optional[Hashable] = None) -> None:
+        # Evict least recently used entries until within limits; never the entry just loaded.
+        def over() -> bool:
+            if self.max_entries is not None and len(self._entries) > max(self.max_entries, 1):
+                return True
+            if self.max_bytes is not None and self.max_bytes > 0:
+                return sum(size for _value, size in self._entries.values()) > self.max_bytes
+            return False
+
+        while over():
+            victim = next((k for k in self._entries if k != keep), None)
+            if victim is None:
+                break
+            del self._entries[victim]
+            self._stats.evictions += 1
+
+
+_mb = _env_int("UPSCALER_MODEL_CACHE_MB", None)
+MODEL_CACHE = ModelCache(
+    max_entries=_env_int("UPSCALER_MODEL_CACHE_ENTRIES", 2),
+    max_bytes=_mb * 1024 * 1024 if _mb else None,
+)
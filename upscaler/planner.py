@@ -0,0 +1,122 @@
+# upscaler/upscaler/planner.py
+"""
+Pick the model pass for a requested upscale.
+
+A request is an overall factor (`scale`) or an output height (`target_height`).
+Among the models of the requested model's family (general / anime) that the
+backend can run, the planner picks the one with the smallest native scale that
+still reaches the factor: a 2x model does a quarter of the work of a 4x one.
+Whatever is left between the model's native output and the requested size is a
+plain resize applied in the same pass (on-device for torch, in the encode filter
+for video). Requests no single model pass can satisfy raise `PlanError` before
+any frames are extracted.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+from .config import MODEL_SCALES, MODELS_DIR, REALESRGAN_MODELS, TORCH_MODEL_URLS
+
+
+class PlanError(ValueError):
+    """The requested model/scale/size combination cannot be produced."""
+
+
+@dataclass(frozen=True)
+class UpscalePlan:
+    model: str
+    model_scale: int        # native scale of the model pass
+    factor: float           # requested overall factor
+    # Exact output (width, height); None when the input size was not given.
+    out_size: Optional[tuple[int, int]] = None
+
+    @property
+    def needs_resize(self) -> bool:
+        return self.factor != self.model_scale
+
+
+def model_family(model: str) -> str:
+    """'general' / 'anime' for known models (from config.REALESRGAN_MODELS), else the name itself."""
+    for alias, name in REALESRGAN_MODELS.items():
+        if name == model:
+            return alias.rsplit("-", 1)[0]
+    return model
+
+
+def backend_models(backend: str) -> list[str]:
+    """Models `backend` can run here."""
+    if backend in ("torch", "onnx"):
+        # onnx graphs are exported from the torch weights.
+        return [m for m in MODEL_SCALES if m in TORCH_MODEL_URLS]
+    if backend == "realesrgan":
+        # Only NCNN models that are unpacked locally (the stock archive has no x2plus).
+        return [
+            m for m in MODEL_SCALES
+            if (MODELS_DIR / f"{m}.param").exists() and (MODELS_DIR / f"{m}.bin").exists()
+        ]
+    return list(MODEL_SCALES)
+
+
+def output_size(width: int, height: int, factor: float, even: bool = False) -> tuple[int, int]:
+    """`width`x`height` scaled by `factor`; `even` rounds to even sizes (yuv420p video)."""
+    def dim(v: int) -> int:
+        d = max(1, round(v * factor))
+        return d + (d % 2) if even else d
+
+    return dim(width), dim(height)
+
+
+def factor_for(scale: float | None, target_height: int | None, input_size: tuple[int, int] | None) -> float:
+    """The overall factor of a request (target height wins over scale)."""
+    if target_height is not None:
+        if target_height <= 0:
+            raise PlanError(f"target height must be positive, got {target_height}")
+        if input_size is None:
+            raise PlanError("a target height needs the input size")
+        factor = target_height / input_size[1]
+    elif scale is not None:
+        factor = float(scale)
+    else:
+        raise PlanError("either a scale or a target height is required")
+    if factor < 1:
+        raise PlanError(f"factor {factor:g} would downscale; only upscaling is supported")
+    return factor
+
+
+def plan_upscale(
+        model: str,
+        scale: float | None = None,
+        target_height: int | None = None,
+        input_size: tuple[int, int] | None = None,
+        backend: str = "realesrgan",
+        even: bool = False,
+) -> UpscalePlan:
+    """
+    Plan one model pass for `model` (or a cheaper model of its family) reaching
+    `scale`, or `target_height` when given. `input_size` is (width, height).
+    """
+    if model not in MODEL_SCALES:
+        raise PlanError(f"Unknown model: {model!r} (expected one of {sorted(MODEL_SCALES)})")
+    factor = factor_for(scale, target_height, input_size)
+
+    family = model_family(model)
+    available = [m for m in backend_models(backend) if model_family(m) == family]
+    if backend == "realesrgan" and model not in available:
+        # Not unpacked yet (e.g. --auto-download will fetch it): keep the requested model.
+        available.append(model)
+    if not available:
+        raise PlanError(f"Backend {backend!r} has no {family} model (requested {model!r})")
+
+    # Smallest native scale that reaches the factor; the requested model wins ties.
+    candidates = sorted(available, key=lambda m: (MODEL_SCALES[m], m != model))
+    chosen = next((m for m in candidates if MODEL_SCALES[m] >= factor), None)
+    if chosen is None:
+        best = max(MODEL_SCALES[m] for m in available)
+        raise PlanError(
+            f"{factor:g}x exceeds the largest {family} model available to {backend!r} ({best}x); "
+            f"run a second pass on the output instead"
+        )
+
+    out_size = output_size(*input_size, factor, even=even) if input_size is not None else None
+    return UpscalePlan(model=chosen, model_scale=MODEL_SCALES[chosen], factor=factor, out_size=out_size)
@@ -0,0 +1,287 @@
+# upscaler/upscaler/preflight.py
+"""
+Vulkan device preflight for the NCNN backend.
+
+`run_realesrgan` can only tell that Vulkan resolved to a software device
+(llvmpipe/SwiftShader) from the output of a finished run, i.e. after a whole
+video was extracted and processed on CPU. The preflight runs the binary once
+with `-v` on a tiny image, records the devices it enumerates and whether each
+is hardware or software, and caches that on disk keyed by host, binary and
+Vulkan driver, so it costs one extra process per configuration, not per job.
+
+Jobs then fail fast (`force_gpu`), pin `-g` to a hardware device when the
+default would land on a software one, or, for `backend="auto"`, pick the
+backend before any frame work starts.
+
+Environment:
+- UPSCALER_DEVICE_CACHE: cache file (default ~/.cache/upscaler/devices.json)
+- UPSCALER_PREFLIGHT=0: skip the preflight
+"""
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import os
+import re
+import socket
+import subprocess
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from rich.console import Console
+
+console = Console()
+
+PREFLIGHT_TIMEOUT = 120.0
+
+# ncnn prints one or more lines per enumerated device: "[0 NVIDIA GeForce RTX 3080]  queueC=2[8] ..."
+_DEVICE_LINE = re.compile(r"^\[(\d+) (.+?)\]\s+(.*)$")
+_FP16 = re.compile(r"fp16-p/s/a=(\d)/(\d)/(\d)")
+
+_ICD_DIRS = (
+    "/usr/share/vulkan/icd.d",
+    "/usr/local/share/vulkan/icd.d",
+    "/etc/vulkan/icd.d",
+)
+
+
+@dataclass
+class VulkanDevice:
+    index: int
+    name: str
+    software: bool
+    fp16: Optional[bool] = None
+
+
+@dataclass
+class DeviceReport:
+    key: str
+    binary: str
+    devices: list[VulkanDevice] = field(default_factory=list)
+    returncode: int = 0
+    created: float = field(default_factory=time.time)
+
+    @property
+    def hardware(self) -> list[VulkanDevice]:
+        return [d for d in self.devices if not d.software]
+
+    @property
+    def software_only(self) -> bool:
+        return bool(self.devices) and not self.hardware
+
+    def device(self, index: int) -> Optional[VulkanDevice]:
+        return next((d for d in self.devices if d.index == index), None)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DeviceReport":
+        devices = [VulkanDevice(**d) for d in data.get("devices", [])]
+        return cls(**{**data, "devices": devices})
+
+
+def cache_file() -> Path:
+    env = os.environ.get("UPSCALER_DEVICE_CACHE")
+    return Path(env) if env else Path.home() / ".cache" / "upscaler" / "devices.json"
+
+
+def preflight_enabled() -> bool:
+    return os.environ.get("UPSCALER_PREFLIGHT", "1").lower() not in ("0", "false", "no", "off")
+
+
+def driver_fingerprint() -> str:
+    """Short hash of what decides which Vulkan drivers load: ICD env vars and files, NVIDIA driver version."""
+    parts = [f"{k}={os.environ.get(k, '')}" for k in ("VK_ICD_FILENAMES", "VK_DRIVER_FILES")]
+    for d in _ICD_DIRS:
+        for path in sorted(glob.glob(os.path.join(d, "*.json"))):
+            try:
+                parts.append(f"{path}:{os.stat(path).st_mtime_ns}")
+            except OSError:
+                pass
+    try:
+        parts.append(Path("/proc/driver/nvidia/version").read_text().splitlines()[0])
+    except (OSError, IndexError):
+        pass
+    parts.append(f"dri={sorted(os.listdir('/dev/dri')) if os.path.isdir('/dev/dri') else []}")
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()[:12]
+
+
+def cache_key(binary: Path) -> str:
+    try:
+        st = binary.stat()
+        stamp = f"{st.st_size}:{st.st_mtime_ns}"
+    except OSError:
+        stamp = "missing"
+    return f"{socket.gethostname()}|{binary.resolve()}|{stamp}|driver={driver_fingerprint()}"
+
+
+def parse_devices(output: str) -> list[VulkanDevice]:
+    """Devices from the binary's `-v` output, one entry per index (first name seen)."""
+    from .realesrgan_vulkan import _is_software_vulkan
+
+    devices: dict[int, VulkanDevice] = {}
+    for line in output.splitlines():
+        m = _DEVICE_LINE.match(line.strip())
+        if not m:
+            continue
+        index, name, rest = int(m.group(1)), m.group(2), m.group(3)
+        dev = devices.setdefault(index, VulkanDevice(index, name, _is_software_vulkan(name)))
+        fp16 = _FP16.search(rest)
+        if fp16 and dev.name == name:
+            dev.fp16 = fp16.group(1) == "1"
+    return [devices[k] for k in sorted(devices)]
+
+
+def _load() -> dict:
+    try:
+        return json.loads(cache_file().read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _store(report: DeviceReport) -> None:
+    path = cache_file()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = _load()
+    data[report.key] = asdict(report)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=2, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def run_preflight(model_name: str = "realesrgan-x4plus", auto_download: bool = False) -> DeviceReport:
+    """Run the binary once on a 16x16 image with `-v` and parse the devices it reports."""
+    from PIL import Image
+
+    from .realesrgan_vulkan import build_realesrgan_command
+
+    with tempfile.TemporaryDirectory(prefix="upscaler_preflight_") as tmp:
+        src = Path(tmp) / "in.png"
+        Image.new("RGB", (16, 16)).save(src)
+        rc = build_realesrgan_command(
+            src, Path(tmp) / "out.png", 4, model_name, auto_download=auto_download, verbose=True,
+        )
+        # Device selection is what is being probed: ignore -g from the environment.
+        if rc.gpu_id is not None:
+            i = rc.cmd.index("-g")
+            del rc.cmd[i:i + 2]
+        try:
+            proc = subprocess.run(rc.cmd, capture_output=True, text=True, timeout=PREFLIGHT_TIMEOUT)
+        except subprocess.TimeoutExpired as e:
+            raise RuntimeError(f"RealESRGAN preflight did not finish in {PREFLIGHT_TIMEOUT:.0f}s") from e
+    combined = (proc.stdout or "") + "\n" + (proc.stderr or "")
+    report = DeviceReport(
+        key=cache_key(Path(rc.cmd[0])),
+        binary=rc.cmd[0],
+        devices=parse_devices(combined),
+        returncode=proc.returncode,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"RealESRGAN preflight failed (exit {proc.returncode}):\n{combined.strip()}")
+    return report
+
+
+def preflight(model_name: str = "realesrgan-x4plus", auto_download: bool = False, refresh: bool = False) -> DeviceReport:
+    """The cached device report for this host/binary/driver, running the preflight on a miss."""
+    from . import realesrgan_vulkan
+
+    if not refresh:
+        # Resolved the way build_realesrgan_command resolves it.
+        binary = realesrgan_vulkan.ensure_realesrgan_binary(auto_download=auto_download)
+        entry = _load().get(cache_key(binary))
+        if entry:
+            return DeviceReport.from_dict(entry)
+
+    t0 = time.perf_counter()
+    report = run_preflight(model_name, auto_download=auto_download)
+    _store(report)
+    names = ", ".join(f"{d.index}: {d.name}{' (software)' if d.software else ''}" for d in report.devices) or "none reported"
+    console.log(f"[cyan] Vulkan preflight ({time.perf_counter() - t0:.1f}s): {names}[/cyan]")
+    return report
+
+
+def _software_message(report: DeviceReport) -> str:
+    names = ", ".join(d.name for d in report.devices)
+    return (
+        f"Vulkan only offers software devices here ({names}), which run on CPU. "
+        "Check the GPU driver / Vulkan ICD (in WSL/Docker/VMs: GPU passthrough), "
+        "or use --backend torch on a CUDA host."
+    )
+
+
+def choose_gpu(report: DeviceReport, gpu_id: Optional[int], force_gpu: bool = False) -> Optional[int]:
+    """
+    The `-g` value to run with: `gpu_id` when given (checked against the report),
+    else a hardware device when the binary's default could be a software one.
+    Raises RuntimeError when `force_gpu` and only software devices are available.
+    """
+    force_gpu = force_gpu or os.environ.get("CUTSMITH_FORCE_GPU") in ("1", "true", "yes", "on")
+    if gpu_id == -1 or not report.devices:
+        # Explicit CPU, or nothing to go on (the run itself still checks its output).
+        return gpu_id
+
+    if gpu_id is not None:
+        dev = report.device(gpu_id)
+        if dev is None:
+            raise RuntimeError(
+                f"Vulkan device {gpu_id} not found; available: "
+                + ", ".join(f"{d.index} ({d.name})" for d in report.devices)
+            )
+        if dev.software and force_gpu:
+            raise RuntimeError(f"Vulkan device {gpu_id} ({dev.name}) is a software device. " + _software_message(report))
+        return gpu_id
+
+    if report.software_only:
+        if force_gpu:
+            raise RuntimeError(_software_message(report))
+        console.print(f"[yellow]{_software_message(report)}[/yellow]")
+        return None
+    if len(report.hardware) < len(report.devices):
+        # Pin a hardware device rather than trusting the binary's default choice.
+        return report.hardware[0].index
+    return None
+
+
+def preflight_gpu(
+        model_name: str,
+        gpu_id: Optional[int],
+        force_gpu: bool = False,
+        auto_download: bool = False,
+) -> Optional[int]:
+    """`choose_gpu` on the cached report; returns `gpu_id` untouched when preflight is disabled."""
+    if not preflight_enabled():
+        return gpu_id
+    if gpu_id is None:
+        from .realesrgan_vulkan import _env_int
+
+        gpu_id = _env_int("CUTSMITH_UPSCALER_GPU_ID")
+        if gpu_id is None:
+            gpu_id = _env_int("REALESRGAN_GPU_ID")
+    return choose_gpu(preflight(model_name, auto_download=auto_download), gpu_id, force_gpu)
+
+
+def auto_backend(model_name: str = "realesrgan-x4plus", auto_download: bool = False) -> str:
+    """
+    Backend for `backend="auto"`: NCNN on a hardware Vulkan device, else torch on
+    CUDA when installed, else onnx (CPU) when installed, else NCNN anyway
+    (software Vulkan / CPU).
+    """
+    from .backends import backend_available
+
+    report: Optional[DeviceReport] = None
+    try:
+        report = preflight(model_name, auto_download=auto_download) if preflight_enabled() else None
+    except RuntimeError as e:
+        console.print(f"[yellow]Vulkan preflight failed ({e}); considering torch[/yellow]")
+    if report is not None and (report.hardware or not report.devices):
+        return "realesrgan"
+    if backend_available("torch"):
+        import torch
+
+        if torch.cuda.is_available():
+            return "torch"
+    if backend_available("onnx"):
+        return "onnx"
+    return "realesrgan"
@@ -0,0 +1,353 @@
+# upscaler/upscaler/realesrgan_onnx.py
+"""
+ONNX Runtime backend: Real-ESRGAN on the CPU with neither Vulkan nor torch at runtime.
+
+The first use of a model exports the RRDBNet that `load_realesrgan_model` builds
+(same weights, same pre/post-processing as the torch backend, dynamic batch and
+spatial axes) to `<onnx dir>/<model>.onnx`; later runs only load that graph, so
+hosts without torch work once the file is there (copy it, or export where torch
+is installed).
+
+Inference uses the CPU execution provider with full graph optimizations, one
+intra-op pool sized to the CPUs this process may run on and IO binding into
+reused output buffers. Batching and tiling follow the torch backend: frames
+(or same-sized tiles of frames, see tiling) are batched together.
+
+Environment:
+- UPSCALER_ONNX_DIR: graph directory (default ~/.cache/realesrgan/onnx)
+- UPSCALER_ONNX_THREADS: intra-op threads (default: CPUs in this process's affinity mask)
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+import onnxruntime as ort
+from rich.console import Console
+
+from .batching import aligned_size
+from .config import INPUT_MULTIPLE, MODEL_SCALES
+from .metrics import JobMetrics
+from .model_cache import MODEL_CACHE
+from .tiling import Tile, auto_tile_size, host_available_memory, plan_tiles
+
+console = Console()
+
+ONNX_OPSET = 17
+INPUT_NAME = "input"
+OUTPUT_NAME = "output"
+
+
+def onnx_dir() -> Path:
+    env = os.environ.get("UPSCALER_ONNX_DIR")
+    return Path(env) if env else Path.home() / ".cache" / "realesrgan" / "onnx"
+
+
+def onnx_model_path(model_name: str) -> Path:
+    return onnx_dir() / f"{model_name}.onnx"
+
+
+def default_threads() -> int:
+    env = os.environ.get("UPSCALER_ONNX_THREADS")
+    if env:
+        return max(1, int(env))
+    try:
+        # Container CPU limits show up in the affinity mask, not in os.cpu_count().
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def export_onnx(model_name: str, path: Optional[Path] = None, opset: int = ONNX_OPSET) -> Path:
+    """
+    Export `model_name` to an ONNX graph at `path` (default `onnx_model_path`).
+    Needs the torch backend; the graph takes and returns NCHW float32 in [0, 1].
+    """
+    path = Path(path or onnx_model_path(model_name))
+    try:
+        import torch
+
+        from .realesrgan_torch import load_realesrgan_model
+    except Exception as e:
+        raise RuntimeError(
+            f"No ONNX graph for {model_name} at {path}, and exporting one needs the torch backend ({e}). "
+            "Export it once where torch is installed and copy it there (or set UPSCALER_ONNX_DIR)."
+        ) from e
+
+    class _Exportable(torch.nn.Module):
+        # The torch backend's normalization (mean/std 0.5) and output mapping, baked into the graph.
+        def __init__(self, net: torch.nn.Module):
+            super().__init__()
+            self.net = net
+
+        def forward(self, x: torch.Tensor) -> torch.Tensor:
+            return self.net(x * 2.0 - 1.0).mul(0.5).add(0.5).clamp(0.0, 1.0)
+
+    console.log(f"[cyan][upscaler] Exporting {model_name} to ONNX: {path}[/cyan]")
+    net = _Exportable(load_realesrgan_model(model_name, MODEL_SCALES.get(model_name, 4), "cpu")).eval()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with torch.inference_mode():
+            torch.onnx.export(
+                net,
+                (torch.rand(1, 3, 32, 32),),
+                str(tmp),
+                input_names=[INPUT_NAME],
+                output_names=[OUTPUT_NAME],
+                dynamic_axes={INPUT_NAME: {0: "n", 2: "h", 3: "w"}, OUTPUT_NAME: {0: "n", 2: "oh", 3: "ow"}},
+                opset_version=opset,
+                dynamo=False,
+            )
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return path
+
+
+def ensure_onnx_model(model_name: str) -> Path:
+    path = onnx_model_path(model_name)
+    return path if path.exists() else export_onnx(model_name, path)
+
+
+def get_onnx_session(model_name: str, threads: Optional[int] = None) -> ort.InferenceSession:
+    """An InferenceSession for `model_name` through MODEL_CACHE, keyed by (model, "onnx", threads)."""
+    threads = threads or default_threads()
+
+    def load() -> ort.InferenceSession:
+        path = ensure_onnx_model(model_name)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        # One pool does the work: the graph is a single chain of convolutions.
+        opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        return ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+
+    return MODEL_CACHE.get(
+        (model_name, MODEL_SCALES.get(model_name, 4), "onnx", threads),
+        load,
+        lambda _session: onnx_model_path(model_name).stat().st_size,
+    )
+
+
+class _BoundRunner:
+    """
+    Runs a session with IO binding: inputs are bound in place and outputs are
+    written into a buffer reused per output shape. The returned array is only
+    valid until the next call with the same shape.
+    """
+
+    MAX_BUFFERS = 8
+
+    def __init__(self, session: ort.InferenceSession, scale: int):
+        self.session = session
+        self.scale = scale
+        self._buffers: dict[tuple[int, ...], np.ndarray] = {}
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        n, c, h, w = batch.shape
+        shape = (n, c, h * self.scale, w * self.scale)
+        out = self._buffers.get(shape)
+        if out is None:
+            if len(self._buffers) >= self.MAX_BUFFERS:
+                self._buffers.clear()
+            out = self._buffers[shape] = np.empty(shape, dtype=np.float32)
+        binding = self.session.io_binding()
+        binding.bind_cpu_input(INPUT_NAME, np.ascontiguousarray(batch, dtype=np.float32))
+        binding.bind_output(OUTPUT_NAME, "cpu", 0, np.float32, list(shape), out.ctypes.data)
+        self.session.run_with_iobinding(binding)
+        return out
+
+
+def _to_input(img: np.ndarray) -> np.ndarray:
+    """uint8 HWC -> float32 1xCxHxW in [0, 1]."""
+    return (img.transpose(2, 0, 1)[None].astype(np.float32)) / 255.0
+
+
+def _pad_to(x: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Pad a CxHxW array at the bottom/right to height x width (as realesrgan_torch._pad_to)."""
+    h, w = x.shape[-2:]
+    if (h, w) == (height, width):
+        return x
+    # Reflection needs the padding to be smaller than the image.
+    mode = "reflect" if (height - h < h and width - w < w) else "edge"
+    return np.pad(x, ((0, 0), (0, height - h), (0, width - w)), mode=mode)
+
+
+def _to_uint8(out: np.ndarray) -> np.ndarray:
+    """float CHW in [0, 1] -> uint8 HWC (same rounding as the torch backend)."""
+    return (out * 255.0 + 0.5).clip(0, 255).astype(np.uint8).transpose(1, 2, 0)
+
+
+class _OnnxFrameUpscaler:
+    """
+    numpy counterpart of realesrgan_torch._FrameUpscaler: whole frames batched
+    by size, or tiled (`tile_size`, 0 = from available memory) with same-sized
+    windows of all frames batched together. Frames are padded to the model's
+    input multiple and the outputs cropped back. `out_size` resizes outputs (Lanczos).
+    """
+
+    def __init__(
+            self,
+            runner: _BoundRunner,
+            scale: int,
+            batch_size: int,
+            tile_size: Optional[int] = None,
+            tile_pad: int = 10,
+            out_size: Optional[tuple[int, int]] = None,
+    ):
+        self.runner = runner
+        self.scale = scale
+        self.batch_size = max(1, batch_size)
+        self.tile_pad = max(0, tile_pad)
+        if tile_size is not None and tile_size <= 0:
+            tile_size = auto_tile_size(host_available_memory(), scale, 4, self.tile_pad)
+            console.log(f"[cyan][upscaler] Auto tile size: {tile_size} (pad {self.tile_pad}) on cpu[/cyan]")
+        self.tile_size = tile_size
+        self.out_size = out_size
+        self.input_multiple = INPUT_MULTIPLE.get(scale, 1)
+
+    def __call__(self, imgs: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """uint8 HWC frames -> uint8 HWC outputs."""
+        outs = self._tiled(imgs) if self.tile_size else self._whole(imgs)
+        return [self._resize(o) for o in outs]
+
+    def _whole(self, imgs: Sequence[np.ndarray]) -> List[np.ndarray]:
+        outputs: List[Optional[np.ndarray]] = [None] * len(imgs)
+        groups: dict[tuple[int, ...], list[int]] = {}
+        for idx, img in enumerate(imgs):
+            groups.setdefault(img.shape, []).append(idx)
+        s = self.scale
+        for (h, w, _c), idxs in groups.items():
+            aw, ah = aligned_size(w, h, self.input_multiple)
+            for k in range(0, len(idxs), self.batch_size):
+                chunk = idxs[k : k + self.batch_size]
+                out = self.runner(np.stack([_pad_to(_to_input(imgs[i])[0], ah, aw) for i in chunk]))
+                for i, o in zip(chunk, out):
+                    outputs[i] = _to_uint8(o[:, : h * s, : w * s])
+        return [o for o in outputs if o is not None]
+
+    def _tiled(self, imgs: Sequence[np.ndarray]) -> List[np.ndarray]:
+        assert self.tile_size is not None
+        s = self.scale
+        shapes = [img.shape[:2] for img in imgs]
+        inputs = [
+            _pad_to(_to_input(img)[0], *aligned_size(w, h, self.input_multiple)[::-1])
+            for img, (h, w) in zip(imgs, shapes)
+        ]
+        canvases = [np.empty((3, x.shape[1] * s, x.shape[2] * s), dtype=np.float32) for x in inputs]
+
+        groups: dict[tuple[int, int], list[tuple[int, Tile]]] = {}
+        for idx, x in enumerate(inputs):
+            for t in plan_tiles(x.shape[1], x.shape[2], self.tile_size, self.tile_pad, self.input_multiple):
+                groups.setdefault((t.wy1 - t.wy0, t.wx1 - t.wx0), []).append((idx, t))
+
+        for items in groups.values():
+            for k in range(0, len(items), self.batch_size):
+                chunk = items[k : k + self.batch_size]
+                out = self.runner(np.stack([inputs[idx][:, t.wy0 : t.wy1, t.wx0 : t.wx1] for idx, t in chunk]))
+                for (idx, t), out_t in zip(chunk, out):
+                    canvases[idx][:, t.y0 * s : t.y1 * s, t.x0 * s : t.x1 * s] = out_t[
+                        :,
+                        (t.y0 - t.wy0) * s : (t.y1 - t.wy0) * s,
+                        (t.x0 - t.wx0) * s : (t.x1 - t.wx0) * s,
+                    ]
+        return [_to_uint8(c[:, : h * s, : w * s]) for c, (h, w) in zip(canvases, shapes)]
+
+    def _resize(self, img: np.ndarray) -> np.ndarray:
+        if self.out_size is None or (img.shape[1], img.shape[0]) == self.out_size:
+            return img
+        from PIL import Image
+
+        return np.asarray(Image.fromarray(img).resize(self.out_size, Image.LANCZOS))
+
+
+def _read_frame(path: Path) -> np.ndarray:
+    from PIL import Image
+
+    with Image.open(path) as im:
+        return np.asarray(im.convert("RGB"))
+
+
+def _save_frame(img: np.ndarray, path: Path, save_options: Optional[dict] = None) -> None:
+    from PIL import Image
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.fromarray(img).save(path, **(save_options or {}))
+
+
+def run_realesrgan_onnx(
+        input_paths: List[Path],
+        output_paths: List[Path],
+        scale: int,
+        model_name: str,
+        batch_size: int = 4,
+        tile_size: Optional[int] = None,
+        tile_pad: int = 10,
+        threads: Optional[int] = None,
+        decode_workers: int = 2,
+        write_workers: int = 2,
+        metrics: Optional[JobMetrics] = None,
+        out_size: Optional[tuple[int, int]] = None,
+        save_options: Optional[dict] = None,
+        cancel: Optional[threading.Event] = None,
+) -> int:
+    """
+    Upscale `input_paths` into `output_paths` with the ONNX graph of `model_name`.
+    The next batch is decoded while the current one runs and outputs are written
+    by a small pool. `tile_size`/`tile_pad`/`out_size`/`save_options` as for the
+    torch backend; `cancel` stops before the next batch (RuntimeError).
+    Returns the number of frames processed.
+    """
+    scale = MODEL_SCALES.get(model_name, scale)
+    threads = threads or default_threads()
+    console.log(f"[cyan][upscaler] Using backend=onnx, model={model_name}, scale={scale}, threads={threads}[/cyan]")
+    session = get_onnx_session(model_name, threads)
+    upscaler = _OnnxFrameUpscaler(_BoundRunner(session, scale), scale, batch_size, tile_size, tile_pad, out_size)
+
+    total = len(input_paths)
+    if total == 0:
+        console.log("[yellow][upscaler] No frames to process.[/yellow]")
+        return 0
+
+    batch_size = max(1, batch_size)
+    starts = range(0, total, batch_size)
+    # Outputs waiting for a writer, bounded so a slow disk cannot pile up frames in memory.
+    max_pending = max(1, write_workers) * batch_size * 2
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, decode_workers), thread_name_prefix="upscaler-onnx-decode") as decode, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="upscaler-onnx-prefetch") as prefetch, \
+            ThreadPoolExecutor(max_workers=max(1, write_workers), thread_name_prefix="upscaler-onnx-write") as write:
+
+        def read(i: int) -> List[np.ndarray]:
+            return list(decode.map(_read_frame, input_paths[i : i + batch_size]))
+
+        pending: deque = deque()
+        ahead = prefetch.submit(read, starts[0])
+        for n, i in enumerate(starts):
+            if cancel is not None and cancel.is_set():
+                raise RuntimeError("ONNX pipeline cancelled")
+            imgs = ahead.result()
+            if n + 1 < len(starts):
+                ahead = prefetch.submit(read, starts[n + 1])
+            console.log(f"[blue][upscaler] Processing batch {n + 1} ({len(imgs)} frames) on cpu (onnx)[/blue]")
+            t0 = time.perf_counter()
+            outs = upscaler(imgs)
+            if metrics is not None:
+                metrics.event("infer_batch", backend="onnx", batch=n + 1, frames=len(imgs), seconds=time.perf_counter() - t0)
+            for out, path in zip(outs, output_paths[i : i + len(imgs)]):
+                pending.append(write.submit(_save_frame, out, path, save_options))
+            while len(pending) > max_pending:
+                pending.popleft().result()
+        for fut in pending:
+            fut.result()
+
+    console.log(f"[cyan][upscaler] onnx: {total} frames in {time.perf_counter() - t_start:.2f}s[/cyan]")
+    return total
@@ -1,36 +1,72 @@
 # upscaler/upscaler/realesrgan_torch.py
 # WARNING: torch backend is SLOW, for expriments/short clips only
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
 from pathlib import Path
-from typing import List
-import sys, types
+from typing import TYPE_CHECKING, BinaryIO, Callable, Hashable, Iterator, List, Optional, Sequence
+import os, queue, sys, threading, time, types
 
 import torch
-from torchvision.io import read_image
+from torchvision.io import ImageReadMode, read_image
 from torchvision.transforms.functional import normalize
 from torchvision.utils import save_image
 
-import torchvision.transforms.functional as F_tv
+from rich.console import Console
 
-shim_module = types.ModuleType("torchvision.transforms.functional_tensor")
-shim_module.rgb_to_grayscale = F_tv.rgb_to_grayscale # type: ignore[arg-type]
-sys.modules.setdefault("torchvision.transforms.functional_tensor", shim_module)
+from .batching import BATCH_SIZES, BatchController, aligned_size, plan_buckets
+from .config import INPUT_MULTIPLE, MODEL_SCALES, TORCH_MODEL_URLS
+from .metrics import JobMetrics
+from .model_cache import MODEL_CACHE
+from .tiling import Tile, auto_tile_size, host_available_memory, plan_tiles
+from .torch_cpu import CALIBRATION_FRAMES, CpuMode, apply_threads, parse_cpu_mode, prepare_cpu_model
 
-from basicsr.archs.rrdbnet_arch import RRDBNet
-from basicsr.utils.download_util import load_file_from_url
-from rich.console import Console
+if TYPE_CHECKING:
+    from basicsr.archs.rrdbnet_arch import RRDBNet
 
 console = Console()
 
-MODEL_URLS = {
-    "realesrgan-x4plus": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth",
-    "realesrgan-x2plus": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x2plus.pth",
-}
+MODEL_URLS = TORCH_MODEL_URLS
+
+# Largest batch the adaptive controller grows to on CUDA (UPSCALER_TORCH_MAX_BATCH).
+# On CPU larger batches barely change throughput, so the requested size is the ceiling.
+DEFAULT_MAX_BATCH = 16
+
+# Padding a smaller image into a larger batch costs compute; worth it on CUDA, where
+# batching pays, not on CPU (see batching.plan_buckets).
+CUDA_MAX_PAD = 0.15
+
+
+def _import_basicsr():
+    """
+    Import basicsr on the first model load rather than with this module.
+    basicsr still imports `torchvision.transforms.functional_tensor` (removed in
+    torchvision 0.17), so a shim for it is installed first.
+    """
+    if "torchvision.transforms.functional_tensor" not in sys.modules:
+        import torchvision.transforms.functional as F_tv
+
+        shim_module = types.ModuleType("torchvision.transforms.functional_tensor")
+        shim_module.rgb_to_grayscale = F_tv.rgb_to_grayscale # type: ignore[attr-defined]
+        sys.modules["torchvision.transforms.functional_tensor"] = shim_module
+
+    from basicsr.archs.rrdbnet_arch import RRDBNet
+    from basicsr.utils.download_util import load_file_from_url
+    return RRDBNet, load_file_from_url
 
 
 def load_realesrgan_model(model_name: str, scale: int, device: str) -> RRDBNet:
+    """
+    Build the network at the model's native scale (from config.MODEL_SCALES) and load
+    its weights. `scale` only matters for models missing from MODEL_SCALES: the weights
+    of a 4x model cannot be loaded into a 2x network.
+    """
     model_url = MODEL_URLS.get(model_name)
     if not model_url:
         raise ValueError(f"Unknown model: {model_name}")
+    scale = MODEL_SCALES.get(model_name, scale)
+    RRDBNet, load_file_from_url = _import_basicsr()
 
     model_path = load_file_from_url(
         url=model_url,
@@ -64,100 +100,754 @@ def load_realesrgan_model(model_name: str, scale: int, device: str) -> RRDBNet:
     return model
 
 
-def run_realesrgan_torch(
-    input_paths: List[Path],
-    output_paths: List[Path],
+def _model_nbytes(model: torch.nn.Module) -> int:
+    # state_dict rather than parameters(): quantized layers keep packed weights outside them.
+    def tensors(value):
+        if isinstance(value, torch.Tensor):
+            yield value
+        elif isinstance(value, (tuple, list)):
+            for v in value:
+                yield from tensors(v)
+
+    return sum(t.numel() * t.element_size() for v in model.state_dict().values() for t in tensors(v))
+
+
+def get_realesrgan_model(
+    model_name: str,
     scale: int,
+    device: str,
+    dtype: str = "float32",
+    cpu_mode: Optional[CpuMode] = None,
+    calibration: Optional[Callable[[], List[torch.Tensor]]] = None,
+) -> RRDBNet:
+    """
+    `load_realesrgan_model` through the process-wide MODEL_CACHE,
+    keyed by (model_name, native scale, device, dtype, CPU mode).
+    A CPU mode other than fp32 is prepared from the cached fp32 model (see torch_cpu);
+    `calibration` returns the frames int8 is calibrated on, only called on a miss.
+    """
+    scale = MODEL_SCALES.get(model_name, scale)
+    mode_key = cpu_mode.key if (cpu_mode is not None and device == "cpu") else "fp32"
+    def load() -> RRDBNet:
+        if mode_key != "fp32":
+            base = get_realesrgan_model(model_name, scale, device, dtype)
+            frames = calibration() if (calibration is not None and cpu_mode.int8) else None
+            return prepare_cpu_model(base, cpu_mode, frames)
+        model = load_realesrgan_model(model_name, scale, device)
+        if dtype == "float16":
+            model = model.half()
+        return model
+
+    return MODEL_CACHE.get((model_name, scale, device, dtype, mode_key), load, _model_nbytes)
+
+
+def evict_realesrgan_model(
+    model_name: Optional[str] = None,
+    scale: Optional[int] = None,
+    device: Optional[str] = None,
+    dtype: Optional[str] = None,
+    cpu_mode: Optional[str] = None,
+) -> int:
+    """
+    Evict cached models matching every given field (all models when none given).
+    `scale` is mapped to `model_name`'s native scale, as in `get_realesrgan_model`.
+    """
+    if model_name is not None and scale is not None:
+        scale = MODEL_SCALES.get(model_name, scale)
+    wanted = (model_name, scale, device, dtype, parse_cpu_mode(cpu_mode).key if cpu_mode else None)
+    n = 0
+    for key in MODEL_CACHE.keys():
+        if isinstance(key, tuple) and len(key) == len(wanted) and all(
+            w is None or w == k for w, k in zip(wanted, key)
+        ):
+            n += MODEL_CACHE.evict(key)
+    if n and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    return n
+
+
+def _to_input_tensor(img: torch.Tensor, device: str, fp16: bool) -> torch.Tensor:
+    """uint8 CHW image -> normalized 1xCxHxW tensor on device."""
+    img = img.to(device)
+    img = img.float() / 255.0
+    img = img.unsqueeze(0)
+
+    normalize(img, mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5], inplace=True)
+
+    if fp16 and device == "cuda":
+        img = img.half()
+    return img
+
+
+def _is_oom(e: BaseException) -> bool:
+    msg = str(e).lower()
+    # CUDA: "CUDA out of memory"; CPU: "DefaultCPUAllocator: can't allocate memory".
+    return "out of memory" in msg or "can't allocate memory" in msg
+
+
+def _pad_to(img: torch.Tensor, height: int, width: int) -> torch.Tensor:
+    """Pad a 1xCxHxW tensor at the bottom/right to height x width."""
+    h, w = int(img.shape[-2]), int(img.shape[-1])
+    if (h, w) == (height, width):
+        return img
+    # Reflection needs the padding to be smaller than the image.
+    mode = "reflect" if (height - h < h and width - w < w) else "replicate"
+    return torch.nn.functional.pad(img, (0, width - w, 0, height - h), mode=mode)
+
+
+def max_batch_size(device: str, batch_size: int) -> int:
+    """Ceiling for the adaptive batch size on `device`."""
+    if device != "cuda":
+        return max(1, batch_size)
+    try:
+        ceiling = int(os.environ.get("UPSCALER_TORCH_MAX_BATCH") or DEFAULT_MAX_BATCH)
+    except ValueError:
+        ceiling = DEFAULT_MAX_BATCH
+    return max(1, batch_size, ceiling)
+
+
+def _infer_batch(model: RRDBNet, tensor_list: List[torch.Tensor], device: str) -> torch.Tensor:
+    """
+    Run one batch through the model and return outputs in [0, 1].
+    Out-of-memory errors propagate: batch sizes are `_FrameUpscaler`'s business.
+    """
+    input_tensor = torch.cat(tensor_list, dim=0)
+
+    try:
+        with torch.inference_mode():
+            output_tensor = model(input_tensor)
+    except RuntimeError as e:
+        msg = str(e).lower()
+        # Common on very new NVIDIA GPUs with older Torch wheels.
+        if device == "cuda" and (
+            "no kernel image" in msg
+            or "not compatible" in msg
+            or "sm_120" in msg
+            or "sm120" in msg
+        ):
+            raise RuntimeError(
+                "PyTorch CUDA backend failed on this GPU (likely missing sm_120 support). "
+                "Use the Vulkan/NCNN backend (`--backend realesrgan`) or install a PyTorch build "
+                "that supports your GPU (CUDA 12.8+ / newer PyTorch). "
+                f"Original error: {e}"
+            ) from e
+        raise
+
+    # Tensors created under inference_mode can only be modified in place inside it.
+    with torch.inference_mode():
+        return output_tensor.mul_(0.5).add_(0.5).clamp_(0.0, 1.0)
+
+
+def _prepare_model(
     model_name: str,
-    device: str = "cuda",
-    fp16: bool = True,
-    batch_size: int = 4,
-) -> None:
+    scale: int,
+    device: str,
+    fp16: bool,
+    cpu_mode: Optional[str] = None,
+    calibration: Optional[Callable[[], List[torch.Tensor]]] = None,
+) -> tuple[RRDBNet, str]:
     if device == "cuda" and not torch.cuda.is_available():
         console.print("[yellow][upscaler] CUDA not found. Switching to CPU (this will be slow).[/yellow]")
         device = "cpu"
 
-    console.log(f"[cyan][upscaler] Using backend=torch, model={model_name}, scale={scale}, device={device}[/cyan]")
+    mode = None
+    if device == "cpu":
+        # CPU execution mode (see torch_cpu); thread counts are per process, so applied every time.
+        mode = parse_cpu_mode(cpu_mode)
+        apply_threads(mode)
+
+    console.log(
+        f"[cyan][upscaler] Using backend=torch, model={model_name}, scale={scale}, device={device}"
+        + (f", cpu mode={mode}" if mode is not None else "") + "[/cyan]"
+    )
 
     if device == "cuda":
         torch.backends.cudnn.benchmark = True
 
-    model = load_realesrgan_model(model_name, scale, device)
-    if fp16 and device == "cuda":
-        model = model.half()
-
-    total_frames = len(input_paths)
-    if total_frames == 0:
-        console.log("[yellow][upscaler] No frames to process.[/yellow]")
-        return
-
-    for i in range(0, total_frames, batch_size):
-        batch_in = input_paths[i : i + batch_size]
-        batch_out = output_paths[i : i + batch_size]
+    dtype = "float16" if (fp16 and device == "cuda") else "float32"
+    model = get_realesrgan_model(model_name, scale, device, dtype, mode, calibration)
+    return model, device
 
-        tensor_list = []
-        for p in batch_in:
-            img = read_image(str(p)).to(device)
-            img = img.float() / 255.0          
-            img = img.unsqueeze(0)               
 
-            normalize(img, mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5], inplace=True)
+def available_memory(device: str) -> int:
+    """Best-effort free memory in bytes for `device` (free VRAM on CUDA, MemAvailable on CPU)."""
+    if device.startswith("cuda"):
+        try:
+            free, _total = torch.cuda.mem_get_info(torch.device(device))
+            return int(free)
+        except Exception:
+            pass
+    return host_available_memory()
+
+
+class _FrameUpscaler:
+    """
+    Upscales lists of uint8 CHW frames, either whole-frame (batched across frames) or
+    tiled: every frame is cut into overlapping windows, windows of equal size from all
+    frames are batched together and the cores are stitched back on the CPU.
+    `tile_size=None` disables tiling, `0` picks a size from available memory.
+    A single frame that OOMs in whole-frame mode switches the upscaler to auto tiles.
+    `out_size` (width, height) resizes the model output to that size before it leaves
+    the device (see planner.UpscalePlan).
+
+    Batches run at the size `batcher` holds for (model_key, device, input shape),
+    starting at `batch_size` and never above `max_batch`; an OOM shrinks the size
+    and re-runs the rest of the batch (see batching.BatchController).
+    """
+
+    def __init__(
+        self,
+        model: RRDBNet,
+        device: str,
+        fp16: bool,
+        scale: int,
+        batch_size: int,
+        tile_size: Optional[int] = None,
+        tile_pad: int = 10,
+        out_size: Optional[tuple[int, int]] = None,
+        model_key: Hashable = None,
+        max_batch: Optional[int] = None,
+        batcher: BatchController = BATCH_SIZES,
+    ):
+        self.model = model
+        self.device = device
+        self.fp16 = fp16
+        self.scale = scale
+        self.batch_size = max(1, batch_size)
+        self.tile_pad = max(0, tile_pad)
+        self.tile_size = self._resolve_tile_size(tile_size)
+        self.out_size = out_size
+        self.model_key = model_key
+        self.max_batch = max(self.batch_size, max_batch or 0)
+        self.batcher = batcher
+        self.input_multiple = INPUT_MULTIPLE.get(scale, 1)
+        self.oom_retries = 0
+
+    def _resolve_tile_size(self, tile_size: Optional[int]) -> Optional[int]:
+        if tile_size is None or tile_size > 0:
+            return tile_size
+        bytes_per_elem = 2 if (self.fp16 and self.device == "cuda") else 4
+        size = auto_tile_size(available_memory(self.device), self.scale, bytes_per_elem, self.tile_pad)
+        console.log(f"[cyan][upscaler] Auto tile size: {size} (pad {self.tile_pad}) on {self.device}[/cyan]")
+        return size
+
+    def _key(self, kind: str, height: int, width: int) -> Hashable:
+        return (self.model_key, self.device, kind, height, width)
+
+    def batch_size_for(self, width: int, height: int) -> int:
+        """Frames of `width`x`height` worth decoding for the next call."""
+        if self.tile_size is not None:
+            return self.batch_size
+        w, h = aligned_size(width, height, self.input_multiple)
+        return self.batcher.size(self._key("frame", h, w), self.batch_size, self.max_batch)
+
+    def _batches(self, kind: str, tensors: List[torch.Tensor]) -> Iterator[tuple[int, torch.Tensor]]:
+        """
+        Run equal-shape 1xCxHxW `tensors` in batches of the controller's size,
+        yielding (offset, outputs). An OOM shrinks the size and retries; one that
+        hits a single tensor is re-raised.
+        """
+        key = self._key(kind, int(tensors[0].shape[-2]), int(tensors[0].shape[-1]))
+        k = 0
+        while k < len(tensors):
+            n = min(self.batcher.size(key, self.batch_size, self.max_batch), len(tensors) - k)
+            try:
+                out = _infer_batch(self.model, tensors[k : k + n], self.device)
+            except RuntimeError as e:
+                if not _is_oom(e):
+                    raise
+                if self.device == "cuda":
+                    torch.cuda.empty_cache()
+                smaller = self.batcher.oom(key, n)
+                if n == 1:
+                    raise
+                self.oom_retries += 1
+                console.print(
+                    f"[yellow][upscaler] OOM on a batch of {n} ({kind} {key[-1]}x{key[-2]}); "
+                    f"retrying with {smaller}.[/yellow]"
+                )
+                continue
+            self.batcher.success(key, n, self.max_batch)
+            yield k, out
+            k += n
+
+    def __call__(
+        self,
+        imgs: List[torch.Tensor],
+        out_sizes: Optional[Sequence[Optional[tuple[int, int]]]] = None,
+        pad_to: Optional[tuple[int, int]] = None,
+    ) -> List[torch.Tensor]:
+        """
+        uint8 CHW frames -> float CHW outputs in [0, 1] on the CPU.
+        Frames of different sizes are padded to `pad_to` (width, height; default:
+        the largest frame) for the model and cropped back; `out_sizes` overrides
+        `out_size` per frame.
+        """
+        sizes = list(out_sizes) if out_sizes is not None else [self.out_size] * len(imgs)
+        if self.tile_size is None:
+            try:
+                return self._whole(imgs, sizes, pad_to)
+            except RuntimeError as e:
+                if not _is_oom(e):
+                    raise
+                console.print("[yellow][upscaler] OOM on a single frame; switching to tiled inference.[/yellow]")
+                if self.device == "cuda":
+                    torch.cuda.empty_cache()
+                self.tile_size = self._resolve_tile_size(0)
+        return self._tiled(imgs, sizes)
+
+    def _whole(
+        self, imgs: List[torch.Tensor], out_sizes: List[Optional[tuple[int, int]]], pad_to: Optional[tuple[int, int]],
+    ) -> List[torch.Tensor]:
+        inputs = [_to_input_tensor(img, self.device, self.fp16) for img in imgs]
+        shapes = [(int(t.shape[-2]), int(t.shape[-1])) for t in inputs]
+        # Never smaller than a frame, so bad size hints cannot crop anything.
+        w, h = aligned_size(
+            max([w for _h, w in shapes] + ([pad_to[0]] if pad_to else [])),
+            max([h for h, _w in shapes] + ([pad_to[1]] if pad_to else [])),
+            self.input_multiple,
+        )
+        inputs = [_pad_to(t, h, w) for t in inputs]
+
+        results: List[torch.Tensor] = []
+        for k, out in self._batches("frame", inputs):
+            s = int(out.shape[-1]) // w
+            chunk = shapes[k : k + len(out)]
+            sizes = out_sizes[k : k + len(out)]
+            if all(shape == (h, w) for shape in chunk) and len(set(sizes)) == 1:
+                results.extend(self._resize(out, sizes[0]).float().cpu())
+                continue
+            for o, (fh, fw), size in zip(out, chunk, sizes):
+                o = o[:, : fh * s, : fw * s].unsqueeze(0)
+                results.append(self._resize(o, size)[0].float().cpu())
+        return results
+
+    def _resize(self, batch: torch.Tensor, out_size: Optional[tuple[int, int]]) -> torch.Tensor:
+        # Leftover resize from the model's native scale to the planned output size.
+        if out_size is None:
+            return batch
+        w, h = out_size
+        if (batch.shape[-1], batch.shape[-2]) == (w, h):
+            return batch
+        with torch.inference_mode():
+            out = torch.nn.functional.interpolate(
+                batch, size=(h, w), mode="bicubic", align_corners=False, antialias=True,
+            )
+            return out.clamp_(0.0, 1.0)
+
+    def _tiled(self, imgs: List[torch.Tensor], out_sizes: List[Optional[tuple[int, int]]]) -> List[torch.Tensor]:
+        assert self.tile_size is not None
+        inputs = [_to_input_tensor(img, self.device, self.fp16) for img in imgs]
+        shapes = [(int(t.shape[-2]), int(t.shape[-1])) for t in inputs]
+        inputs = [_pad_to(t, *aligned_size(w, h, self.input_multiple)[::-1]) for t, (h, w) in zip(inputs, shapes)]
+        outputs: List[Optional[torch.Tensor]] = [None] * len(imgs)
+
+        # Group windows by shape so tiles from different frames share a batch.
+        groups: dict[tuple[int, int], list[tuple[int, Tile]]] = {}
+        for idx, img in enumerate(inputs):
+            h, w = int(img.shape[-2]), int(img.shape[-1])
+            for t in plan_tiles(h, w, self.tile_size, self.tile_pad, self.input_multiple):
+                groups.setdefault((t.wy1 - t.wy0, t.wx1 - t.wx0), []).append((idx, t))
+
+        for items in groups.values():
+            windows = [inputs[idx][:, :, t.wy0 : t.wy1, t.wx0 : t.wx1] for idx, t in items]
+            for k, out in self._batches("tile", windows):
+                out = out.float().cpu()
+                chunk = items[k : k + len(out)]
+                s = out.shape[-1] // (chunk[0][1].wx1 - chunk[0][1].wx0)
+
+                for (idx, t), out_t in zip(chunk, out):
+                    canvas = outputs[idx]
+                    if canvas is None:
+                        h, w = int(inputs[idx].shape[-2]), int(inputs[idx].shape[-1])
+                        canvas = outputs[idx] = torch.empty((out_t.shape[0], h * s, w * s))
+                    canvas[:, t.y0 * s : t.y1 * s, t.x0 * s : t.x1 * s] = out_t[
+                        :,
+                        (t.y0 - t.wy0) * s : (t.y1 - t.wy0) * s,
+                        (t.x0 - t.wx0) * s : (t.x1 - t.wx0) * s,
+                    ]
+
+        # Stitched on the CPU, so the crop and the leftover resize happen there too.
+        results = []
+        for o, (h, w), t, size in zip(outputs, shapes, inputs, out_sizes):
+            if o is not None:
+                s = o.shape[-1] // int(t.shape[-1])
+                results.append(self._resize(o[:, : h * s, : w * s].unsqueeze(0), size)[0])
+        return results
+
+
+# Formats torchvision decodes natively; everything else (BMP, PPM, WebP) goes through PIL.
+_TV_DECODE_SUFFIXES = (".png", ".jpg", ".jpeg")
+
+
+def _read_frame(path: Path) -> torch.Tensor:
+    """uint8 RGB CHW tensor from an image file."""
+    if path.suffix.lower() in _TV_DECODE_SUFFIXES:
+        return read_image(str(path), mode=ImageReadMode.RGB)
+    from PIL import Image
+    import numpy as np
+
+    with Image.open(path) as im:
+        arr = np.asarray(im.convert("RGB"))
+    return torch.from_numpy(arr.copy()).permute(2, 0, 1)
+
+
+def _image_size(path: Path) -> tuple[int, int]:
+    """(width, height) from the file header."""
+    from PIL import Image
+
+    with Image.open(path) as im:
+        return im.size
+
+
+def _save_frame(img: torch.Tensor, path: Path, save_options: Optional[dict] = None) -> None:
+    """Write a float CHW tensor in [0, 1]; `save_options` go to PIL.Image.save."""
+    if not save_options:
+        save_image(img, str(path))
+        return
+    from PIL import Image
+
+    # Same quantization as torchvision's save_image.
+    arr = img.mul(255).add_(0.5).clamp_(0, 255).to(torch.uint8).permute(1, 2, 0).numpy()
+    Image.fromarray(arr).save(path, **save_options)
+
+
+@dataclass
+class PipelineStats:
+    """
+    Per-stage timings of `run_realesrgan_torch`.
+    `*_busy` is time spent doing work (summed over workers for pooled stages),
+    `infer_idle` is time the model waited for decoded batches and
+    `infer_blocked` is time it waited for room in the write queue.
+    `buckets` is the number of resolution buckets, `oom_retries` the batches
+    that ran out of memory and were re-run smaller.
+    """
+    frames: int = 0
+    batches: int = 0
+    buckets: int = 0
+    oom_retries: int = 0
+    wall: float = 0.0
+    decode_busy: float = 0.0
+    infer_busy: float = 0.0
+    infer_idle: float = 0.0
+    infer_blocked: float = 0.0
+    write_busy: float = 0.0
+
+    @property
+    def infer_utilization(self) -> float:
+        return self.infer_busy / self.wall if self.wall > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.frames} frames / {self.batches} batches / {self.buckets} sizes in {self.wall:.2f}s | "
+            f"infer busy {self.infer_busy:.2f}s ({self.infer_utilization:.0%}), "
+            f"idle {self.infer_idle:.2f}s, blocked on write {self.infer_blocked:.2f}s | "
+            f"decode busy {self.decode_busy:.2f}s, write busy {self.write_busy:.2f}s"
+            + (f" | {self.oom_retries} OOM retries" if self.oom_retries else "")
+        )
 
-            if fp16 and device == "cuda":
-                img = img.half()
 
-            tensor_list.append(img)
+_STOP = object()
 
-        if not tensor_list:
-            continue
 
-        input_tensor = torch.cat(tensor_list, dim=0) 
+def run_realesrgan_torch(
+    input_paths: List[Path],
+    output_paths: List[Path],
+    scale: int,
+    model_name: str,
+    device: str = "cuda",
+    fp16: bool = True,
+    batch_size: int = 4,
+    decode_workers: int = 2,
+    write_workers: int = 2,
+    prefetch_batches: int = 2,
+    write_queue_batches: int = 2,
+    tile_size: Optional[int] = None,
+    tile_pad: int = 10,
+    metrics: Optional[JobMetrics] = None,
+    out_size: Optional[tuple[int, int]] = None,
+    save_options: Optional[dict] = None,
+    cancel: Optional[threading.Event] = None,
+    cpu_mode: Optional[str] = None,
+    input_sizes: Optional[Sequence[tuple[int, int]]] = None,
+    out_sizes: Optional[Sequence[Optional[tuple[int, int]]]] = None,
+    max_batch: Optional[int] = None,
+) -> PipelineStats:
+    """
+    Upscale `input_paths` into `output_paths` with a bounded producer/consumer pipeline:
+    a decode pool keeps up to `prefetch_batches` decoded batches ready ahead of the model
+    and a writer pool drains up to `write_queue_batches` batches of outputs behind it.
+    `tile_size`/`tile_pad` enable tiled inference and `out_size` resizes every output
+    (see `_FrameUpscaler`); `out_sizes` gives one size per input instead.
+    Inputs may differ in size: they are grouped into resolution buckets (padded on
+    CUDA, see batching.plan_buckets) using `input_sizes` (width, height per input;
+    read from the file headers when not given). `batch_size` is where the adaptive
+    batch size starts, `max_batch` how far it may grow (default: `max_batch_size`).
+    `save_options` are passed to PIL when writing outputs (e.g. `{"compress_level": 0}`). `cpu_mode` selects the CPU execution mode
+    (see torch_cpu; int8 calibrates on the first input frames). Setting `cancel` stops the pipeline before the
+    next batch (RuntimeError); used when the caller runs this in an executor. With `metrics`, every batch is recorded as an `infer_batch` event along with
+    queue depths and bytes read/written.
+    """
+    stats = PipelineStats()
+    model, device = _prepare_model(
+        model_name, scale, device, fp16, cpu_mode,
+        calibration=lambda: [_read_frame(p) for p in input_paths[:CALIBRATION_FRAMES]],
+    )
+    max_batch = max_batch or max_batch_size(device, batch_size)
+    upscaler = _FrameUpscaler(
+        model, device, fp16, scale, batch_size, tile_size, tile_pad, out_size,
+        model_key=(model_name, fp16 and device == "cuda", cpu_mode or ""), max_batch=max_batch,
+    )
 
-        console.log(
-            f"[blue][upscaler] Processing batch {i//batch_size + 1} "
-            f"({len(batch_in)} frames) on {device}[/blue]"
-        )
+    total_frames = len(input_paths)
+    if total_frames == 0:
+        console.log("[yellow][upscaler] No frames to process.[/yellow]")
+        return stats
 
+    if input_sizes is None:
+        input_sizes = [_image_size(p) for p in input_paths]
+    buckets = plan_buckets(
+        input_sizes, max(1, batch_size), CUDA_MAX_PAD if device == "cuda" else 0.0, upscaler.input_multiple,
+    )
+    stats.buckets = len(buckets)
+    if out_sizes is None:
+        out_sizes = [out_size] * total_frames
+
+    decoded: queue.Queue = queue.Queue(maxsize=max(1, prefetch_batches))
+    to_write: queue.Queue = queue.Queue(maxsize=max(1, write_queue_batches) * max_batch)
+    stop = threading.Event()
+    errors: list[BaseException] = []
+    lock = threading.Lock()
+
+    def put(q: queue.Queue, item) -> bool:
+        # Bounded put that gives up once another stage failed.
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def decode_one(p: Path) -> torch.Tensor:
+        t0 = time.perf_counter()
+        img = _read_frame(p)
+        with lock:
+            stats.decode_busy += time.perf_counter() - t0
+        if metrics is not None:
+            metrics.add("bytes_read", p.stat().st_size)
+        return img
+
+    def producer(pool: ThreadPoolExecutor) -> None:
         try:
-            with torch.inference_mode():
-                output_tensor = model(input_tensor)
-        except RuntimeError as e:
-            msg = str(e).lower()
-            # Common on very new NVIDIA GPUs with older Torch wheels.
-            if device == "cuda" and (
-                "no kernel image" in msg
-                or "not compatible" in msg
-                or "sm_120" in msg
-                or "sm120" in msg
-            ):
-                raise RuntimeError(
-                    "PyTorch CUDA backend failed on this GPU (likely missing sm_120 support). "
-                    "Use the Vulkan/NCNN backend (`--backend realesrgan`) or install a PyTorch build "
-                    "that supports your GPU (CUDA 12.8+ / newer PyTorch). "
-                    f"Original error: {e}"
-                ) from e
-
-            # If we OOM on a multi-frame batch, retry frame-by-frame (same model, lower peak VRAM).
-            if device == "cuda" and "out of memory" in msg and len(tensor_list) > 1:
-                console.print(
-                    "[yellow][upscaler] CUDA OOM on batch; retrying frame-by-frame to reduce VRAM.[/yellow]"
+            for bucket in buckets:
+                k = 0
+                while k < len(bucket.indices):
+                    if stop.is_set():
+                        return
+                    # Sized when decoded, so growth/shrinking applies from the next batch on.
+                    idxs = bucket.indices[k : k + upscaler.batch_size_for(*bucket.size)]
+                    k += len(idxs)
+                    imgs = list(pool.map(decode_one, [input_paths[j] for j in idxs]))
+                    if not put(decoded, (bucket, idxs, imgs)):
+                        return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(decoded, _STOP)
+
+    def writer() -> None:
+        while True:
+            item = to_write.get()
+            if item is _STOP:
+                return
+            if stop.is_set():
+                continue
+            out_t, out_path = item
+            try:
+                t0 = time.perf_counter()
+                out_path.parent.mkdir(parents=True, exist_ok=True)
+                _save_frame(out_t, out_path, save_options)
+                with lock:
+                    stats.write_busy += time.perf_counter() - t0
+                if metrics is not None:
+                    metrics.add("bytes_written", out_path.stat().st_size)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+
+    t_start = time.perf_counter()
+    decode_pool = ThreadPoolExecutor(max_workers=max(1, decode_workers), thread_name_prefix="upscaler-decode")
+    writers = [
+        threading.Thread(target=writer, name=f"upscaler-write-{k}", daemon=True)
+        for k in range(max(1, write_workers))
+    ]
+    for w in writers:
+        w.start()
+    feeder = threading.Thread(target=producer, args=(decode_pool,), name="upscaler-prefetch", daemon=True)
+    feeder.start()
+
+    try:
+        while not stop.is_set():
+            if cancel is not None and cancel.is_set():
+                raise RuntimeError("Torch pipeline cancelled")
+            t0 = time.perf_counter()
+            try:
+                item = decoded.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            finally:
+                stats.infer_idle += time.perf_counter() - t0
+            if item is _STOP:
+                break
+
+            bucket, idxs, imgs = item
+            batch_out = [output_paths[j] for j in idxs]
+            if metrics is not None:
+                metrics.observe_queue("decoded", decoded.qsize())
+                metrics.observe_queue("write", to_write.qsize())
+            console.log(
+                f"[blue][upscaler] Processing batch {stats.batches + 1} "
+                f"({len(imgs)} frames, {bucket.size[0]}x{bucket.size[1]}) on {device}[/blue]"
+            )
+
+            t0 = time.perf_counter()
+            output_tensor = upscaler(imgs, [out_sizes[j] for j in idxs], bucket.size)
+            infer_s = time.perf_counter() - t0
+            stats.infer_busy += infer_s
+            stats.batches += 1
+            stats.frames += len(imgs)
+            stats.oom_retries = upscaler.oom_retries
+            if metrics is not None:
+                metrics.event(
+                    "infer_batch", backend="torch", batch=stats.batches, frames=len(imgs), seconds=infer_s,
+                    bucket=f"{bucket.size[0]}x{bucket.size[1]}",
                 )
+
+            t0 = time.perf_counter()
+            for out_t, out_path in zip(output_tensor, batch_out):
+                if not put(to_write, (out_t, out_path)):
+                    break
+            stats.infer_blocked += time.perf_counter() - t0
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        if stop.is_set():
+            # Unblock the producer if it is waiting on a full queue.
+            while feeder.is_alive():
                 try:
-                    torch.cuda.empty_cache()
-                except Exception:
+                    decoded.get(timeout=0.1)
+                except queue.Empty:
                     pass
+        feeder.join()
+        decode_pool.shutdown(wait=True)
+        for _ in writers:
+            to_write.put(_STOP)
+        for w in writers:
+            w.join()
+
+    if errors:
+        raise errors[0]
+
+    stats.wall = time.perf_counter() - t_start
+    console.log(f"[cyan][upscaler] torch pipeline: {stats.summary()}[/cyan]")
+    if metrics is not None:
+        metrics.event("torch_pipeline", **asdict(stats))
+    return stats
+
+
+def _read_exact(stream: BinaryIO, size: int) -> Optional[bytearray]:
+    """Read exactly `size` bytes from a pipe; None on clean EOF."""
+    buf = bytearray(size)
+    view = memoryview(buf)
+    got = 0
+    while got < size:
+        n = stream.readinto(view[got:])
+        if not n:
+            break
+        got += n
+    if got == 0:
+        return None
+    if got != size:
+        raise RuntimeError(f"Truncated rawvideo frame from decoder ({got}/{size} bytes)")
+    return buf
+
+
+def run_realesrgan_torch_stream(
+    frames_in: BinaryIO,
+    open_writer: Callable[[int, int], BinaryIO],
+    width: int,
+    height: int,
+    scale: int,
+    model_name: str,
+    device: str = "cuda",
+    fp16: bool = True,
+    batch_size: int = 4,
+    tile_size: Optional[int] = None,
+    tile_pad: int = 10,
+    metrics: Optional[JobMetrics] = None,
+    out_size: Optional[tuple[int, int]] = None,
+    cpu_mode: Optional[str] = None,
+) -> int:
+    """
+    Streaming variant of `run_realesrgan_torch`: reads rgb24 rawvideo frames of
+    `width`x`height` from `frames_in`, upscales them in batches and writes rgb24
+    frames to the stream returned by `open_writer(out_width, out_height)`.
+    The writer is opened lazily once the first output size is known.
+    Returns the number of frames processed. int8 (`cpu_mode`) calibrates on synthetic frames.
+    Batch sizes adapt as in `run_realesrgan_torch`.
+    """
+    model, device = _prepare_model(model_name, scale, device, fp16, cpu_mode)
+    upscaler = _FrameUpscaler(
+        model, device, fp16, scale, batch_size, tile_size, tile_pad, out_size,
+        model_key=(model_name, fp16 and device == "cuda", cpu_mode or ""),
+        max_batch=max_batch_size(device, batch_size),
+    )
 
-                outs = []
-                with torch.inference_mode():
-                    for single in tensor_list:
-                        outs.append(model(single))
-                output_tensor = torch.cat(outs, dim=0)
-            else:
-                raise
-
-        output_tensor = output_tensor.mul_(0.5).add_(0.5).clamp_(0.0, 1.0)
-
-        for j, out_t in enumerate(output_tensor):
-            out_path = batch_out[j]
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-            save_image(out_t, str(out_path))  
+    frame_bytes = width * height * 3
+    frames_out: Optional[BinaryIO] = None
+    processed = 0
+    t_start = time.perf_counter()
+    eof = False
+
+    while not eof:
+        imgs = []
+        n = upscaler.batch_size_for(width, height)
+        while len(imgs) < n:
+            buf = _read_exact(frames_in, frame_bytes)
+            if buf is None:
+                eof = True
+                break
+            imgs.append(torch.frombuffer(buf, dtype=torch.uint8).view(height, width, 3).permute(2, 0, 1))
+
+        if not imgs:
+            break
+
+        t0 = time.perf_counter()
+        output_tensor = torch.stack(upscaler(imgs))
+        if metrics is not None:
+            metrics.event(
+                "infer_batch", backend="torch", frames=len(imgs), seconds=time.perf_counter() - t0,
+            )
+            metrics.add("bytes_read", len(imgs) * frame_bytes)
+        output_u8 = output_tensor.mul_(255.0).round_().to(torch.uint8).permute(0, 2, 3, 1).contiguous()
+
+        if frames_out is None:
+            out_h, out_w = int(output_u8.shape[1]), int(output_u8.shape[2])
+            frames_out = open_writer(out_w, out_h)
+
+        for out_frame in output_u8:
+            frames_out.write(out_frame.numpy().tobytes())
+        if metrics is not None:
+            metrics.add("bytes_written", output_u8.numel())
+
+        if processed == 0:
+            console.log(
+                f"[blue][upscaler] First output frame after {time.perf_counter() - t_start:.2f}s[/blue]"
+            )
+        processed += len(imgs)
+
+    console.log(f"[cyan][upscaler] Streamed {processed} frames on {device}[/cyan]")
+    return processed
@@ -8,14 +8,22 @@ SwiftShader), which are CPU-backed and extremely slow. We surface that clearly.
 
 from __future__ import annotations
 
+import math
 import os
+import queue
+import shutil
 import subprocess
+import threading
+import time
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Sequence
 
 from rich.console import Console
 
+from .dedup import link_frames
 from .downloads import ensure_realesrgan_binary, ensure_model
+from .metrics import JobMetrics
 
 console = Console()
 
@@ -39,7 +47,15 @@ def _is_software_vulkan(output: str) -> bool:
     return ("llvmpipe" in s) or ("swiftshader" in s)
 
 
-def run_realesrgan(
+@dataclass
+class RealesrganCommand:
+    cmd: list[str]
+    gpu_id: Optional[int]
+    verbose: bool
+    force_gpu: bool
+
+
+def build_realesrgan_command(
         input_path: Path,
         output_path: Path,
         scale: int, 
@@ -48,7 +64,16 @@ def run_realesrgan(
         gpu_id: Optional[int] = None,
         verbose: bool = False,
         force_gpu: bool = False,
-) -> None: 
+        tile_size: Optional[int] = None,
+        threads: Optional[str] = None,
+        output_format: Optional[str] = None,
+) -> RealesrganCommand:
+    """
+    Resolve binary, model and environment overrides into the command line for one
+    run (shared by `run_realesrgan` and the asyncio API). Creates the output folder.
+    """
+    # NOTE: ensure_* may download (auto_download) and block; callers in async code
+    # run this in an executor.
     bin_path = ensure_realesrgan_binary(auto_download = auto_download)
     model_dir = ensure_model(model_name, auto_download = auto_download)
 
@@ -86,18 +111,45 @@ def run_realesrgan(
         # Real-ESRGAN: -g can be 0,1,2... or -1 (CPU). Default is "auto".
         cmd += ["-g", str(gpu_id)]
 
+    if tile_size is not None:
+        # -t: tile size (>=32), 0 = auto from VRAM.
+        cmd += ["-t", str(tile_size)]
+
+    if threads:
+        # -j: load:proc:save thread counts, e.g. "1:2:2".
+        cmd += ["-j", threads]
+
+    if output_format:
+        # -f: png/jpg/webp, used for the outputs in folder mode.
+        cmd += ["-f", output_format]
+
     if verbose:
         cmd += ["-v"]
 
+    return RealesrganCommand(cmd, gpu_id, verbose, force_gpu)
 
-    console.log(f"[blue] RealESRGAN: {' '.join(cmd)}[/blue]")
-    proc = subprocess.run(cmd, capture_output = True, text = True)
 
-    combined = (proc.stdout or "") + ("\n" if proc.stdout and proc.stderr else "") + (proc.stderr or "")
+def _selected_device_output(combined: str, gpu_id: Optional[int]) -> str:
+    # `-v` lists every device ("[<index> <name>] ..."); with -g set only the chosen one matters.
+    if gpu_id is None or gpu_id < 0:
+        return combined
+    prefix = f"[{gpu_id} "
+    lines = [line for line in combined.splitlines() if line.strip().startswith(prefix)]
+    return "\n".join(lines) if lines else combined
+
+
+def check_realesrgan_output(
+        returncode: int,
+        combined: str,
+        verbose: bool,
+        force_gpu: bool,
+        gpu_id: Optional[int] = None,
+) -> None:
+    """Surface software Vulkan devices and raise on a failed run."""
     if verbose and combined.strip():
         console.print(combined.rstrip())
 
-    if _is_software_vulkan(combined):
+    if _is_software_vulkan(_selected_device_output(combined, gpu_id)):
         msg = (
             "RealESRGAN Vulkan is using a software Vulkan device (llvmpipe/SwiftShader) "
             "which runs on CPU. This usually means you're running inside WSL/Docker/VM "
@@ -111,5 +163,142 @@ def run_realesrgan(
             raise RuntimeError(msg)
         console.print(f"[yellow]{msg}[/yellow]")
 
-    if proc.returncode != 0:
-        raise RuntimeError(f"RealESRGAN failed:\n{combined or '(no output)'}")
\ No newline at end of file
+    if returncode != 0:
+        raise RuntimeError(f"RealESRGAN failed:\n{combined or '(no output)'}")
+
+
+def run_realesrgan(
+        input_path: Path,
+        output_path: Path,
+        scale: int, 
+        model_name: str, 
+        auto_download: bool = False,
+        gpu_id: Optional[int] = None,
+        verbose: bool = False,
+        force_gpu: bool = False,
+        tile_size: Optional[int] = None,
+        threads: Optional[str] = None,
+        metrics: Optional[JobMetrics] = None,
+        output_format: Optional[str] = None,
+) -> None: 
+    rc = build_realesrgan_command(
+        input_path, output_path, scale, model_name,
+        auto_download=auto_download,
+        gpu_id=gpu_id,
+        verbose=verbose,
+        force_gpu=force_gpu,
+        tile_size=tile_size,
+        threads=threads,
+        output_format=output_format,
+    )
+    cmd, gpu_id = rc.cmd, rc.gpu_id
+    console.log(f"[blue] RealESRGAN: {' '.join(cmd)}[/blue]")
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, capture_output = True, text = True)
+    if metrics is not None:
+        n_frames = sum(1 for _ in input_path.iterdir()) if input_path.is_dir() else 1
+        metrics.event(
+            "ncnn_call",
+            backend="realesrgan",
+            input=str(input_path),
+            frames=n_frames,
+            gpu_id=gpu_id,
+            returncode=proc.returncode,
+            seconds=time.perf_counter() - t0,
+        )
+
+    combined = (proc.stdout or "") + ("\n" if proc.stdout and proc.stderr else "") + (proc.stderr or "")
+    check_realesrgan_output(proc.returncode, combined, rc.verbose, rc.force_gpu, gpu_id)
+
+
+def run_realesrgan_sharded(
+        frames: Sequence[Path],
+        output_dir: Path,
+        scale: int,
+        model_name: str,
+        devices: Sequence[Optional[int]],
+        work_dir: Path,
+        instances_per_device: int = 1,
+        chunk_size: Optional[int] = None,
+        auto_download: bool = False,
+        verbose: bool = False,
+        force_gpu: bool = False,
+        tile_size: Optional[int] = None,
+        threads: Optional[str] = None,
+        metrics: Optional[JobMetrics] = None,
+        output_format: Optional[str] = None,
+) -> None:
+    """
+    Run several binary instances at once over `frames`, writing into `output_dir`.
+
+    Frames are cut into chunks (hardlinked sub-directories of `work_dir`) that sit
+    in one shared queue; every instance is pinned to a device id from `devices`
+    (`-1` = CPU, None = binary default) and keeps pulling the next chunk until the queue is empty, so a
+    slow device simply takes fewer chunks. Raises once all workers finished if
+    any chunk failed, listing the failed chunks.
+    """
+    frames = list(frames)
+    if not frames:
+        return
+    slots = [d for d in devices for _ in range(max(1, instances_per_device))] or [None]
+    if chunk_size is None:
+        # Several chunks per instance so fast instances can take over the tail.
+        chunk_size = max(1, math.ceil(len(frames) / (len(slots) * 4)))
+
+    chunks: "queue.Queue[tuple[int, list[Path]]]" = queue.Queue()
+    for n, i in enumerate(range(0, len(frames), chunk_size)):
+        chunks.put((n, frames[i : i + chunk_size]))
+    total_chunks = chunks.qsize()
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    failures: list[tuple[int, Exception]] = []
+    lock = threading.Lock()
+
+    def worker(device: Optional[int]) -> None:
+        while True:
+            try:
+                n, chunk = chunks.get_nowait()
+            except queue.Empty:
+                return
+            if metrics is not None:
+                metrics.observe_queue("ncnn_chunks", chunks.qsize())
+            chunk_dir = work_dir / f"chunk_{n:05d}"
+            try:
+                link_frames(chunk, chunk_dir)
+                run_realesrgan(
+                    input_path=chunk_dir,
+                    output_path=output_dir,
+                    scale=scale,
+                    model_name=model_name,
+                    auto_download=auto_download,
+                    gpu_id=device,
+                    verbose=verbose,
+                    force_gpu=force_gpu,
+                    tile_size=tile_size,
+                    threads=threads,
+                    metrics=metrics,
+                    output_format=output_format,
+                )
+            except Exception as e:
+                with lock:
+                    failures.append((n, e))
+            finally:
+                shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    console.log(
+        f"[bold yellow] RealESRGAN sharded: {len(frames)} frames in {total_chunks} chunks "
+        f"over {len(slots)} instances (devices {list(devices)}) [/bold yellow]"
+    )
+    instances = [
+        threading.Thread(target=worker, args=(device,), name=f"realesrgan-shard-{k}", daemon=True)
+        for k, device in enumerate(slots)
+    ]
+    for t in instances:
+        t.start()
+    for t in instances:
+        t.join()
+
+    if failures:
+        failures.sort(key=lambda f: f[0])
+        detail = "\n".join(f"chunk {n}: {e}" for n, e in failures[:5])
+        raise RuntimeError(f"RealESRGAN sharded run failed for {len(failures)}/{total_chunks} chunks:\n{detail}")
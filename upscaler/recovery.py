@@ -0,0 +1,174 @@
+# upscaler/upscaler/recovery.py
+"""
+Bisecting recovery after a failed folder-mode run.
+
+When one folder-mode run fails (for example on a frame the binary cannot decode),
+running the rest one frame at a time costs a process start and a Vulkan init per
+frame. `recover_frames` instead splits the frames that are still missing into
+groups, runs each group in folder mode, and halves only the groups that fail,
+until every bad frame is isolated in a one-frame group. For a few bad frames in
+n that is O(log n) extra runs per bad frame.
+
+Groups run on a bounded pool of slots (one per device instance, like the sharded
+NCNN run), each in a hardlinked folder under `work_dir`. Frames that already
+have an output are skipped at every step, so work a failed run finished is kept.
+When the first groups and all their halves fail without writing anything the
+failure is not about particular frames (a broken binary or device), and
+recovery stops with that error instead of bisecting down to every single frame.
+One level of halves is always tried: a bad frame in every first group, on which
+the binary gives up before writing anything, looks the same one level up.
+"""
+from __future__ import annotations
+
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+from rich.console import Console
+
+from .dedup import link_frames
+from .metrics import JobMetrics
+
+console = Console()
+
+# Folder-mode pass over one group: (input_dir, device) -> None, raising on failure.
+GroupRun = Callable[[Path, Optional[int]], None]
+
+
+@dataclass
+class RecoveryReport:
+    frames: int = 0  # frames without an output when recovery started
+    recovered: int = 0
+    runs: int = 0
+    failed: list[Path] = field(default_factory=list)
+    errors: dict[str, str] = field(default_factory=dict)  # frame name -> error of its one-frame run
+
+
+def _split(items: list[Path], parts: int) -> list[list[Path]]:
+    parts = max(1, min(parts, len(items)))
+    size, extra = divmod(len(items), parts)
+    groups, start = [], 0
+    for k in range(parts):
+        end = start + size + (1 if k < extra else 0)
+        groups.append(items[start:end])
+        start = end
+    return groups
+
+
+def recover_frames(
+        frames: Sequence[Path],
+        output_dir: Path,
+        suffix: str,
+        run: GroupRun,
+        work_dir: Path,
+        devices: Sequence[Optional[int]] = (None,),
+        instances_per_device: int = 1,
+        metrics: Optional[JobMetrics] = None,
+) -> RecoveryReport:
+    """
+    Produce `output_dir/<stem><suffix>` for every frame of `frames` that lacks
+    one, by bisecting groups through `run` (see module docstring). Returns the
+    report; frames that failed on their own are in `report.failed`. Raises
+    RuntimeError when the failure does not depend on the frames.
+    """
+    slots = [d for d in devices for _ in range(max(1, instances_per_device))] or [None]
+    report = RecoveryReport()
+
+    def missing(group: list[Path]) -> list[Path]:
+        return [f for f in group if not (output_dir / (f.stem + suffix)).exists()]
+
+    pending = missing(list(frames))
+    report.frames = len(pending)
+    if not pending:
+        return report
+
+    # The whole set just failed: start from halves (or one group per slot).
+    # Groups are (depth, frames); depth 1 are the halves of the first groups.
+    groups: list[tuple[int, list[Path]]] = [(0, g) for g in _split(pending, max(2, len(slots)))]
+    halves = sum(1 for _, g in groups for h in _split(g, 2) if len(g) > 1 and len(h) > 1)
+    cond = threading.Condition()
+    active = 0
+    seq = 0
+    wasted = 0  # failed multi-frame halves that wrote nothing, while no run has made progress
+    progressed = False
+    fatal: Optional[Exception] = None
+
+    def worker(device: Optional[int]) -> None:
+        nonlocal active, seq, wasted, progressed, fatal
+        while True:
+            with cond:
+                while not groups and active and fatal is None:
+                    cond.wait()
+                if not groups or fatal is not None:
+                    cond.notify_all()
+                    return
+                # Breadth first: a whole level runs before any group is split further.
+                depth, group = groups.pop(0)
+                active += 1
+                seq += 1
+                n = seq
+            todo = missing(group)
+            error: Optional[Exception] = None
+            if todo:
+                group_dir = work_dir / f"recover_{n:05d}"
+                try:
+                    link_frames(todo, group_dir)
+                    run(group_dir, device)
+                except Exception as e:
+                    error = e
+                finally:
+                    shutil.rmtree(group_dir, ignore_errors=True)
+            left = missing(todo) if error is not None else []
+            with cond:
+                active -= 1
+                if todo:
+                    report.runs += 1
+                if error is None:
+                    progressed = True
+                elif len(left) < len(todo):
+                    progressed = True
+                if error is not None:
+                    if not progressed and depth == 1 and len(left) == len(todo) > 1:
+                        wasted += 1
+                        if wasted >= halves:
+                            fatal = error
+                    if len(left) == 1:
+                        report.failed.append(left[0])
+                        report.errors[left[0].name] = str(error).strip()
+                    elif left:
+                        groups.extend((depth + 1, g) for g in _split(left, 2))
+                cond.notify_all()
+
+    t0 = time.perf_counter()
+    console.log(
+        f"[yellow] recovery: {len(pending)} frames in {len(groups)} groups over {len(slots)} instances[/yellow]"
+    )
+    threads = [
+        threading.Thread(target=worker, args=(device,), name=f"upscaler-recovery-{k}", daemon=True)
+        for k, device in enumerate(slots)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if fatal is not None:
+        raise RuntimeError(
+            f"recovery stopped: every group and its halves failed without output, "
+            f"the error is not frame-specific:\n{fatal}"
+        )
+    report.failed.sort()
+    report.recovered = report.frames - len(missing(pending))
+    console.log(
+        f"[yellow] recovery: {report.recovered}/{report.frames} frames in {report.runs} runs "
+        f"({time.perf_counter() - t0:.1f}s), {len(report.failed)} failed[/yellow]"
+    )
+    if metrics is not None:
+        metrics.event(
+            "recovery", frames=report.frames, recovered=report.recovered, runs=report.runs,
+            failed=[f.name for f in report.failed],
+        )
+    return report
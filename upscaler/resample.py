@@ -0,0 +1,87 @@
+# upscaler/upscaler/resample.py
+"""
+In-process classic resampling (bicubic / lanczos) for images.
+
+Used by the "bicubic" and "lanczos" backends: no model and no ffmpeg process per
+image, just Pillow. Decoding, resizing and encoding release the GIL, so batches
+run in a thread pool and scale with cores.
+"""
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Sequence
+
+from rich.console import Console
+
+console = Console()
+
+RESAMPLE_METHODS = ("bicubic", "lanczos")
+
+# Output is an intermediate or a preview: favour encode speed over file size.
+_PNG_COMPRESS_LEVEL = 1
+
+
+def _pil_filter(method: str):
+    from PIL import Image
+
+    try:
+        return {"bicubic": Image.Resampling.BICUBIC, "lanczos": Image.Resampling.LANCZOS}[method]
+    except KeyError:
+        raise ValueError(f"Unknown resample method: {method!r} (expected one of {RESAMPLE_METHODS})") from None
+
+
+def resample_image(
+        input_path: Path,
+        output_path: Path,
+        scale: float,
+        method: str = "bicubic",
+        size: Optional[tuple[int, int]] = None,
+) -> Path:
+    """
+    Resize `input_path` by `scale` (or to `size`, (width, height), when given) with
+    `method` and write it to `output_path`, which may be `input_path` itself.
+    """
+    from PIL import Image
+
+    resample = _pil_filter(method)
+    with Image.open(input_path) as im:
+        im.load()
+        # Palette / 1-bit images would otherwise be resized with nearest neighbour.
+        if im.mode == "P":
+            im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+        elif im.mode not in ("RGB", "RGBA", "L", "LA", "I;16", "I", "F"):
+            im = im.convert("RGB")
+        size = size or (max(1, round(im.width * scale)), max(1, round(im.height * scale)))
+        out = im.resize(size, resample) if size != im.size else im.copy()
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    if output_path.suffix.lower() == ".png":
+        out.save(output_path, compress_level=_PNG_COMPRESS_LEVEL)
+    else:
+        if out.mode in ("RGBA", "LA") and output_path.suffix.lower() in (".jpg", ".jpeg"):
+            out = out.convert("RGB")
+        out.save(output_path)
+    return output_path
+
+
+def resample_images(
+        input_paths: Sequence[Path],
+        output_paths: Sequence[Path],
+        scale: float,
+        method: str = "bicubic",
+        workers: Optional[int] = None,
+        sizes: Optional[Sequence[Optional[tuple[int, int]]]] = None,
+) -> list[Path]:
+    """`resample_image` over many files in a thread pool (`sizes`: optional per-file output sizes)."""
+    if len(input_paths) != len(output_paths):
+        raise ValueError("input_paths and output_paths must have the same length")
+    sizes = list(sizes) if sizes is not None else [None] * len(input_paths)
+    _pil_filter(method)  # fail fast on a bad method name
+    workers = workers or min(32, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(
+            lambda job: resample_image(job[0], job[1], scale, method, job[2]),
+            zip(input_paths, output_paths, sizes),
+        ))
@@ -0,0 +1,186 @@
+# upscaler/upscaler/result_cache.py
+"""
+Opt-in, content-addressed on-disk cache of upscale results.
+
+Entries are keyed by the SHA-256 of the input file plus every option that
+affects the output (backend, model, scale, ...). Layout under the cache root:
+
+    objects/<k[:2]>/<key><suffix>   cached outputs
+    tmp/                            in-flight writes (same filesystem as objects/)
+
+Writes go to tmp/ and are published with os.replace, so readers in other
+processes never see partial files. Hits bump the entry's mtime, and eviction
+removes the least recently used entries until the cache fits `max_bytes`.
+
+Environment:
+- UPSCALER_CACHE_DIR: enables the cache for the API/CLI and sets its root
+- UPSCALER_CACHE_MAX_GB: size cap (default 10)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+from rich.console import Console
+
+console = Console()
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "upscaler" / "results"
+
+
+def _default_max_bytes() -> int:
+    try:
+        gb = float(os.environ.get("UPSCALER_CACHE_MAX_GB") or 10)
+    except ValueError:
+        gb = 10.0
+    return int(gb * 1024 ** 3)
+
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass
+class ResultCacheStats:
+    root: Path
+    entries: int
+    bytes: int
+    max_bytes: int
+    hits: int = 0
+    misses: int = 0
+
+
+class ResultCache:
+    def __init__(self, root: Path | str | None = None, max_bytes: Optional[int] = None):
+        self.root = Path(root) if root is not None else DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else _default_max_bytes()
+        self.objects = self.root / "objects"
+        self.tmp = self.root / "tmp"
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, input_path: Path, **options: Any) -> str:
+        payload = json.dumps(
+            {"v": CACHE_VERSION, "input": file_digest(input_path), "options": options},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _entry(self, key: str, suffix: str) -> Path:
+        return self.objects / key[:2] / f"{key}{suffix}"
+
+    def get(self, key: str, output_path: Path) -> bool:
+        """Copy the cached result for `key` to `output_path`. False on a miss."""
+        entry = self._entry(key, output_path.suffix)
+        try:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_out = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}.part")
+            try:
+                shutil.copyfile(entry, tmp_out)
+                os.replace(tmp_out, output_path)
+            finally:
+                tmp_out.unlink(missing_ok=True)
+            os.utime(entry)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def put(self, key: str, output_path: Path) -> Optional[Path]:
+        """Store `output_path` as the result for `key` (atomic publish), then enforce the size cap."""
+        if not output_path.is_file():
+            return None
+        entry = self._entry(key, output_path.suffix)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp.mkdir(parents=True, exist_ok=True)
+        tmp_entry = self.tmp / f"{key}.{uuid.uuid4().hex}"
+        try:
+            shutil.copyfile(output_path, tmp_entry)
+            os.replace(tmp_entry, entry)
+        finally:
+            tmp_entry.unlink(missing_ok=True)
+        self.prune()
+        return entry
+
+    def _scan(self) -> list[tuple[float, int, Path]]:
+        items = []
+        if not self.objects.exists():
+            return items
+        for p in self.objects.rglob("*"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            if p.is_file():
+                items.append((st.st_mtime, st.st_size, p))
+        return items
+
+    def stats(self) -> ResultCacheStats:
+        items = self._scan()
+        return ResultCacheStats(
+            root=self.root,
+            entries=len(items),
+            bytes=sum(size for _mtime, size, _p in items),
+            max_bytes=self.max_bytes,
+            hits=self.hits,
+            misses=self.misses,
+        )
+
+    def prune(self, max_bytes: Optional[int] = None, older_than: Optional[float] = None) -> tuple[int, int]:
+        """
+        Evict least recently used entries until the cache is within `max_bytes`
+        (default: the configured cap), plus anything unused for `older_than` seconds.
+        Stale in-flight files in tmp/ older than an hour are removed too.
+        Returns (entries removed, bytes freed).
+        """
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        items = sorted(self._scan())
+        total = sum(size for _mtime, size, _p in items)
+        now = time.time()
+        removed = freed = 0
+
+        for mtime, size, p in items:
+            expired = older_than is not None and now - mtime > older_than
+            if total <= limit and not expired:
+                continue
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            freed += size
+
+        if self.tmp.exists():
+            for p in self.tmp.iterdir():
+                try:
+                    if now - p.stat().st_mtime > 3600:
+                        p.unlink()
+                except FileNotFoundError:
+                    pass
+        return removed, freed
+
+
+def open_result_cache(cache_dir: Path | str | None) -> Optional[ResultCache]:
+    """
+    The cache to use for an API call: `cache_dir` when given, else UPSCALER_CACHE_DIR
+    when set, else None (caching disabled).
+    """
+    root = cache_dir if cache_dir is not None else os.environ.get("UPSCALER_CACHE_DIR")
+    if not root:
+        return None
+    return ResultCache(root)
@@ -0,0 +1,258 @@
+# upscaler/upscaler/rolling.py
+"""
+Rolling-window processing for long videos.
+
+The frame-folder path extracts every frame before the model runs and keeps every
+output until the final encode, so scratch use grows with the video's length. In
+rolling mode the video is cut into chunks of `chunk_frames` frames at the output
+frame rate: each chunk is extracted on its own (`-ss` + `-frames:v`), run through
+the model, encoded to a video-only segment and deleted. Extraction of chunk k+1
+and the encode of chunk k-1 overlap the model pass on chunk k, so at most two
+chunks' worth of frames are on disk (`ROLLING_WINDOWS`). The segments are joined
+with the concat demuxer without re-encoding and the audio is muxed in that step
+(see encode.py).
+
+Segments are written next to the output file, not to scratch: together they are
+about the size of the output, which is needed on that disk anyway.
+
+`start_frame`/`end_frame` limit a run to a range of output frames and `audio=False`
+leaves the audio out; segments.py uses both to cut one video into shards.
+"""
+from __future__ import annotations
+
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+from rich.console import Console
+
+from .encode import DEFAULT_ENCODER, EncoderSettings, concat_command, run_with_audio_fallback, segment_command
+from .frame_format import FrameFormat
+from .metrics import JobMetrics, dir_size, stage
+
+console = Console()
+
+# Chunks on disk at once: chunk k+1 being extracted, chunk k in and out, chunk k-1
+# being encoded (its inputs already deleted) -- two chunks of inputs plus outputs.
+ROLLING_WINDOWS = 2
+
+# How far before a chunk's first frame its extraction starts decoding: enough for
+# the fps filter to see the source frames around the chunk boundary.
+PREROLL_SECONDS = 1.0
+
+# Frames a chunk should have at least; shorter chunks spend more on process
+# startup and keyframes than they save.
+MIN_CHUNK_FRAMES = 8
+
+# Model pass over one chunk: (frames, frames_dir, out_dir) -> size the encode must
+# resize the outputs to (None when they are final).
+ChunkInfer = Callable[[list[Path], Path, Path], Optional[tuple[int, int]]]
+
+
+@dataclass
+class RollingStats:
+    chunks: int = 0
+    frames: int = 0
+    peak_scratch_bytes: int = 0
+
+
+def plan_chunk_frames(
+        frame_bytes: int,
+        chunk_frames: Optional[int] = None,
+        scratch_limit: Optional[int] = None,
+) -> int:
+    """
+    Frames per chunk: `chunk_frames`, capped so `ROLLING_WINDOWS` chunks of
+    `frame_bytes` (one input plus one output frame) fit `scratch_limit` bytes;
+    with only a limit, the largest chunk that fits. Raises RuntimeError when the
+    limit cannot hold `MIN_CHUNK_FRAMES`.
+    """
+    if scratch_limit is None:
+        if chunk_frames is None:
+            raise ValueError("rolling mode needs chunk_frames or scratch_limit")
+        return max(1, chunk_frames)
+
+    fit = int(scratch_limit // (ROLLING_WINDOWS * max(1, frame_bytes)))
+    if fit < MIN_CHUNK_FRAMES:
+        raise RuntimeError(
+            f"Scratch limit of {scratch_limit / 1024 ** 3:.2f} GiB holds {fit} frames per chunk "
+            f"(~{frame_bytes / 1024 ** 2:.1f} MiB per frame in and out, {ROLLING_WINDOWS} chunks); "
+            f"need at least {MIN_CHUNK_FRAMES}. Raise the limit or use a cheaper --frame-format."
+        )
+    if chunk_frames is not None and chunk_frames > fit:
+        console.log(f"[yellow] rolling: {chunk_frames} frames per chunk exceed the scratch limit, using {fit}[/yellow]")
+    return min(chunk_frames, fit) if chunk_frames is not None else fit
+
+
+def extract_chunk_command(
+        input_path: Path,
+        frames_dir: Path,
+        start: int,
+        count: int,
+        fps: float,
+        frame_format: FrameFormat,
+) -> list[str]:
+    """
+    Decode frames [start, start + count) at `fps` to `frames_dir/frame_%06d<suffix>`,
+    numbered from `start + 1` like a full extraction.
+    """
+    pattern = str(frames_dir / f"frame_%06d{frame_format.suffix}")
+    if not start:
+        return [
+            "ffmpeg", "-y", "-v", "error", "-i", str(input_path), "-vf", f"fps={fps}",
+            "-frames:v", str(count), *frame_format.ffmpeg_args, pattern,
+        ]
+    # Frame n of a full extraction is output slot n at `fps` on the input's clock
+    # (slots before the first video frame are filled with copies of it). Keeping that
+    # clock (-copyts -start_at_zero) makes the fps filter pick the same source frame
+    # per slot; the seek starts PREROLL_SECONDS early and select drops the slots
+    # before `start` (half a slot of slack; trim would round to the time base).
+    return [
+        "ffmpeg", "-y", "-v", "error",
+        "-ss", f"{max(0.0, start / fps - PREROLL_SECONDS):.6f}",
+        "-i", str(input_path),
+        "-copyts", "-start_at_zero",
+        "-vf", f"fps={fps},select=gte(t\\,{(start - 0.5) / fps:.6f})",
+        "-fps_mode", "passthrough",
+        "-frames:v", str(count),
+        *frame_format.ffmpeg_args,
+        "-start_number", str(start + 1),
+        pattern,
+    ]
+
+
+def run_rolling(
+        input_path: Path,
+        output_path: Path,
+        work_dir: Path,
+        fps: float,
+        chunk_frames: int,
+        fmt_in: FrameFormat,
+        out_suffix: str,
+        infer: ChunkInfer,
+        encoder: EncoderSettings | None = None,
+        metrics: Optional[JobMetrics] = None,
+        start_frame: int = 0,
+        end_frame: Optional[int] = None,
+        audio: bool = True,
+) -> RollingStats:
+    """
+    Upscale `input_path` into `output_path` chunk by chunk with frames under
+    `work_dir` (see module docstring). `infer` runs the model over one chunk and
+    writes `<stem><out_suffix>` frames. Only output frames [`start_frame`,
+    `end_frame`) are processed (`end_frame=None`: to the end of the video);
+    `audio=False` writes a video-only output.
+    """
+    encoder = encoder or DEFAULT_ENCODER
+    stats = RollingStats()
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Absolute: the concat demuxer resolves relative list entries against the list's folder.
+    seg_dir = Path(tempfile.mkdtemp(prefix=f".{output_path.stem}_segments_", dir=output_path.parent)).resolve()
+    segments: list[Path] = []
+
+    def chunk_count(start: int) -> int:
+        return chunk_frames if end_frame is None else min(chunk_frames, end_frame - start)
+
+    def extract(k: int, start: int) -> tuple[Path, list[Path]]:
+        chunk_dir = work_dir / f"chunk_{k:05d}"
+        frames_in = chunk_dir / "in"
+        frames_in.mkdir(parents=True)
+        with stage(metrics, "extract") as info:
+            proc = subprocess.run(
+                extract_chunk_command(input_path, frames_in, start, chunk_count(start), fps, fmt_in),
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                raise RuntimeError(f"ffmpeg extract of chunk {k} failed:\n{proc.stderr}")
+            frames = sorted(frames_in.glob(f"frame_*{fmt_in.suffix}"))
+            info.update(chunk=k, frames=len(frames), bytes_out=dir_size(frames_in))
+        return chunk_dir, frames
+
+    def encode(k: int, frames_out: Path, start: int, count: int, size: Optional[tuple[int, int]]) -> None:
+        with stage(metrics, "assemble") as info:
+            cmd = segment_command(frames_out, segments[k], fps, start + 1, count, size, out_suffix, encoder)
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            if proc.returncode != 0:
+                raise RuntimeError(f"ffmpeg segment {k} encode failed:\n{proc.stderr}")
+            info.update(chunk=k, bytes_out=segments[k].stat().st_size)
+        shutil.rmtree(frames_out.parent, ignore_errors=True)
+
+    t0 = time.perf_counter()
+    extract_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upscaler-rolling-extract")
+    encode_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upscaler-rolling-encode")
+    encodes: deque[Future] = deque()
+    try:
+        start = start_frame
+        if end_frame is not None and end_frame <= start:
+            raise ValueError(f"empty frame range [{start_frame}, {end_frame})")
+        next_chunk = extract_pool.submit(extract, 0, start)
+        while True:
+            chunk_dir, frames = next_chunk.result()
+            if not frames:
+                shutil.rmtree(chunk_dir, ignore_errors=True)
+                break
+            k = stats.chunks
+            last = len(frames) < chunk_count(start) or (end_frame is not None and start + len(frames) >= end_frame)
+            if not last:
+                next_chunk = extract_pool.submit(extract, k + 1, start + len(frames))
+            # Chunk k-2's outputs must be gone before chunk k's are written.
+            while len(encodes) > 1:
+                encodes.popleft().result()
+
+            console.log(
+                f"[cyan] rolling: chunk {k + 1}, frames {start + 1}-{start + len(frames)}[/cyan]"
+            )
+            frames_out = chunk_dir / "out"
+            frames_out.mkdir()
+            size = infer(frames, chunk_dir / "in", frames_out)
+            stats.peak_scratch_bytes = max(stats.peak_scratch_bytes, dir_size(work_dir))
+            # Only the outputs wait for the encode: inputs and whatever infer staged
+            # next to them (dedup links, shard and recovery folders) go now.
+            for entry in chunk_dir.iterdir():
+                if entry != frames_out:
+                    shutil.rmtree(entry, ignore_errors=True)
+
+            segments.append(seg_dir / f"seg_{k:05d}{output_path.suffix or '.mp4'}")
+            encodes.append(encode_pool.submit(encode, k, frames_out, start, len(frames), size))
+            stats.chunks += 1
+            stats.frames += len(frames)
+            start += len(frames)
+            if last:
+                break
+        while encodes:
+            encodes.popleft().result()
+
+        if not segments:
+            raise RuntimeError(f"ffmpeg extracted no frames from {input_path} (from frame {start_frame + 1})")
+        with stage(metrics, "assemble") as info:
+            list_file = seg_dir / "segments.txt"
+            list_file.write_text("".join(f"file '{p.resolve().as_posix()}'\n" for p in segments))
+            run_with_audio_fallback(
+                lambda audio_codec: concat_command(
+                    list_file, input_path, output_path, encoder,
+                    audio_codec if audio else "none", stats.frames / fps,
+                ),
+                encoder, "concat",
+            )
+            info.update(bytes_out=output_path.stat().st_size)
+    finally:
+        # Waits for in-flight work: nothing may still write into removed folders.
+        extract_pool.shutdown(wait=True, cancel_futures=True)
+        encode_pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(seg_dir, ignore_errors=True)
+
+    console.log(
+        f"[cyan] rolling: {stats.frames} frames in {stats.chunks} chunks of {chunk_frames} in "
+        f"{time.perf_counter() - t0:.1f}s, peak scratch {stats.peak_scratch_bytes / 1024 ** 2:.0f} MiB[/cyan]"
+    )
+    if metrics is not None:
+        metrics.frames = stats.frames
+        metrics.scratch_bytes = stats.peak_scratch_bytes
+        metrics.event("rolling", chunks=stats.chunks, frames=stats.frames, chunk_frames=chunk_frames)
+    return stats
@@ -0,0 +1,107 @@
+# upscaler/upscaler/scratch.py
+"""
+Scratch space for intermediate frames.
+
+The root is, in order: an explicit `scratch_dir`, UPSCALER_SCRATCH_DIR, /dev/shm
+when the job's estimated frame volume fits comfortably in free memory, else the
+system temp dir. The estimate is checked against the chosen root's free space
+before extraction starts, so a job fails up front instead of filling the disk
+halfway through.
+
+Environment:
+- UPSCALER_SCRATCH_DIR: scratch root (disables the /dev/shm preference)
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from rich.console import Console
+
+from .frame_format import FrameFormat
+
+console = Console()
+
+SHM_DIR = Path("/dev/shm")
+# Share of free RAM that frames in /dev/shm may take: the model, decoders and
+# the page cache need the rest.
+SHM_BUDGET_FRACTION = 0.5
+# Free space required on the scratch root relative to the estimate.
+HEADROOM = 1.2
+
+
+def estimate_frame_bytes(
+        width: int,
+        height: int,
+        frames: int,
+        scale: float,
+        fmt_in: FrameFormat,
+        fmt_out: FrameFormat,
+) -> int:
+    """Approximate bytes for `frames` extracted frames plus their upscaled outputs."""
+    pixels_in = width * height
+    pixels_out = pixels_in * scale * scale
+    return int(frames * (pixels_in * fmt_in.bytes_per_pixel + pixels_out * fmt_out.bytes_per_pixel))
+
+
+def _mem_available() -> int:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def free_bytes(path: Path) -> int:
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return 0
+
+
+def choose_scratch_root(estimated_bytes: int, scratch_dir: Path | str | None = None) -> Path:
+    """Pick the scratch root for a job that needs about `estimated_bytes`."""
+    explicit = scratch_dir if scratch_dir is not None else os.environ.get("UPSCALER_SCRATCH_DIR")
+    if explicit:
+        return Path(explicit)
+
+    if SHM_DIR.is_dir() and os.access(SHM_DIR, os.W_OK) and estimated_bytes > 0:
+        # tmpfs pages are RAM: the estimate must fit the mount and the memory actually free.
+        budget = min(free_bytes(SHM_DIR), _mem_available() or free_bytes(SHM_DIR)) * SHM_BUDGET_FRACTION
+        if estimated_bytes <= budget:
+            return SHM_DIR
+    return Path(tempfile.gettempdir())
+
+
+def make_scratch_dir(
+        estimated_bytes: int,
+        scratch_dir: Path | str | None = None,
+        prefix: str = "upscaler_",
+) -> Path:
+    """
+    Create a private temp directory under the chosen root. Raises RuntimeError when
+    the root lacks room for `estimated_bytes` (0 = unknown, not checked).
+    """
+    root = choose_scratch_root(estimated_bytes, scratch_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    free = free_bytes(root)
+    if estimated_bytes > 0 and free and estimated_bytes * HEADROOM > free:
+        raise RuntimeError(
+            f"Not enough scratch space in {root}: need ~{estimated_bytes / 1024 ** 3:.1f} GiB "
+            f"for frames, {free / 1024 ** 3:.1f} GiB free. Use --scratch-dir, a cheaper "
+            f"--frame-format or --stream."
+        )
+    console.log(f"[cyan] scratch: {root} (~{estimated_bytes / 1024 ** 2:.0f} MiB estimated)[/cyan]")
+    return Path(tempfile.mkdtemp(prefix=prefix, dir=root))
+
+
+def frame_count_hint(duration: Optional[float], fps: Optional[float]) -> int:
+    if not duration or not fps:
+        return 0
+    return int(duration * fps + 0.5)
@@ -0,0 +1,529 @@
+# upscaler/upscaler/segments.py
+"""
+Keyframe-aligned segment sharding with resume.
+
+`upscale_video` is one all-or-nothing call: a crash or a preempted node loses the
+whole job. Here a video is planned once into segments (a manifest in a shared
+work directory), each segment is upscaled on its own by any worker that can see
+that directory, and the finished segments are joined into the output with the
+concat demuxer (`-c:v copy`) while the original audio is muxed in.
+
+- `plan_segments` cuts at the source's keyframes, about `segment_seconds` apart,
+  so each segment's decode starts at a keyframe. A stretch without keyframes is
+  cut in between; extraction is frame-exact either way (see rolling).
+- `process_segment` upscales the output frames [start, end) of one segment with
+  `upscale_video(frame_range=...)` into `seg_<i>.mkv` and writes `seg_<i>.done`
+  once that file is in place; a segment that is done is skipped, so rerunning
+  resumes. A worker holds `seg_<i>.lock` while it runs and touches it every
+  `HEARTBEAT_SECONDS`; a lock untouched for `LOCK_STALE_SECONDS` belongs to a
+  worker that died and is taken over.
+- `merge_segments` needs every segment done.
+
+Upscale options that decide what comes out (scale, model, backend, frame format,
+encoder, ...) are fixed in the manifest; workers only choose how they run
+(devices, batch sizes, threads, scratch), so every segment matches.
+"""
+from __future__ import annotations
+
+import inspect
+import json
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Iterable, Optional
+
+from rich.console import Console
+
+from .encode import EncoderSettings, concat_command, run_with_audio_fallback
+from .ffmpeg_utils import probe_duration, probe_keyframes
+from .scratch import frame_count_hint
+
+console = Console()
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+DEFAULT_SEGMENT_SECONDS = 60.0
+
+# A running worker touches its lock this often; a lock older than the stale age
+# is taken over.
+HEARTBEAT_SECONDS = 30.0
+LOCK_STALE_SECONDS = 300.0
+
+# upscale_video arguments the manifest and the segment runner set themselves.
+_MANAGED_ARGS = {
+    "input_path", "output_path", "fps", "encoder", "frame_range", "stream",
+    "encode_jobs", "cache_dir", "metrics",
+}
+# Output-neutral arguments on top of api._NON_OUTPUT_ARGS that each worker picks.
+_WORKER_ARGS = {"torch_batch_size", "onnx_threads", "chunk_frames", "scratch_limit_gb"}
+
+
+@dataclass
+class Segment:
+    index: int
+    start_frame: int
+    end_frame: Optional[int]  # None: to the end of the video
+    start_time: float
+
+
+@dataclass
+class SegmentManifest:
+    input: str
+    input_bytes: int
+    input_mtime_ns: int
+    fps: float
+    segment_seconds: float
+    segments: list[Segment] = field(default_factory=list)
+    options: dict = field(default_factory=dict)
+    encoder: dict = field(default_factory=dict)
+    version: int = MANIFEST_VERSION
+    created: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SegmentManifest":
+        segments = [Segment(**s) for s in data.get("segments", [])]
+        return cls(**{**data, "segments": segments})
+
+    @property
+    def encoder_settings(self) -> EncoderSettings:
+        return EncoderSettings(**self.encoder)
+
+
+def manifest_path(work_dir: Path | str) -> Path:
+    return Path(work_dir) / MANIFEST_NAME
+
+
+def segment_path(work_dir: Path | str, index: int) -> Path:
+    return Path(work_dir) / f"seg_{index:05d}.mkv"
+
+
+def _marker_path(work_dir: Path | str, index: int) -> Path:
+    return Path(work_dir) / f"seg_{index:05d}.done"
+
+
+def _lock_path(work_dir: Path | str, index: int) -> Path:
+    return Path(work_dir) / f"seg_{index:05d}.lock"
+
+
+def _write_json(path: Path, data: dict) -> None:
+    tmp = path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=2, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def load_manifest(work_dir: Path | str) -> SegmentManifest:
+    path = manifest_path(work_dir)
+    try:
+        data = json.loads(path.read_text())
+    except FileNotFoundError:
+        raise RuntimeError(f"No segment plan in {work_dir} (run `upscaler segments plan` first)") from None
+    if data.get("version") != MANIFEST_VERSION:
+        raise RuntimeError(f"{path} is a version {data.get('version')} plan, expected {MANIFEST_VERSION}")
+    return SegmentManifest.from_dict(data)
+
+
+def _input_stamp(input_path: Path) -> tuple[int, int]:
+    st = input_path.stat()
+    return st.st_size, st.st_mtime_ns
+
+
+def _check_input(manifest: SegmentManifest) -> None:
+    try:
+        stamp = _input_stamp(Path(manifest.input))
+    except FileNotFoundError:
+        raise RuntimeError(f"Input {manifest.input} of the segment plan is not reachable from this host") from None
+    if stamp != (manifest.input_bytes, manifest.input_mtime_ns):
+        raise RuntimeError(f"Input {manifest.input} changed since the segment plan was made; plan again in a new work dir")
+
+
+def _option_sets() -> tuple[set[str], set[str]]:
+    """(plan options, worker options): upscale_video arguments that shape the output, and the rest."""
+    from .api import _NON_OUTPUT_ARGS, upscale_video
+
+    worker = (_NON_OUTPUT_ARGS | _WORKER_ARGS) - _MANAGED_ARGS
+    plan = set(inspect.signature(upscale_video).parameters) - worker - _MANAGED_ARGS
+    return plan, worker
+
+
+def _check_options(options: dict, allowed: set[str], what: str) -> None:
+    unknown = sorted(set(options) - allowed)
+    if unknown:
+        raise ValueError(f"{what} does not take {', '.join(unknown)} (allowed: {', '.join(sorted(allowed))})")
+
+
+def segment_starts(
+        keyframes: Iterable[float],
+        fps: float,
+        n_frames: int,
+        segment_frames: int,
+) -> list[int]:
+    """
+    First output frame of every segment: keyframes (seconds) at least
+    `segment_frames` apart, with extra cuts where keyframes are more than two
+    segments apart. No cut leaves a tail shorter than a quarter segment when the
+    length (`n_frames`, 0 when unknown) is known.
+    """
+    segment_frames = max(1, segment_frames)
+    points = {int(round(t * fps)) for t in keyframes}
+    if n_frames:
+        points.add(n_frames)
+    starts = [0]
+    for f in sorted(points):
+        while f - starts[-1] >= 2 * segment_frames:
+            starts.append(starts[-1] + segment_frames)
+        if f - starts[-1] >= segment_frames and (not n_frames or f < n_frames - segment_frames // 4):
+            starts.append(f)
+    return starts
+
+
+def plan_segments(
+        input_path: Path | str,
+        work_dir: Path | str,
+        segment_seconds: float = DEFAULT_SEGMENT_SECONDS,
+        fps: float | None = None,
+        encoder: EncoderSettings | None = None,
+        **options,
+) -> SegmentManifest:
+    """
+    Plan `input_path` into segments and write the manifest to `work_dir`.
+    `options` are `upscale_video` arguments fixed for every segment. An existing
+    plan for the same input and settings is returned as is (resume); one for
+    anything else raises RuntimeError.
+    """
+    from .api import RESAMPLE_BACKENDS, _probe_fps
+
+    if segment_seconds <= 0:
+        raise ValueError(f"segment_seconds must be positive, got {segment_seconds}")
+    _check_options(options, _option_sets()[0], "plan_segments")
+    if options.get("backend") in RESAMPLE_BACKENDS:
+        raise ValueError(f"{options['backend']} runs as a single ffmpeg pass; segments need a model backend")
+    try:
+        json.dumps(options)
+    except TypeError as e:
+        raise ValueError(f"plan_segments options must be JSON values: {e}") from None
+
+    input_path = Path(input_path).resolve()
+    work_dir = Path(work_dir)
+    size, mtime = _input_stamp(input_path)
+    out_fps = float(fps) if fps is not None else _probe_fps(input_path)
+    encoder_dict = asdict(encoder or EncoderSettings())
+
+    if manifest_path(work_dir).exists():
+        manifest = load_manifest(work_dir)
+        same = (
+            manifest.input == str(input_path)
+            and (manifest.input_bytes, manifest.input_mtime_ns) == (size, mtime)
+            and manifest.fps == out_fps
+            and manifest.segment_seconds == segment_seconds
+            and manifest.options == options
+            and manifest.encoder == encoder_dict
+        )
+        if not same:
+            raise RuntimeError(f"{work_dir} already holds a segment plan for other settings; use a new work dir")
+        console.log(f"[cyan] segments: reusing the plan in {work_dir}[/cyan]")
+        return manifest
+
+    n_frames = frame_count_hint(probe_duration(input_path), out_fps)
+    keyframes = probe_keyframes(input_path)
+    if not keyframes:
+        console.log("[yellow] segments: no keyframes found, cutting at fixed intervals[/yellow]")
+    starts = segment_starts(keyframes, out_fps, n_frames, int(round(segment_seconds * out_fps)))
+    ends: list[Optional[int]] = [*starts[1:], None]
+    manifest = SegmentManifest(
+        input=str(input_path),
+        input_bytes=size,
+        input_mtime_ns=mtime,
+        fps=out_fps,
+        segment_seconds=segment_seconds,
+        segments=[Segment(i, s, e, round(s / out_fps, 6)) for i, (s, e) in enumerate(zip(starts, ends))],
+        options=options,
+        encoder=encoder_dict,
+    )
+    work_dir.mkdir(parents=True, exist_ok=True)
+    _write_json(manifest_path(work_dir), asdict(manifest))
+    console.log(
+        f"[cyan] segments: {len(manifest.segments)} segments of ~{segment_seconds:g}s "
+        f"({n_frames} frames at {out_fps:g} fps, {len(keyframes)} keyframes) in {work_dir}[/cyan]"
+    )
+    return manifest
+
+
+def segment_status(work_dir: Path | str) -> dict[int, str]:
+    """"done", "running" (fresh lock), "stale" (lock of a dead worker) or "pending" per segment."""
+    manifest = load_manifest(work_dir)
+    status: dict[int, str] = {}
+    now = time.time()
+    for seg in manifest.segments:
+        if _marker_path(work_dir, seg.index).exists():
+            status[seg.index] = "done"
+            continue
+        try:
+            age = now - _lock_path(work_dir, seg.index).stat().st_mtime
+        except FileNotFoundError:
+            status[seg.index] = "pending"
+            continue
+        status[seg.index] = "stale" if age > LOCK_STALE_SECONDS else "running"
+    return status
+
+
+class _SegmentLock:
+    """
+    Exclusive claim on one segment, kept fresh by a heartbeat thread while held.
+
+    The lock file holds the owner's token. A stale lock is taken over by renaming
+    it away and checking that the renamed file is the one found stale (a fresh
+    lock renamed by mistake is put back); the new lock is then created with
+    O_EXCL. Owners re-read their token on every heartbeat and before committing,
+    so a worker whose lock was taken anyway drops its result.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(4).hex()}"
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def held(self) -> bool:
+        try:
+            return self.path.read_text() == self.token and not self.lost.is_set()
+        except FileNotFoundError:
+            return False
+
+    def _take_over(self) -> bool:
+        """Remove the lock at `path` if it is stale; False when it is not (or no longer)."""
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return True
+        age = time.time() - st.st_mtime
+        if age <= LOCK_STALE_SECONDS:
+            return False
+        moved = self.path.with_name(f".{self.path.name}.{self.token.replace(':', '-')}.stale")
+        try:
+            os.rename(self.path, moved)
+        except FileNotFoundError:
+            return True  # someone else removed it; race for the O_EXCL create
+        try:
+            mst = moved.stat()
+            if (mst.st_ino, mst.st_mtime_ns) != (st.st_ino, st.st_mtime_ns):
+                # Another worker replaced the stale lock in between: that one is live.
+                try:
+                    os.link(moved, self.path)
+                except FileExistsError:
+                    pass  # a third worker holds the path now; the displaced owner sees its token gone
+                return False
+        finally:
+            moved.unlink(missing_ok=True)
+        console.log(f"[yellow] segments: taking over {self.path.name} (untouched for {age:.0f}s)[/yellow]")
+        return True
+
+    def acquire(self) -> bool:
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._take_over():
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(self.token)
+            if not self.held():
+                return False
+            self._thread = threading.Thread(target=self._beat, name="upscaler-segment-lock", daemon=True)
+            self._thread.start()
+            return True
+        return False
+
+    def _beat(self) -> None:
+        while not self._stop.wait(HEARTBEAT_SECONDS):
+            if not self.held():
+                console.log(f"[yellow] segments: lost {self.path.name} to another worker[/yellow]")
+                self.lost.set()
+                return
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                self.lost.set()
+                return
+
+    def release(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.held():
+            self.path.unlink(missing_ok=True)
+
+
+def _count_frames(path: Path) -> int:
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+        "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", str(path),
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    try:
+        return int((proc.stdout or "").strip().splitlines()[0])
+    except (IndexError, ValueError):
+        raise RuntimeError(f"ffprobe could not count the frames of {path}:\n{proc.stderr}") from None
+
+
+def process_segment(work_dir: Path | str, index: int, **worker_options) -> Optional[Path]:
+    """
+    Upscale segment `index` of the plan in `work_dir`. `worker_options` are the
+    `upscale_video` arguments the plan leaves open (devices, batch sizes, scratch,
+    ...). Returns the segment file, or None when the segment is already done or
+    another worker holds it.
+    """
+    from .api import upscale_video
+
+    # Absolute, so the segment's own output path does not depend on the worker's cwd.
+    work_dir = Path(work_dir).resolve()
+    manifest = load_manifest(work_dir)
+    if not 0 <= index < len(manifest.segments):
+        raise ValueError(f"segment {index} out of range (plan has {len(manifest.segments)})")
+    _check_options(worker_options, _option_sets()[1], "process_segment")
+
+    seg = manifest.segments[index]
+    target = segment_path(work_dir, index)
+    if _marker_path(work_dir, index).exists():
+        console.log(f"[cyan] segments: {index} already done[/cyan]")
+        return None
+    _check_input(manifest)
+
+    lock = _SegmentLock(_lock_path(work_dir, index))
+    if not lock.acquire():
+        console.log(f"[cyan] segments: {index} is being processed by another worker[/cyan]")
+        return None
+    part = work_dir / f".{target.stem}.{lock.token.replace(':', '-')}{target.suffix}"
+    try:
+        end = "end" if seg.end_frame is None else seg.end_frame
+        console.log(f"[bold cyan] segments: {index + 1}/{len(manifest.segments)}[/] frames {seg.start_frame + 1}-{end}")
+        t0 = time.perf_counter()
+        upscale_video(
+            manifest.input,
+            part,
+            fps=manifest.fps,
+            encoder=manifest.encoder_settings,
+            frame_range=(seg.start_frame, seg.end_frame),
+            **manifest.options,
+            **worker_options,
+        )
+        frames = _count_frames(part)
+        if not lock.held():
+            console.log(f"[yellow] segments: {index} was taken over by another worker, dropping this result[/yellow]")
+            return None
+        os.replace(part, target)
+        _write_json(_marker_path(work_dir, index), {
+            "index": index,
+            "frames": frames,
+            "bytes": target.stat().st_size,
+            "host": socket.gethostname(),
+            "seconds": round(time.perf_counter() - t0, 3),
+            "finished": time.time(),
+        })
+    finally:
+        part.unlink(missing_ok=True)
+        lock.release()
+    return target
+
+
+def process_segments(
+        work_dir: Path | str,
+        indices: Iterable[int] | None = None,
+        shard: tuple[int, int] | None = None,
+        **worker_options,
+) -> list[int]:
+    """
+    Run `process_segment` over `indices` (default: every segment), or over the
+    segments `i` with `index % n == i` for `shard=(i, n)`. Segments that are done
+    or held by another worker are skipped; a failed segment does not stop the
+    rest, RuntimeError names the failures at the end. Returns the segments this
+    call finished.
+    """
+    manifest = load_manifest(work_dir)
+    todo = list(indices) if indices is not None else [s.index for s in manifest.segments]
+    if shard is not None:
+        i, n = shard
+        if not 0 <= i < n:
+            raise ValueError(f"shard {i}/{n}: need 0 <= i < n")
+        todo = [k for k in todo if k % n == i]
+
+    finished: list[int] = []
+    failed: dict[int, str] = {}
+    for index in todo:
+        try:
+            if process_segment(work_dir, index, **worker_options) is not None:
+                finished.append(index)
+        except (RuntimeError, OSError) as e:
+            console.print(f"[red] segments: {index} failed: {e}[/red]")
+            failed[index] = str(e)
+    if failed:
+        raise RuntimeError(f"{len(failed)} segments failed: {', '.join(map(str, sorted(failed)))}")
+    return finished
+
+
+def merge_segments(work_dir: Path | str, output_path: Path | str) -> Path:
+    """
+    Join the finished segments of `work_dir` into `output_path` without
+    re-encoding and mux the input's audio. Raises RuntimeError while a segment
+    is not done.
+    """
+    work_dir = Path(work_dir)
+    output_path = Path(output_path)
+    manifest = load_manifest(work_dir)
+    missing = [s.index for s in manifest.segments if not _marker_path(work_dir, s.index).exists()]
+    if missing:
+        raise RuntimeError(
+            f"{len(missing)} of {len(manifest.segments)} segments not done yet: "
+            f"{', '.join(map(str, missing[:20]))}{' ...' if len(missing) > 20 else ''}"
+        )
+
+    frames = sum(json.loads(_marker_path(work_dir, s.index).read_text())["frames"] for s in manifest.segments)
+    list_file = work_dir / f".merge.{socket.gethostname()}.{os.getpid()}.txt"
+    list_file.write_text("".join(
+        f"file '{segment_path(work_dir, s.index).resolve().as_posix()}'\n" for s in manifest.segments
+    ))
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    part = output_path.with_name(f".{output_path.stem}.merge{output_path.suffix}")
+    encoder = manifest.encoder_settings
+    try:
+        run_with_audio_fallback(
+            lambda audio: concat_command(list_file, Path(manifest.input), part, encoder, audio, frames / manifest.fps),
+            encoder, "segment merge",
+        )
+        os.replace(part, output_path)
+    finally:
+        list_file.unlink(missing_ok=True)
+        part.unlink(missing_ok=True)
+    console.log(f"[green] segments: merged {len(manifest.segments)} segments ({frames} frames) into {output_path}[/green]")
+    return output_path
+
+
+def upscale_video_segmented(
+        input_path: Path | str,
+        output_path: Path | str,
+        work_dir: Path | str,
+        segment_seconds: float = DEFAULT_SEGMENT_SECONDS,
+        fps: float | None = None,
+        encoder: EncoderSettings | None = None,
+        keep: bool = False,
+        worker_options: dict | None = None,
+        **options,
+) -> Path:
+    """
+    Plan, process and merge in one call. Rerunning after a crash with the same
+    arguments reuses the plan and skips the segments already done; the work dir
+    is removed after the merge unless `keep`.
+    """
+    work_dir = Path(work_dir).resolve()
+    plan_segments(input_path, work_dir, segment_seconds, fps, encoder, **options)
+    process_segments(work_dir, **(worker_options or {}))
+    merge_segments(work_dir, output_path)
+    if not keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return Path(output_path)
@@ -0,0 +1,415 @@
+# upscaler/upscaler/server.py
+"""
+Long-running worker daemon (`upscaler serve`).
+
+For many short jobs, starting Python, importing the backends and loading models
+dominates the runtime. The daemon pays that once: torch models stay in
+MODEL_CACHE, the NCNN binary/models are resolved and the Vulkan device is probed
+at startup, and jobs run from a priority queue on per-device worker slots.
+
+Protocol: JSON over HTTP/1.1, on a Unix socket (default) or TCP.
+
+    POST   /jobs        {"op": "image"|"images"|"video", "args": {...}, "priority": 0}
+    GET    /jobs        all known jobs
+    GET    /jobs/<id>   one job: status queued/running/done/failed/cancelled, result, error
+    DELETE /jobs/<id>   cancel a queued job
+    GET    /health      devices, slots, queue length, warm models, Vulkan info
+
+`args` are the keyword arguments of `upscale_image` / `upscale_images` /
+`upscale_video`. Lower priority values run first; equal priorities run in
+submission order. A worker slot pinned to a device passes it as `gpu_id`
+(NCNN) unless the job sets one; torch jobs use the default CUDA device.
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence
+
+from rich.console import Console
+
+from .api import upscale_image, upscale_images, upscale_video
+from .config import default_socket_path
+from .encode import EncoderSettings
+from .metrics import JobMetrics
+
+console = Console()
+
+OPS: dict[str, Callable[..., Any]] = {
+    "image": upscale_image,
+    "images": upscale_images,
+    "video": upscale_video,
+}
+# Arguments that name files, converted from JSON strings.
+_PATH_ARGS = ("input_path", "output_path", "output_dir", "cache_dir", "scratch_dir")
+# Finished jobs kept for status queries.
+HISTORY = 1000
+
+
+@dataclass
+class Job:
+    id: str
+    op: str
+    args: dict
+    priority: int = 0
+    status: str = "queued"
+    device: Optional[int] = None
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    error_type: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "op": self.op,
+            "args": self.args,
+            "priority": self.priority,
+            "status": self.status,
+            "device": self.device,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "result": self.result,
+            "error": self.error,
+            "error_type": self.error_type,
+        }
+
+
+def _call_args(op: str, args: dict) -> dict:
+    kwargs = dict(args)
+    for name in _PATH_ARGS:
+        if kwargs.get(name) is not None:
+            kwargs[name] = Path(kwargs[name])
+    if isinstance(kwargs.get("encoder"), dict):
+        kwargs["encoder"] = EncoderSettings(**kwargs["encoder"])
+    if op == "images" and "inputs" in kwargs:
+        kwargs["inputs"] = [Path(p) for p in kwargs["inputs"]]
+    return kwargs
+
+
+class JobQueue:
+    """Priority queue of jobs served by `slots_per_device` worker threads per device."""
+
+    def __init__(self, devices: Sequence[Optional[int]] = (None,), slots_per_device: int = 1):
+        self.devices = list(devices) or [None]
+        self.slots_per_device = max(1, slots_per_device)
+        self._queue: "queue.PriorityQueue[tuple[int, int, str]]" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._workers: list[threading.Thread] = []
+        self._stopping = threading.Event()
+
+    def start(self) -> None:
+        for device in self.devices:
+            for k in range(self.slots_per_device):
+                t = threading.Thread(
+                    target=self._worker, args=(device,), name=f"upscaler-worker-{device}-{k}", daemon=True,
+                )
+                t.start()
+                self._workers.append(t)
+
+    def stop(self) -> None:
+        self._stopping.set()
+        for _ in self._workers:
+            # Sentinels sort after every real job.
+            self._queue.put((1 << 62, next(self._seq), ""))
+
+    def submit(self, op: str, args: dict, priority: int = 0) -> Job:
+        if op not in OPS:
+            raise ValueError(f"Unknown op: {op!r} (expected one of {', '.join(OPS)})")
+        if not isinstance(args, dict):
+            raise ValueError("args must be a JSON object")
+        job = Job(uuid.uuid4().hex[:12], op, args, int(priority))
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        self._queue.put((job.priority, next(self._seq), job.id))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> list[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Job:
+        """Cancel a queued job; running jobs are not interrupted (ValueError)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise KeyError(job_id)
+            if job.status != "queued":
+                raise ValueError(f"Job {job_id} is {job.status}, only queued jobs can be cancelled")
+            job.status = "cancelled"
+            job.finished = time.time()
+            return job
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.status == "queued")
+
+    def _trim(self) -> None:
+        done = [j for j in self._jobs.values() if j.finished is not None]
+        for job in sorted(done, key=lambda j: j.finished)[: max(0, len(done) - HISTORY)]:
+            del self._jobs[job.id]
+
+    def _worker(self, device: Optional[int]) -> None:
+        while not self._stopping.is_set():
+            _priority, _seq, job_id = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.status != "queued":
+                    continue
+                job.status = "running"
+                job.device = device
+                job.started = time.time()
+            try:
+                self._run(job, device)
+            except Exception as e:
+                # Whatever went wrong, the job ends as failed and the slot keeps serving.
+                console.log(f"[red] job {job.id} failed: {e}[/red]")
+                self._finish(job, None, "failed", str(e), type(e).__name__)
+
+    def _run(self, job: Job, device: Optional[int]) -> None:
+        metrics = JobMetrics.from_env() or JobMetrics()
+        try:
+            # Malformed arguments (bad paths, unknown encoder keys) fail the job like any other error.
+            kwargs = _call_args(job.op, job.args)
+            if device is not None:
+                kwargs.setdefault("gpu_id", device)
+            if job.op != "images":
+                kwargs["metrics"] = metrics
+            console.log(f"[cyan] job {job.id}: {job.op} on device {device} (priority {job.priority})[/cyan]")
+            output = OPS[job.op](**kwargs)
+            result: dict = {"output": str(output) if not isinstance(output, list) else [str(p) for p in output]}
+            if job.op != "images":
+                result.update(frames=metrics.frames, seconds=metrics.wall_seconds, stages=metrics.stages)
+            status, error, error_type = "done", None, None
+        except Exception as e:
+            result, status, error, error_type = None, "failed", str(e), type(e).__name__
+            console.log(f"[red] job {job.id} failed: {e}[/red]")
+        self._finish(job, result, status, error, error_type)
+
+    def _finish(
+            self,
+            job: Job,
+            result: Optional[dict],
+            status: str,
+            error: Optional[str],
+            error_type: Optional[str],
+    ) -> None:
+        with self._lock:
+            job.result, job.status, job.error, job.error_type = result, status, error, error_type
+            job.finished = time.time()
+
+
+@dataclass
+class WarmState:
+    binary: Optional[str] = None
+    vulkan_devices: list[str] = field(default_factory=list)
+    software_vulkan: bool = False
+    torch_models: list[str] = field(default_factory=list)
+
+
+def _probe_vulkan(state: WarmState) -> None:
+    """
+    Device preflight, rerun rather than read from the cache: warms the driver and
+    refreshes the cached report the jobs then use (see preflight).
+    """
+    from .preflight import preflight
+
+    report = preflight(refresh=True)
+    state.vulkan_devices = [f"{d.index}: {d.name}" for d in report.devices]
+    state.software_vulkan = report.software_only
+
+
+def warm_up(preload: Sequence[str] = (), probe_vulkan: bool = True) -> WarmState:
+    """Resolve the NCNN binary, probe Vulkan and load `preload` torch models into MODEL_CACHE."""
+    from .config import MODEL_SCALES
+    from .downloads import ensure_realesrgan_binary
+
+    state = WarmState()
+    bin_path = ensure_realesrgan_binary()
+    if bin_path.exists():
+        state.binary = str(bin_path)
+        if probe_vulkan:
+            try:
+                _probe_vulkan(state)
+            except Exception as e:
+                console.print(f"[yellow]Vulkan warm-up skipped: {e}[/yellow]")
+
+    if preload:
+        try:
+            from .realesrgan_torch import _prepare_model
+        except Exception as e:
+            console.print(f"[yellow]torch unavailable, not preloading models ({e})[/yellow]")
+            return state
+        for name in preload:
+            _model, device = _prepare_model(name, MODEL_SCALES.get(name, 4), "cuda", fp16=True)
+            state.torch_models.append(f"{name}@{device}")
+    return state
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "upscaler"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def jobs(self) -> JobQueue:
+        return self.server.jobs  # type: ignore[attr-defined]
+
+    def address_string(self) -> str:
+        # Unix socket peers have no address.
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose:  # type: ignore[attr-defined]
+            console.log(f"[dim]{self.address_string()} {format % args}[/dim]")
+
+    def _send(self, code: int, data: Any) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code: int, message: str) -> None:
+        self._send(code, {"error": message})
+
+    def _job_id(self) -> Optional[str]:
+        parts = self.path.strip("/").split("/")
+        return parts[1] if len(parts) == 2 and parts[0] == "jobs" else None
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            warm: WarmState = self.server.warm  # type: ignore[attr-defined]
+            self._send(200, {
+                "pid": os.getpid(),
+                "devices": self.jobs.devices,
+                "slots_per_device": self.jobs.slots_per_device,
+                "queued": self.jobs.pending(),
+                "binary": warm.binary,
+                "vulkan_devices": warm.vulkan_devices,
+                "software_vulkan": warm.software_vulkan,
+                "torch_models": warm.torch_models,
+            })
+        elif self.path.rstrip("/") == "/jobs":
+            self._send(200, [j.to_dict() for j in self.jobs.jobs()])
+        elif (job_id := self._job_id()) is not None:
+            job = self.jobs.get(job_id)
+            if job is None:
+                self._error(404, f"No such job: {job_id}")
+            else:
+                self._send(200, job.to_dict())
+        else:
+            self._error(404, f"Not found: {self.path}")
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/jobs":
+            self._error(404, f"Not found: {self.path}")
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            job = self.jobs.submit(payload.get("op"), payload.get("args") or {}, payload.get("priority", 0))
+        except (ValueError, TypeError, AttributeError) as e:
+            self._error(400, str(e))
+            return
+        self._send(202, job.to_dict())
+
+    def do_DELETE(self) -> None:
+        job_id = self._job_id()
+        if job_id is None:
+            self._error(404, f"Not found: {self.path}")
+            return
+        try:
+            self._send(200, self.jobs.cancel(job_id).to_dict())
+        except KeyError:
+            self._error(404, f"No such job: {job_id}")
+        except ValueError as e:
+            self._error(409, str(e))
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _claim_socket(path: Path) -> None:
+    # A leftover socket from a crashed daemon is removed; a live one is an error.
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(path))
+    except OSError:
+        path.unlink()
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"An upscaler daemon is already listening on {path}")
+
+
+def serve(
+        socket_path: Path | str | None = None,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        devices: Sequence[Optional[int]] = (None,),
+        slots_per_device: int = 1,
+        preload: Sequence[str] = (),
+        probe_vulkan: bool = True,
+        verbose: bool = False,
+) -> None:
+    """Run the daemon until interrupted. TCP when `port` is given, else a Unix socket."""
+    warm = warm_up(preload, probe_vulkan=probe_vulkan)
+    jobs = JobQueue(devices, slots_per_device)
+
+    sock_file: Optional[Path] = None
+    if port is not None:
+        httpd: socketserver.BaseServer = ThreadingHTTPServer((host or "127.0.0.1", port), _Handler)
+        address = f"http://{host or '127.0.0.1'}:{port}"
+    else:
+        sock_file = Path(socket_path) if socket_path else default_socket_path()
+        _claim_socket(sock_file)
+        httpd = _UnixHTTPServer(str(sock_file), _Handler)
+        os.chmod(sock_file, 0o600)
+        address = f"unix:{sock_file}"
+
+    httpd.jobs = jobs  # type: ignore[attr-defined]
+    httpd.warm = warm  # type: ignore[attr-defined]
+    httpd.verbose = verbose  # type: ignore[attr-defined]
+    if threading.current_thread() is threading.main_thread():
+        # `kill` (SIGTERM) stops the daemon as cleanly as Ctrl-C; shutdown() must not run on the serving thread.
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=httpd.shutdown, daemon=True).start())
+    jobs.start()
+    console.log(
+        f"[bold cyan] upscaler daemon[/] listening on [yellow]{address}[/] "
+        f"({len(jobs.devices)} devices x {jobs.slots_per_device} slots)"
+    )
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        jobs.stop()
+        httpd.server_close()
+        if sock_file is not None:
+            sock_file.unlink(missing_ok=True)
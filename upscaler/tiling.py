@@ -0,0 +1,99 @@
+# upscaler/upscaler/tiling.py
+"""
+Tile geometry for tiled inference.
+
+Pure Python on purpose: the same plan is used by every array backend.
+Each tile has a *core* region (written to the output, tiles' cores partition the
+frame) and a fixed-size *window* around it (what the model actually sees), so the
+overlap gives every core pixel `tile_pad` pixels of context and the stitched output
+has no seams. Windows of one frame all have the same size, which lets tiles from
+many frames of the same resolution share a batch.
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Tile:
+    # Core region in input pixels: [y0, y1) x [x0, x1).
+    y0: int
+    y1: int
+    x0: int
+    x1: int
+    # Window fed to the model, in input pixels: [wy0, wy1) x [wx0, wx1).
+    wy0: int
+    wy1: int
+    wx0: int
+    wx1: int
+
+
+def _axis_spans(length: int, tile_size: int, tile_pad: int, multiple: int = 1) -> list[tuple[int, int, int, int]]:
+    m = max(1, multiple)
+    win = min(length, -(-(tile_size + 2 * tile_pad) // m) * m)
+    spans = []
+    for c0 in range(0, length, tile_size):
+        c1 = min(c0 + tile_size, length)
+        w0 = max(0, min(c0 - tile_pad, length - win))
+        spans.append((c0, c1, w0, w0 + win))
+    return spans
+
+
+def plan_tiles(height: int, width: int, tile_size: int, tile_pad: int, multiple: int = 1) -> list[Tile]:
+    """
+    Split a `height`x`width` frame into overlapping tiles (row-major order).
+    Window sides are rounded up to `multiple` (what the model needs), so on a
+    frame padded to that multiple every window is aligned.
+    """
+    if tile_size <= 0:
+        raise ValueError(f"tile_size must be positive, got {tile_size}")
+    tile_pad = max(0, tile_pad)
+
+    tiles = []
+    for y0, y1, wy0, wy1 in _axis_spans(height, tile_size, tile_pad, multiple):
+        for x0, x1, wx0, wx1 in _axis_spans(width, tile_size, tile_pad, multiple):
+            tiles.append(Tile(y0, y1, x0, x1, wy0, wy1, wx0, wx1))
+    return tiles
+
+
+# Rough peak activation footprint of RRDBNet per *input* pixel, in elements:
+# dense blocks concatenate up to 64 + 4*32 channels at input resolution, the
+# upsampling tail holds 64 channels at output resolution.
+_RRDB_ELEMS_PER_PIXEL = 192 + 64
+
+
+def auto_tile_size(
+        available_bytes: int,
+        scale: int,
+        bytes_per_elem: int = 4,
+        tile_pad: int = 10,
+        budget_fraction: float = 0.5,
+        multiple: int = 32,
+        min_tile: int = 64,
+        max_tile: int = 1024,
+) -> int:
+    """
+    Largest square tile whose estimated activation memory fits in
+    `budget_fraction` of `available_bytes`, rounded down to `multiple`.
+    """
+    per_pixel = (_RRDB_ELEMS_PER_PIXEL + 64 * scale * scale) * bytes_per_elem
+    budget = max(0, int(available_bytes * budget_fraction))
+    side = int((budget / per_pixel) ** 0.5) - 2 * tile_pad
+    side -= side % multiple
+    return max(min_tile, min(max_tile, side))
+
+
+def host_available_memory() -> int:
+    """Best-effort available host memory in bytes (MemAvailable, else free pages, else 2 GiB)."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except Exception:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return 2 * 1024 ** 3
@@ -0,0 +1,301 @@
+# upscaler/upscaler/torch_cpu.py
+"""
+CPU execution modes for the torch backend.
+
+On CUDA the torch backend runs fp16 with cuDNN autotuning; on CPU it would run
+plain fp32 eager. A CPU mode is a `+`-joined list of options:
+
+    fp32             plain eager float32 (the reference)
+    channels_last    NHWC memory format (oneDNN convolutions skip layout reorders)
+    bf16             bfloat16 autocast; only where the CPU has native bf16
+                     (AVX512-BF16 / AMX), otherwise ignored with a warning
+    int8             static int8 quantization (FX graph mode, x86 backend) of the
+                     RRDB trunk (~90% of the FLOPs); the first convolution and the
+                     upsampling tail stay float. Dynamic quantization only covers
+                     Linear/RNN layers, so it does nothing for this all-conv network.
+    compile          torch.compile (inductor; needs a C++ compiler, eager otherwise)
+    threads=N        intra-op threads (torch.set_num_threads)
+    interop=N        inter-op threads (torch.set_num_interop_threads; must be set
+                     before any parallel work, so first use in a process wins)
+
+e.g. "channels_last+bf16+threads=8". The default comes from UPSCALER_TORCH_CPU_MODE.
+int8 is calibrated on the first frames of the job that loads it (synthetic frames
+when none are given); the prepared model is cached per mode in MODEL_CACHE.
+
+`evaluate_cpu_modes` measures throughput and PSNR of each mode against fp32 eager
+and `pick_cpu_mode` returns the fastest mode within a PSNR limit
+(`upscaler bench --cpu-modes`).
+"""
+from __future__ import annotations
+
+import copy
+import math
+import os
+import time
+import warnings
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+import torch
+from rich.console import Console
+
+console = Console()
+
+CPU_OPTIONS = ("fp32", "channels_last", "bf16", "int8", "compile")
+DEFAULT_CPU_MODES = ("fp32", "channels_last", "channels_last+bf16", "channels_last+int8", "channels_last+compile")
+DEFAULT_MIN_PSNR = 40.0
+# Calibration frames for int8 and the crop they are cut to (activation ranges, not content, matter).
+CALIBRATION_FRAMES = 4
+CALIBRATION_CROP = 128
+
+
+@dataclass(frozen=True)
+class CpuMode:
+    channels_last: bool = False
+    bf16: bool = False
+    int8: bool = False
+    compile: bool = False
+    threads: Optional[int] = None
+    interop_threads: Optional[int] = None
+
+    @property
+    def key(self) -> str:
+        """Model-cache tag: the options that change the prepared model (not thread counts)."""
+        parts = [name for name in CPU_OPTIONS[1:] if getattr(self, name)]
+        return "+".join(parts) or "fp32"
+
+    def __str__(self) -> str:
+        parts = [self.key]
+        if self.threads:
+            parts.append(f"threads={self.threads}")
+        if self.interop_threads:
+            parts.append(f"interop={self.interop_threads}")
+        return "+".join(parts)
+
+
+def parse_cpu_mode(mode: Optional[str]) -> CpuMode:
+    """Parse "channels_last+bf16+threads=8" (None: UPSCALER_TORCH_CPU_MODE, else fp32)."""
+    mode = mode if mode is not None else os.environ.get("UPSCALER_TORCH_CPU_MODE", "fp32")
+    flags: dict = {}
+    for part in (p.strip().lower().replace("-", "_") for p in mode.split("+")):
+        if not part or part == "fp32":
+            continue
+        name, eq, value = part.partition("=")
+        if eq and name in ("threads", "interop"):
+            try:
+                flags["threads" if name == "threads" else "interop_threads"] = int(value)
+            except ValueError:
+                raise ValueError(f"CPU mode {mode!r}: {name} expects an integer, got {value!r}") from None
+        elif not eq and name in CPU_OPTIONS:
+            flags[name] = True
+        else:
+            raise ValueError(
+                f"Unknown CPU mode option {part!r} in {mode!r} "
+                f"(expected {', '.join(CPU_OPTIONS)}, threads=N, interop=N)"
+            )
+    return CpuMode(**flags)
+
+
+def bf16_supported() -> bool:
+    """Native bf16 matmul/conv on this CPU (emulated bf16 is slower than fp32)."""
+    try:
+        return bool(torch.cpu._is_avx512_bf16_supported() or torch.cpu._is_amx_tile_supported())
+    except AttributeError:
+        return False
+
+
+def apply_threads(mode: CpuMode) -> None:
+    if mode.threads:
+        torch.set_num_threads(mode.threads)
+    if mode.interop_threads and torch.get_num_interop_threads() != mode.interop_threads:
+        try:
+            torch.set_num_interop_threads(mode.interop_threads)
+        except RuntimeError as e:
+            console.print(f"[yellow][upscaler] inter-op threads already fixed for this process ({e})[/yellow]")
+
+
+class _CpuModel(torch.nn.Module):
+    """Applies the input memory format and bf16 autocast around the wrapped network."""
+
+    def __init__(self, model: torch.nn.Module, channels_last: bool, bf16: bool):
+        super().__init__()
+        self.model = model
+        self.channels_last = channels_last
+        self.bf16 = bf16
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        if self.bf16:
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                return self.model(x).float()
+        return self.model(x)
+
+
+def _normalize(img: torch.Tensor) -> torch.Tensor:
+    # Same normalization as realesrgan_torch._to_input_tensor.
+    return img.float().div(255.0).sub(0.5).div(0.5).unsqueeze(0)
+
+
+def synthetic_frames(n: int = CALIBRATION_FRAMES, size: int = CALIBRATION_CROP) -> list[torch.Tensor]:
+    """Deterministic uint8 CHW frames with gradients, edges and noise."""
+    g = torch.Generator().manual_seed(0)
+    ys, xs = torch.meshgrid(torch.linspace(0, 1, size), torch.linspace(0, 1, size), indexing="ij")
+    frames = []
+    for k in range(n):
+        base = torch.stack([xs, ys, (xs + ys) / 2]) * (0.4 + 0.15 * k)
+        stripes = (torch.sin(xs * (8 + 6 * k) * math.pi) > 0).float() * 0.3
+        noise = torch.rand((3, size, size), generator=g) * 0.2
+        frames.append((base + stripes + noise).clamp(0, 1).mul(255).to(torch.uint8))
+    return frames
+
+
+def _center_crop(img: torch.Tensor, size: int) -> torch.Tensor:
+    h, w = img.shape[-2:]
+    y, x = max(0, (h - size) // 2), max(0, (w - size) // 2)
+    return img[..., y : y + size, x : x + size]
+
+
+def _quantize_trunk(model: torch.nn.Module, calibration: Sequence[torch.Tensor]) -> None:
+    """Static int8 quantization of `model.body` in place, calibrated by running the whole network."""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = "x86"
+    inputs = [_normalize(_center_crop(img, CALIBRATION_CROP)) for img in calibration]
+    # The trunk sees features (after pixel-unshuffle and conv_first), not images.
+    seen: list[torch.Tensor] = []
+    hook = model.body.register_forward_pre_hook(lambda _m, args: seen.append(args[0]))
+    try:
+        with torch.no_grad():
+            model(inputs[0])
+    finally:
+        hook.remove()
+    with warnings.catch_warnings():
+        # torch.ao.quantization deprecation notices; the API is still the supported one for eager CPU.
+        warnings.simplefilter("ignore")
+        model.body = prepare_fx(model.body, get_default_qconfig_mapping("x86"), (seen[0],))
+        with torch.no_grad():
+            for x in inputs:
+                model(x)
+        model.body = convert_fx(model.body)
+
+
+def prepare_cpu_model(
+        model: torch.nn.Module,
+        mode: CpuMode,
+        calibration: Optional[Sequence[torch.Tensor]] = None,
+) -> torch.nn.Module:
+    """
+    A copy of the fp32 `model` prepared for `mode` (the input model is left
+    untouched: it may be shared through MODEL_CACHE). `calibration` are uint8
+    CHW frames for int8.
+    """
+    apply_threads(mode)
+    if mode.key == "fp32":
+        return model
+
+    bf16 = mode.bf16
+    if bf16 and not bf16_supported():
+        console.print("[yellow][upscaler] CPU has no native bf16; running the bf16 mode in fp32.[/yellow]")
+        bf16 = False
+
+    net = copy.deepcopy(model).eval()
+    if mode.int8:
+        try:
+            _quantize_trunk(net, calibration or synthetic_frames())
+        except Exception as e:
+            console.print(f"[yellow][upscaler] int8 quantization failed ({e}); keeping the float trunk.[/yellow]")
+            net = copy.deepcopy(model).eval()
+    if mode.channels_last:
+        net = net.to(memory_format=torch.channels_last)
+
+    prepared: torch.nn.Module = _CpuModel(net, mode.channels_last, bf16).eval()
+    if mode.compile:
+        compiled = torch.compile(prepared)
+        try:
+            # Compilation is lazy: surface a missing compiler now, not mid-job.
+            with torch.inference_mode():
+                compiled(torch.zeros(1, 3, 32, 32))
+            prepared = compiled
+        except Exception as e:
+            console.print(f"[yellow][upscaler] torch.compile unavailable ({e}); running eager.[/yellow]")
+    return prepared
+
+
+def psnr(a: torch.Tensor, b: torch.Tensor) -> float:
+    """PSNR in dB of two float tensors in [0, 1], capped at 100 dB (identical; keeps reports valid JSON)."""
+    mse = torch.mean((a.float() - b.float()) ** 2).item()
+    return 100.0 if mse <= 1e-10 else 10 * math.log10(1.0 / mse)
+
+
+@dataclass
+class CpuModeResult:
+    mode: str
+    seconds: float = 0.0
+    fps: float = 0.0
+    speedup: float = 0.0
+    psnr_db: Optional[float] = None
+    error: Optional[str] = None
+
+
+def evaluate_cpu_modes(
+        model_name: str = "realesrgan-x4plus",
+        modes: Sequence[str] = DEFAULT_CPU_MODES,
+        frames: Optional[Sequence[Path]] = None,
+        size: int = 64,
+        runs: int = 3,
+        on_result: Optional[Callable[[CpuModeResult], None]] = None,
+) -> list[CpuModeResult]:
+    """
+    Throughput and PSNR of each CPU mode against fp32 eager on the same frames:
+    `frames` (center crops of `size`) or synthetic ones. Each mode is warmed up
+    once (compilation, oneDNN primitive caches), then the best of `runs` is kept.
+    """
+    from .config import MODEL_SCALES
+    from .realesrgan_torch import _read_frame, load_realesrgan_model
+
+    imgs = [_center_crop(_read_frame(Path(p)), size) for p in frames] if frames else synthetic_frames(size=size)
+    inputs = torch.cat([_normalize(img) for img in imgs])
+    default_threads = torch.get_num_threads()
+    base = load_realesrgan_model(model_name, MODEL_SCALES.get(model_name, 4), "cpu")
+
+    def timed(net: torch.nn.Module) -> tuple[float, torch.Tensor]:
+        with torch.inference_mode():
+            out = net(inputs)
+            best = math.inf
+            for _ in range(max(1, runs)):
+                t0 = time.perf_counter()
+                out = net(inputs)
+                best = min(best, time.perf_counter() - t0)
+        return best, out.float().mul(0.5).add(0.5).clamp(0, 1)
+
+    reference: Optional[torch.Tensor] = None
+    ref_seconds = 0.0
+    results = []
+    for spec in ["fp32", *[m for m in modes if m != "fp32"]]:
+        result = CpuModeResult(spec)
+        try:
+            mode = parse_cpu_mode(spec)
+            seconds, out = timed(prepare_cpu_model(base, mode, imgs))
+            if reference is None:
+                reference, ref_seconds = out, seconds
+            result.seconds = seconds
+            result.fps = len(imgs) / seconds
+            result.speedup = ref_seconds / seconds
+            result.psnr_db = psnr(out, reference)
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+    # A mode may have changed the thread count; restore it for the rest of the process.
+    torch.set_num_threads(default_threads)
+    return results
+
+
+def pick_cpu_mode(results: Sequence[CpuModeResult], min_psnr: float = DEFAULT_MIN_PSNR) -> str:
+    """The fastest evaluated mode whose PSNR against fp32 is at least `min_psnr` dB."""
+    ok = [r for r in results if r.error is None and r.psnr_db is not None and r.psnr_db >= min_psnr]
+    return max(ok, key=lambda r: r.fps).mode if ok else "fp32"